@@ -0,0 +1,114 @@
+import argparse
+import io
+import json
+import time
+import tracemalloc
+import pyarrow as pa
+from sqlalchemy import create_engine, text
+from classes.DataBase import PSQLDataBase
+from classes.PortfolioPanel import PANEL_COLUMNS
+from benchmarks.synthetic import make_portfolio_data
+
+"""
+Script usage (from /backend): python3 -m benchmarks.bench_fetch <db url> [--tickers N] [--months M]
+
+Compares the pd.read_sql fetch path with the COPY bulk path (with and without
+column projection) on a synthetic panel. The panel is written to a scratch
+table, bench_portfolio_data, which is dropped again afterwards.
+"""
+
+TABLE = 'bench_portfolio_data'
+
+DDL = f"""
+CREATE TABLE {TABLE} (
+    date date,
+    ticker text,
+    price double precision,
+    volume bigint,
+    "EVEBIT" double precision,
+    "EVEBITDA" double precision,
+    "MOMENTUM" double precision,
+    "PB" double precision,
+    "PE" double precision,
+    "PS" double precision,
+    sector text,
+    index_weight double precision,
+    index text,
+    return double precision,
+    t_plus_3_return double precision,
+    estimated_vol double precision
+);
+"""
+
+def load_table(engine, data) -> None:
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS {TABLE}'))
+        conn.execute(text(DDL))
+
+    buffer = io.StringIO()
+    data.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            columns = ", ".join(f'"{c}"' for c in data.columns)
+            cur.copy_expert(f"COPY {TABLE} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        raw.commit()
+    finally:
+        raw.close()
+
+def time_fetch(db, start_date, end_date, columns, repeat) -> dict:
+    timings = []
+    tracemalloc.start()
+    arrow_before = pa.total_allocated_bytes()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = db.fetch_between_dates(TABLE, start_date, end_date, None, columns)
+        timings.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'rows': len(data),
+        'columns': len(data.columns),
+        'best_s': min(timings),
+        'mean_s': sum(timings) / len(timings),
+        'python_peak_mb': peak / 1e6,
+        'arrow_mb': (pa.total_allocated_bytes() - arrow_before) / 1e6,
+        'frame_mb': data.memory_usage(deep=True).sum() / 1e6
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('db_url')
+    parser.add_argument('--tickers', type=int, default=3000)
+    parser.add_argument('--months', type=int, default=240)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_portfolio_data(args.tickers, args.months)
+    start_date, end_date = data['date'].min(), data['date'].max()
+
+    engine = create_engine(args.db_url)
+    load_table(engine, data)
+
+    # caching is switched off so every call really goes to the database
+    read_sql_db = PSQLDataBase(args.db_url, cached_tables=(), bulk_fetch=False)
+    copy_db = PSQLDataBase(args.db_url, cached_tables=(), bulk_fetch=True)
+    projection = PANEL_COLUMNS + ['PE', 'PB', 'MOMENTUM']
+
+    cases = [
+        ('read_sql', read_sql_db, None),
+        ('copy', copy_db, None),
+        ('read_sql_projected', read_sql_db, projection),
+        ('copy_projected', copy_db, projection),
+    ]
+
+    try:
+        for name, db, columns in cases:
+            result = time_fetch(db, start_date, end_date, columns, args.repeat)
+            print(json.dumps({'benchmark': 'fetch_between_dates', 'mode': name, **result}))
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {TABLE}'))
@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from classes.AlphaModel import AlphaModel
+from classes.BackTest import BackTest
+from classes.DataBase import PSQLDataBase
+from classes.ParquetDataSource import ParquetDataSource
+from classes.PortfolioPanel import PANEL_COLUMNS
+from benchmarks.synthetic import make_portfolio_data, InMemoryDataBase, FACTORS
+
+"""
+Script usage (from /backend): python3 -m benchmarks.bench_suite [--scales small,medium] [--backends memory,sqlite,parquet] [--repeat 3] [--output results.json] [--compare baseline.json]
+
+Times the backend's hot paths (fetch_between_dates, BackTest.backtest,
+AlphaModel.get_weights_on_date and get_weights_between_dates) on seeded
+synthetic panels at several scales, without the real dumps or a running
+postgres. The panel is served in-process (memory), from a scratch SQLite
+file through PSQLDataBase (sqlite, with its cache switched off so every call
+really reads the data) or from a scratch parquet file through
+ParquetDataSource (parquet).
+
+Each benchmark is run once to warm up, timed over --repeat runs, then run
+once more under tracemalloc for its peak python memory (tracemalloc slows
+things down, so it is kept out of the timings). Results are written as one
+JSON document; --compare prints the change against an earlier one.
+For postgres fetch timings see bench_fetch.py.
+"""
+
+SCALES = {
+    'small': {'n_tickers': 500, 'n_months': 60},
+    'medium': {'n_tickers': 1500, 'n_months': 120},
+    'large': {'n_tickers': 3000, 'n_months': 240}
+}
+
+LOOKBACK = 24
+OVERLAY_WEIGHT = 0.6
+TRANSACTION_COSTS = 0.001
+
+def make_database(backend: str, data: pd.DataFrame, scratch_dir: str):
+    if backend == 'memory':
+        return InMemoryDataBase({'portfolio_data': data})
+
+    if backend == 'sqlite':
+        db_url = f"sqlite:///{os.path.join(scratch_dir, 'portfolio_data.db')}"
+        engine = create_engine(db_url)
+        # sqlite has no date type, so dates are stored as iso strings,
+        # which still compare in date order
+        data.assign(date=data['date'].astype(str)).to_sql('portfolio_data', engine, index=False, if_exists='replace')
+        engine.dispose()
+        return PSQLDataBase(db_url, cached_tables=())
+
+    if backend == 'parquet':
+        # sorted by date with several row groups, like a dump would be, so
+        # the date filter can skip row groups
+        data.to_parquet(os.path.join(scratch_dir, 'portfolio_data.parquet'), index=False, row_group_size=50_000)
+        return ParquetDataSource(scratch_dir)
+
+    raise ValueError(f'Unknown backend: {backend}')
+
+def hot_paths(db, months: list, factors: list[str]) -> dict:
+    # one callable per benchmark, over the whole synthetic range
+    start_date, end_date = months[0].isoformat(), months[-1].isoformat()
+    range_start = months[-12].isoformat()
+
+    return {
+        'fetch_between_dates': lambda: db.fetch_between_dates(
+            'portfolio_data', start_date, end_date, None, PANEL_COLUMNS + factors
+        ),
+        'backtest': lambda: BackTest(
+            start_date, end_date, LOOKBACK, factors, OVERLAY_WEIGHT, TRANSACTION_COSTS, db
+        ).backtest(),
+        'weights_on_date': lambda: AlphaModel.get_weights_on_date(
+            end_date, LOOKBACK, OVERLAY_WEIGHT, factors, db
+        ),
+        'weights_range': lambda: AlphaModel.get_weights_between_dates(
+            range_start, end_date, LOOKBACK, OVERLAY_WEIGHT, factors, db
+        )
+    }
+
+def measure(fn, repeat: int) -> dict:
+    fn()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'best_s': min(timings),
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.mean(timings),
+        'python_peak_mb': peak / 1e6
+    }
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+def compare(results: list[dict], baseline: dict) -> None:
+    # best time and peak memory relative to the baseline run, for every
+    # benchmark both runs have
+    key = lambda r: (r['benchmark'], r['backend'], r['scale'])
+    previous = {key(r): r for r in baseline['results']}
+    print(f"Compared with {baseline['environment'].get('commit')} ({baseline['environment'].get('created_at')}):")
+    for result in results:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        time_ratio = result['best_s'] / max(before['best_s'], 1e-12)
+        memory_ratio = result['python_peak_mb'] / max(before['python_peak_mb'], 1e-12)
+        print(
+            f"  {result['benchmark']:<20} {result['backend']:<7} {result['scale']:<7} "
+            f"time {before['best_s']:.4f}s -> {result['best_s']:.4f}s ({time_ratio:.2f}x), "
+            f"peak {before['python_peak_mb']:.1f}MB -> {result['python_peak_mb']:.1f}MB ({memory_ratio:.2f}x)"
+        )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default='small,medium')
+    parser.add_argument('--backends', default='memory,sqlite,parquet')
+    parser.add_argument('--benchmarks', default=None, help='comma separated subset, default all')
+    parser.add_argument('--factors', default=','.join(FACTORS))
+    parser.add_argument('--sectors', type=int, default=11)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None)
+    args = parser.parse_args()
+
+    factors = args.factors.split(',')
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for scale in args.scales.split(','):
+            data = make_portfolio_data(
+                **SCALES[scale],
+                factors=factors,
+                n_sectors=args.sectors,
+                seed=args.seed
+            )
+            months = sorted(data['date'].unique())
+
+            for backend in args.backends.split(','):
+                db = make_database(backend, data, scratch_dir)
+                benchmarks = hot_paths(db, months, factors)
+                names = args.benchmarks.split(',') if args.benchmarks else list(benchmarks)
+
+                for name in names:
+                    timings = measure(benchmarks[name], args.repeat)
+                    result = {
+                        'benchmark': name,
+                        'backend': backend,
+                        'scale': scale,
+                        'tickers': SCALES[scale]['n_tickers'],
+                        'months': SCALES[scale]['n_months'],
+                        'rows': len(data),
+                        'factors': len(factors),
+                        'repeat': args.repeat,
+                        **timings
+                    }
+                    results.append(result)
+                    print(
+                        f"{name:<20} {backend:<7} {scale:<7} best {result['best_s']:.4f}s "
+                        f"median {result['median_s']:.4f}s peak {result['python_peak_mb']:.1f}MB",
+                        file=sys.stderr
+                    )
+
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Wrote {len(results)} results to {args.output}')
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
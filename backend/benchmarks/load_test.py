@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import json
+import time
+import httpx
+import numpy as np
+
+"""
+Script usage (from /backend): python3 -m benchmarks.load_test [--url http://localhost:8000] [--endpoint weights] [--body '{"date": "2012-06-30"}']
+
+Fires requests at a running backend (uvicorn main:app) from an increasing
+number of concurrent clients and reports throughput and latency for each
+level, one JSON line per level.
+"""
+
+ENDPOINTS = {
+    'weights': ('/v1/model/weights_on_date', {
+        'date': '2015-06-30',
+        'factors': ['EVEBIT', 'EVEBITDA', 'MOMENTUM', 'PB', 'PE', 'PS'],
+        'overlay_weight': 0.6,
+        'lookback': 24
+    }),
+    'backtest': ('/v1/backtest/backtest_between_dates', {
+        'start_date': '2010-01-31',
+        'end_date': '2015-12-31',
+        'lookback': 24,
+        'factors': ['EVEBIT', 'EVEBITDA', 'MOMENTUM', 'PB', 'PE', 'PS'],
+        'overlay_weight': 0.6,
+        'transaction_costs': 0.001
+    }),
+    'pull': ('/v1/data/pull_between_dates', {
+        'table_name': 'portfolio_data',
+        'start_date': '2015-01-01',
+        'end_date': '2015-03-31',
+        'tickers': None
+    }),
+}
+
+async def client(http, path, body, n_requests, latencies, errors):
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        response = await http.post(path, json=body)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+async def run_level(url, path, body, concurrency, requests_per_client) -> dict:
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=600, limits=limits) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            client(http, path, body, requests_per_client, latencies, errors)
+            for _ in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'elapsed_s': elapsed,
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)) * 1e3,
+        'p95_ms': float(np.percentile(latencies, 95)) * 1e3
+    }
+
+async def main(args) -> None:
+    path, body = ENDPOINTS[args.endpoint]
+    body = {**body, **json.loads(args.body)}
+
+    # warm caches once so every level measures the same steady state
+    async with httpx.AsyncClient(base_url=args.url, timeout=600) as http:
+        await http.post(path, json=body)
+
+    for concurrency in args.concurrency:
+        result = await run_level(args.url, path, body, concurrency, args.requests)
+        print(json.dumps({'benchmark': 'load_test', 'endpoint': path, **result}))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--endpoint', choices=list(ENDPOINTS), default='weights')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--requests', type=int, default=20, help='requests per client')
+    parser.add_argument('--body', default='{}', help='JSON fields to override in the request body')
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
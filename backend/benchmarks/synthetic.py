@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from classes.BoundsCache import TableMetadata
+from classes.DataSource import DataSource
+
+"""
+Seeded synthetic data with the same schema as the portfolio_data table, so
+the hot paths can be exercised without the real dumps, and an in-process
+stand-in for the database to serve it from.
+"""
+
+FACTORS = ['EVEBIT', 'EVEBITDA', 'MOMENTUM', 'PB', 'PE', 'PS']
+SECTORS = [
+    'Communication Services', 'Consumer Discretionary', 'Consumer Staples',
+    'Energy', 'Financials', 'Health Care', 'Industrials', 'Information Technology',
+    'Materials', 'Real Estate', 'Utilities'
+]
+
+def make_portfolio_data(
+    n_tickers: int = 3000,
+    n_months: int = 240,
+    factors: list[str] = FACTORS,
+    n_sectors: int = len(SECTORS),
+    universe_fraction: float = 0.9,
+    start_date: str = '2000-01-31',
+    seed: int = 0
+) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+
+    # each month a random ~universe_fraction of tickers is in the index,
+    # so the universe is ragged the same way the real one is
+    months = pd.date_range(start_date, periods=n_months, freq='ME').date
+    in_universe = rng.random((n_months, n_tickers)) < universe_fraction
+    month_idx, ticker_idx = np.nonzero(in_universe)
+    n = len(month_idx)
+
+    sector_names = np.array((SECTORS * (n_sectors // len(SECTORS) + 1))[:n_sectors], dtype=object)
+    ticker_sector = rng.integers(0, n_sectors, n_tickers)
+    ticker_names = np.array([f'TCK{t:05d}' for t in range(n_tickers)], dtype=object)
+
+    # index weights are market-cap style and sum to one each month
+    caps = rng.lognormal(mean=0.0, sigma=1.5, size=n)
+    month_caps = np.bincount(month_idx, weights=caps, minlength=n_months)
+
+    # returns load weakly on the factors, so the alpha model has something to find
+    scores = rng.standard_normal((n, len(factors)))
+    loadings = rng.normal(0.0, 0.005, len(factors))
+    t_plus_3_return = scores @ loadings + rng.normal(0.02, 0.12, n)
+
+    data = pd.DataFrame({
+        'date': months[month_idx],
+        'ticker': ticker_names[ticker_idx],
+        'price': rng.uniform(5.0, 500.0, n),
+        'volume': rng.integers(10_000, 10_000_000, n),
+    })
+    for i, factor in enumerate(factors):
+        data[factor] = scores[:, i]
+    data['sector'] = sector_names[ticker_sector[ticker_idx]]
+    data['index_weight'] = caps / month_caps[month_idx]
+    data['index'] = 'SP500'
+    data['return'] = t_plus_3_return / 3 + rng.normal(0.0, 0.03, n)
+    data['t_plus_3_return'] = t_plus_3_return
+    data['estimated_vol'] = rng.uniform(0.15, 0.6, n)
+
+    return data
+
+class InMemoryDataBase(DataSource):
+    # a DataSource with the tables held in memory, so the backtest and
+    # alpha model can run in-process. there are no precomputed month stats,
+    # so models are always fitted from the raw rows.
+    def __init__(self, tables: dict[str, pd.DataFrame]) -> None:
+        self.tables = {}
+        self.metadata = {}
+        for name, data in tables.items():
+            data = data.sort_values('date', kind='stable').reset_index(drop=True)
+            dates = pd.to_datetime(data['date']).to_numpy().astype('datetime64[D]')
+            months, counts = np.unique(dates, return_counts=True)
+            self.tables[name] = (data, dates)
+            self.metadata[name] = TableMetadata.from_date_counts(
+                pd.DataFrame({'date': months, 'n': counts}),
+                data.columns.tolist()
+            )
+
+    def table_metadata(self, table: str) -> TableMetadata:
+        return self.metadata[table]
+
+    def fetch_between_dates(
+        self,
+        table_name: str,
+        start_date: str | None,
+        end_date: str | None,
+        tickers: str | None,
+        columns: list[str] | None = None
+    ) -> pd.DataFrame:
+        # rows are sorted by date, so a date range is one slice
+        data, dates = self.tables[table_name]
+        first = 0 if start_date is None else np.searchsorted(dates, np.datetime64(pd.to_datetime(start_date).date(), 'D'), side='left')
+        last = len(dates) if end_date is None else np.searchsorted(dates, np.datetime64(pd.to_datetime(end_date).date(), 'D'), side='right')
+
+        data = data.iloc[first:last]
+        if tickers:
+            data = data[data['ticker'].isin(tickers)]
+        if columns is not None:
+            data = data[columns]
+        return data.reset_index(drop=True)
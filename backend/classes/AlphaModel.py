@@ -1,9 +1,14 @@
 import pandas as pd
-from .DataBase import PSQLDataBase
-from .Responses import WeightsResponse
+from .DataSource import DataSource
+from .Responses import WeightsResponse, DatedWeightsResponse
 from fastapi import HTTPException
 from dataclasses import dataclass
-from sklearn.linear_model import Ridge
+from .PortfolioPanel import PortfolioPanel, PanelView, PANEL_COLUMNS
+from .RidgeSolver import RidgeStats, RidgeFit, RollingRidge
+from .PortfolioConstruction import construct_weights
+from .BackTest import month_ridge_stats
+from .SectorExposure import SectorExposure
+from .Instrumentation import metrics
 import numpy as np
 
 @dataclass
@@ -11,18 +16,73 @@ class WeightResponse:
     weights: dict
     sector_breakdown: dict
 
+def training_window(date, lookback: int) -> tuple[pd.Timestamp, pd.Timestamp, pd.Timestamp]:
+    # ensure the date is the end of the month
+    date_pd = pd.to_datetime(date)
+    end_of_month_date = date_pd + pd.offsets.MonthEnd(0)
+
+    tr_end = end_of_month_date - pd.DateOffset(months=4) + pd.offsets.MonthEnd(0)
+    tr_start = tr_end - pd.DateOffset(months=lookback+4) + pd.offsets.MonthEnd(0)
+    # above, we + 4 to lookback to have three extra months to lookback for the
+    # forward +3 months lookahead bias
+    return end_of_month_date, tr_start, tr_end
+
+def no_training_data(month, tr_start, tr_end) -> HTTPException:
+    # a month whose training window holds no data has no model to give
+    # weights from
+    return HTTPException(
+        status_code=400,
+        detail=f'There is no training data for {pd.to_datetime(month).date()} '
+            f'between {pd.to_datetime(tr_start).date()} and {pd.to_datetime(tr_end).date()}.'
+    )
+
+def check_factors(factors: list[str], db: DataSource) -> None:
+    # check factors are valid and are contained in the portfolio data
+    table_columns = db.table_columns('portfolio_data')
+    missing_factors = [f for f in factors if f not in table_columns]
+    if missing_factors:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The following factors do not exist in portfolio_data: {missing_factors}"
+        )
+
+def month_weights(alpha_model: RidgeFit, pred_data: PanelView, overlay_weight: float) -> np.ndarray:
+    # get the predicted returns
+    pred_return = alpha_model.predict(pred_data.X)
+
+    # now get passive index weights plus the alpha overlay, through the
+    # same construction the backtest uses (as a single-month matrix)
+    portfolio_weights, _ = construct_weights(
+        pred_return,
+        pred_data.estimated_vol,
+        pred_data.index_weight,
+        overlay_weight
+    )
+    return portfolio_weights[0]
+
+def weights_response(
+    alpha_model: RidgeFit,
+    tickers: np.ndarray,
+    portfolio_weights: np.ndarray,
+    sector_weights: dict,
+    factors: list[str]
+) -> WeightsResponse:
+    coeff_dict = dict(zip(factors, np.round(alpha_model.coef_, 4)))
+
+    # Build a dictionary mapping tickers to their portfolio weights
+    portfolio_weights_dict = dict(zip(tickers.tolist(), portfolio_weights.tolist()))
+
+    return WeightsResponse(
+        portfolio_weights=portfolio_weights_dict,
+        model_coef=coeff_dict,
+        sector_weights=sector_weights
+    )
+
 class AlphaModel:
-    def get_weights_on_date(date: str, lookback: int, overlay_weight: float, factors: list[str], db: PSQLDataBase):
-        # ensure the date is the end of the month
-        date_pd = pd.to_datetime(date)
-        end_of_month_date = date_pd + pd.offsets.MonthEnd(0)
+    def get_weights_on_date(date: str, lookback: int, overlay_weight: float, factors: list[str], db: DataSource):
+        end_of_month_date, tr_start, tr_end = training_window(date, lookback)
 
         # now we have to check for validility of these dates
-        tr_end = end_of_month_date - pd.DateOffset(months=4) + pd.offsets.MonthEnd(0)
-        tr_start = tr_end - pd.DateOffset(months=lookback+4) + pd.offsets.MonthEnd(0)
-        # above, we + 4 to lookback to have three extra months to lookback for the 
-        # forward +3 months lookahead bias
-    
         date_validities, bounds = db.are_dates_valid('portfolio_data', [tr_start, tr_end, end_of_month_date])
 
         if False in date_validities:
@@ -31,66 +91,146 @@ class AlphaModel:
                 detail=f"One of the dates is out of bounds. "
                     f"Max date: {bounds.max_date}, Min date: {bounds.min_date}"
             )
-        
+
+        check_factors(factors, db)
+
+        # fit from the precomputed per-month factor statistics if they're
+        # there, so only the prediction month's rows have to be pulled
+        month_stats = db.fetch_month_stats(tr_start, tr_end, factors)
+        if month_stats is not None:
+            _, stats = month_stats
+            window = sum(stats, RidgeStats.empty(len(factors)))
+            if window.n == 0:
+                raise no_training_data(end_of_month_date, tr_start, tr_end)
+            alpha_model = window.solve(alpha=1.0)
+            fetch_start = end_of_month_date
+        else:
+            alpha_model = None
+            fetch_start = tr_start
+
         # fetch the required market data and split into training and testing
-        portfolio_data = db.fetch_between_dates('portfolio_data', tr_start, end_of_month_date, None)
+        portfolio_data = db.fetch_between_dates(
+            'portfolio_data',
+            fetch_start,
+            end_of_month_date,
+            None,
+            PANEL_COLUMNS + factors
+        )
+
+        # slice the training window and the prediction month out of the
+        # month-partitioned panel rather than masking the whole frame
+        with metrics.span('panel_build'):
+            panel = PortfolioPanel(portfolio_data, factors)
+        pred_data = panel.view(*panel.months_between(end_of_month_date, end_of_month_date))
 
-        # check factors are valid and are contained in the portfolio data
-        missing_factors = [f for f in factors if f not in portfolio_data.columns]
-        if missing_factors:
+        # train the model
+        if alpha_model is None:
+            with metrics.span('ridge_fits'):
+                tr_first, tr_last = panel.months_between(tr_start, tr_end)
+                tr_data = panel.view(tr_first, tr_last)
+                window = RidgeStats.from_arrays(tr_data.X, tr_data.t_plus_3_return)
+                # months with rows, but none complete enough to fit on,
+                # are no training data either
+                if window.n == 0:
+                    raise no_training_data(end_of_month_date, tr_start, tr_end)
+                alpha_model = window.solve(alpha=1.0)
+        metrics.count('ridge_fits')
+
+        with metrics.span('weight_construction'):
+            portfolio_weights = month_weights(alpha_model, pred_data, overlay_weight)
+            sector_weights = SectorExposure.from_codes(portfolio_weights, pred_data.sector_codes, pred_data.sector_vocab).month(0)
+
+        return weights_response(alpha_model, pred_data.tickers, portfolio_weights, sector_weights, factors)
+
+    def get_weights_between_dates(
+        start_date: str,
+        end_date: str,
+        lookback: int,
+        overlay_weight: float,
+        factors: list[str],
+        db: DataSource
+    ) -> list[DatedWeightsResponse]:
+        # get_weights_on_date for every month in [start_date, end_date], with
+        # one validity check, one fetch of the union of their windows, and
+        # training windows rolled from month to month instead of refitted
+        first_month, first_tr_start, _ = training_window(start_date, lookback)
+        last_month, _, last_tr_end = training_window(end_date, lookback)
+
+        if first_month > last_month:
             raise HTTPException(
                 status_code=400,
-                detail=f"The following factors do not exist in portfolio_data: {missing_factors}"
+                detail='The start date is after the end date.'
             )
 
+        date_validities, bounds = db.are_dates_valid('portfolio_data', [first_tr_start, first_month, last_month])
+        if False in date_validities:
+            raise HTTPException(
+                status_code=400,
+                detail=f"One of the dates is out of bounds. "
+                    f"Max date: {bounds.max_date}, Min date: {bounds.min_date}"
+            )
 
-        tr_data = portfolio_data[
-            (portfolio_data['date'] >= tr_start.date()) &
-            (portfolio_data['date'] <= tr_end.date())
-        ].copy()
-        pred_data = portfolio_data[portfolio_data['date'] == end_of_month_date.date()].copy()
-
-        # train the model
-        X_tr = tr_data[factors]
-        y_tr = tr_data['t_plus_3_return']
-
-        alpha_model = Ridge(alpha=1.0)
-        alpha_model.fit(X_tr, y_tr)
-
-        coeff_dict = dict(zip(factors, np.round(alpha_model.coef_, 4)))
-
-        # get the predicted returns
-        X_tst = pred_data[factors]
-        pred_data['pred_return'] = alpha_model.predict(X_tst)
-        
-        # now get passive index weights and alpha overlay
-        passive_weights = pred_data['index_weight']
-        inverse_vol = 1 / pred_data['estimated_vol']
-        raw_scores = pred_data['pred_return'] * inverse_vol 
-        centered_scores = raw_scores - raw_scores.mean()
-        alpha_weights = overlay_weight * centered_scores / centered_scores.abs().sum()
-
-        # now we can get the total weights
-        portfolio_weights = passive_weights + alpha_weights
-        pred_data['portfolio_weight'] = portfolio_weights
-        per_sector_breakdown = {
-            sector: {
-                "long": weights[weights > 0].sum(),
-                "short": weights[weights < 0].sum()
-            }
-            for sector, weights in pred_data.groupby("sector")["portfolio_weight"]
-        }
-
-        # Build a dictionary mapping tickers to their portfolio weights
-        portfolio_weights_dict = dict(zip(pred_data['ticker'], portfolio_weights))
-
-        return WeightsResponse(
-            portfolio_weights=portfolio_weights_dict,
-            model_coef=coeff_dict,
-            sector_weights=per_sector_breakdown
+        check_factors(factors, db)
+
+        # per-month statistics for every training month, precomputed if
+        # possible, in which case only the prediction months are pulled
+        month_stats = db.fetch_month_stats(first_tr_start, last_tr_end, factors)
+        portfolio_data = db.fetch_between_dates(
+            'portfolio_data',
+            first_month if month_stats is not None else first_tr_start,
+            last_month,
+            None,
+            PANEL_COLUMNS + factors
         )
+        with metrics.span('panel_build'):
+            panel = PortfolioPanel(portfolio_data, factors)
+
+        if month_stats is not None:
+            stat_months, stats = month_stats
+            stat_months = np.asarray(stat_months, dtype='datetime64[D]')
+        else:
+            with metrics.span('month_stats'):
+                stat_months, stats = panel.month_ends, month_ridge_stats(panel)
+
+        rolling_ridge = RollingRidge(stats, alpha=1.0)
+        first, last = panel.months_between(first_month, last_month)
+
+        alpha_models, weights = [], []
+        for i in range(first, last + 1):
+            _, tr_start, tr_end = training_window(panel.months[i], lookback)
+            tr_first = int(np.searchsorted(stat_months, np.datetime64(tr_start.date(), 'D'), side='left'))
+            tr_last = int(np.searchsorted(stat_months, np.datetime64(tr_end.date(), 'D'), side='right')) - 1
+
+            if tr_last < tr_first:
+                raise no_training_data(panel.months[i], tr_start, tr_end)
+            alpha_model = rolling_ridge.fit_window(tr_first, tr_last)
+            if rolling_ridge.window.n == 0:
+                raise no_training_data(panel.months[i], tr_start, tr_end)
+
+            alpha_models.append(alpha_model)
+            with metrics.span('weight_construction'):
+                weights.append(month_weights(alpha_model, panel.view(i), overlay_weight))
+        metrics.count('ridge_fits', len(alpha_models))
+
+        # sector breakdowns for every month in one pass
+        with metrics.span('sector_exposure'):
+            rows = panel.rows(first, last)
+            sector_exposure = SectorExposure.from_codes(
+                np.concatenate(weights) if weights else np.array([]),
+                panel.sector_codes[rows],
+                panel.sector_vocab,
+                panel.month_ids[rows] - first,
+                panel.months[first:last + 1]
+            )
 
-        
-        
-
-
+        responses = []
+        for m, i in enumerate(range(first, last + 1)):
+            response = weights_response(alpha_models[m], panel.view(i).tickers, weights[m], sector_exposure.month(m), factors)
+            responses.append(DatedWeightsResponse(
+                date=panel.months[i].isoformat(),
+                portfolio_weights=response.portfolio_weights,
+                model_coef=response.model_coef,
+                sector_weights=response.sector_weights
+            ))
+
+        return responses
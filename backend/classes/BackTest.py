@@ -1,11 +1,55 @@
 import pandas as pd
-from .DataBase import PSQLDataBase
+from .DataSource import DataSource
 from fastapi import HTTPException
-from sklearn.linear_model import Ridge
+from fastapi.concurrency import run_in_threadpool
+from .PortfolioPanel import PortfolioPanel, PANEL_COLUMNS
+from .RidgeSolver import RidgeStats, RollingRidge
+from .PortfolioConstruction import construct_weights
+from .WeightMatrix import WeightMatrix
+from .SectorExposure import SectorExposure
+from .ModelDiagnostics import ModelDiagnostics, month_diagnostics
+from .RollingAnalytics import rolling_analytics, rolling_frame, check_metrics
+from .Instrumentation import metrics
+from .CompactFrame import positions
+from .Encoding import records
 from collections import defaultdict
 from scipy.stats.mstats import zscore
 import numpy as np
 
+def month_ridge_stats(panel: PortfolioPanel, factor_idx: list[int] | None = None) -> list[RidgeStats]:
+    # reduce every month of the panel to its ridge sufficient statistics,
+    # so training windows can be rolled over them instead of refitting.
+    # factor_idx picks a subset of the panel's factors.
+    month_stats = []
+    for m in range(len(panel)):
+        month = panel.view(m)
+        X = month.X if factor_idx is None else month.X[:, factor_idx]
+        month_stats.append(RidgeStats.from_arrays(X, month.t_plus_3_return))
+    return month_stats
+
+def union_vocabulary(vocabularies: list[np.ndarray]) -> tuple[np.ndarray, list[np.ndarray]]:
+    # the sorted union of several vocabularies, and for each of them where
+    # its entries sit in the union
+    union = pd.Index(sorted(set().union(*vocabularies)), dtype=object)
+    return np.asarray(union, dtype=object), [positions(union, v) for v in vocabularies]
+
+def fitted_months(n_months: int, lookback: int) -> range:
+    # month indices with a full training window behind them, i.e. the
+    # months a backtest over n_months of data produces results for
+    return range(lookback + 4, n_months)
+
+def rolling_fits(month_stats: list[RidgeStats], lookback: int):
+    # yields (month index, fit) for every month that has a full training
+    # window behind it. the fit is the same as Ridge(alpha=1.0) over months
+    # [tr_start, tr_end].
+    rolling_ridge = RollingRidge(month_stats, alpha=1.0)
+    for i in fitted_months(len(month_stats), lookback):
+        # we start 4 months back, as the predictor in the
+        # training model is 3 month future returns.
+        tr_end = i - 4
+        tr_start = tr_end - lookback
+        yield i, rolling_ridge.fit_window(tr_start, tr_end)
+
 class BackTest:
     def __init__(
         self,
@@ -15,7 +59,7 @@ class BackTest:
         factors: list[str],
         overlay_weight: float, 
         transaction_costs: float,
-        db: PSQLDataBase
+        db: DataSource
     ):
         # first check if dates are valid
         date_validities, bounds = db.are_dates_valid('portfolio_data', [start_date, end_date])
@@ -34,99 +78,303 @@ class BackTest:
         self.transaction_costs = transaction_costs
         self.db = db
 
+        # rolling analytics per window, computed on first request
+        self.analytics_cache = {}
+
+    @classmethod
+    def from_results(
+        cls,
+        params: dict,
+        backtest_results: list[dict],
+        model_coefficients: list[dict],
+        portfolio_weights: WeightMatrix,
+        sector_exposure: SectorExposure | None = None,
+        diagnostics: ModelDiagnostics | None = None
+    ) -> 'BackTest':
+        # rebuild a finished backtest (e.g. from the backtest store) without
+        # a database, so the analytics methods can be served from it
+        backtest = cls.__new__(cls)
+        backtest.start_date = params['start_date']
+        backtest.end_date = params['end_date']
+        backtest.lookback = params['lookback']
+        backtest.factors = params['factors']
+        backtest.overlay_weight = params['overlay_weight']
+        backtest.transaction_costs = params['transaction_costs']
+        backtest.db = None
+        backtest.backtest_results = backtest_results
+        backtest.model_coefficients = model_coefficients
+        backtest.portfolio_weights = portfolio_weights
+        backtest.sector_exposure = sector_exposure
+        backtest.diagnostics = diagnostics
+        backtest.analytics_cache = {}
+        return backtest
+
+    def __getstate__(self) -> dict:
+        # backtests are sent to and from job worker processes; the data
+        # source holds connections and threads, so it stays behind
+        state = self.__dict__.copy()
+        state['db'] = None
+        return state
+
+    def params(self) -> dict:
+        return {
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'lookback': self.lookback,
+            'factors': self.factors,
+            'overlay_weight': self.overlay_weight,
+            'transaction_costs': self.transaction_costs
+        }
+
     def backtest(self) -> pd.DataFrame:
+        self.check_factors()
+
+        # only pull the columns the panel actually uses
         portfolio_data = self.db.fetch_between_dates(
             'portfolio_data',
             self.start_date,
             self.end_date,
-            None
-        ).sort_values(['date', 'ticker'])
+            None,
+            PANEL_COLUMNS + self.factors
+        )
+
+        return self.run_backtest(portfolio_data)
+
+    async def backtest_async(self) -> pd.DataFrame:
+        # same as backtest, but the fetch waits on the database executor and
+        # the model loop runs on the threadpool, so the event loop stays free
+        portfolio_data = await self.fetch_portfolio_data_async()
+        return await run_in_threadpool(self.run_backtest, portfolio_data)
+
+    async def fetch_portfolio_data_async(self) -> pd.DataFrame:
+        await run_in_threadpool(self.check_factors)
+        return await self.db.fetch_between_dates_async(
+            'portfolio_data',
+            self.start_date,
+            self.end_date,
+            None,
+            PANEL_COLUMNS + self.factors
+        )
 
-        # check factors are valid
-        missing_factors = [f for f in self.factors if f not in portfolio_data.columns]
+    def check_factors(self) -> None:
+        table_columns = self.db.table_columns('portfolio_data')
+        missing_factors = [f for f in self.factors if f not in table_columns]
         if missing_factors:
             raise HTTPException(
                 status_code=400,
                 detail=f"The following factors do not exist in portfolio_data: {missing_factors}"
             )
-        print(self.factors)
-        # Extract numpy arrays for fast operations
-        dates = portfolio_data["date"].to_numpy()
-        tickers = portfolio_data["ticker"].to_numpy()
-        factor_arrays = portfolio_data[self.factors].to_numpy()
-        t_plus_3_return = portfolio_data["t_plus_3_return"].to_numpy()
-        returns = portfolio_data["return"].to_numpy()
-        estimated_vol = portfolio_data["estimated_vol"].to_numpy()
-        index_weight = portfolio_data["index_weight"].to_numpy()
-
-        months = np.unique(dates)
-        start_idx = self.lookback + 4
+
+    def run_backtest(self, portfolio_data: pd.DataFrame) -> pd.DataFrame:
+        # build the month-partitioned panel once; every month (or range
+        # of months) below is a zero-copy slice into its column arrays
+        with metrics.span('panel_build'):
+            panel = PortfolioPanel(portfolio_data, self.factors)
+        months = panel.months
+        with metrics.span('month_stats'):
+            month_stats = month_ridge_stats(panel)
 
         self.backtest_results = []
-        self.portfolio_weights = []
-        self.alpha_models = {}
+        self.portfolio_weights = WeightMatrix.from_rows([], panel.universe, [])
+        self.sector_exposure = SectorExposure.from_weights([], [], [], [])
         self.model_coefficients = []
+        self.analytics_cache = {}
+
+        # the loop only fits the models and predicts; weights and returns
+        # for every month are then built in one go below. of the fits
+        # themselves only their out-of-sample diagnostics are kept.
+        pred_months = []
+        pred_returns = []
+        diagnostic_rows = []
+        with metrics.span('ridge_fits'):
+            for i, alpha_model in rolling_fits(month_stats, self.lookback):
+                # save model coefficients (z-scored)
+                zscored_coefs = zscore(alpha_model.coef_)
+                model_coeffs = dict(zip(self.factors, zscored_coefs))
+                model_coeffs['date'] = months[i]
+                self.model_coefficients.append(model_coeffs)
+
+                # prediction data is just this month's block of the panel
+                pred = panel.view(i)
+                pred_months.append(i)
+                pred_returns.append(alpha_model.predict(pred.X))
+                diagnostic_rows.append(month_diagnostics(alpha_model, pred_returns[-1], pred.t_plus_3_return))
+        metrics.count('ridge_fits', len(pred_months))
+        self.diagnostics = ModelDiagnostics.from_rows([months[i] for i in pred_months], self.factors, diagnostic_rows)
+
+        with metrics.span('weight_construction'):
+            if pred_months:
+                first, last = pred_months[0], pred_months[-1]
+                pred_matrix = panel.matrix(np.concatenate(pred_returns), first, last)
+                index_weight = panel.matrix(panel.index_weight, first, last)
+                returns = panel.matrix(panel.returns, first, last)
+
+                portfolio_weights, _ = construct_weights(
+                    pred_matrix,
+                    panel.matrix(panel.estimated_vol, first, last),
+                    index_weight,
+                    self.overlay_weight
+                )
+                portfolio_returns = np.nansum(portfolio_weights * returns, axis=1) - self.transaction_costs
+                passive_returns = np.nansum(index_weight * returns, axis=1)
+
+                # store portfolio weights as one compact (months x tickers) matrix
+                self.portfolio_weights = WeightMatrix.from_rows(
+                    [months[i] for i in pred_months],
+                    panel.universe,
+                    [portfolio_weights]
+                )
+
+                # and long/short exposure per sector through time, from the
+                # same weights laid back out per row
+                rows = panel.rows(first, last)
+                row_months = panel.month_ids[rows] - first
+                self.sector_exposure = SectorExposure.from_codes(
+                    portfolio_weights[row_months, panel.ticker_codes[rows]],
+                    panel.sector_codes[rows],
+                    panel.sector_vocab,
+                    row_months,
+                    self.portfolio_weights.dates
+                )
 
-        for i in range(start_idx, len(months)):
-            # we start 4 months back, as the predictor in the
-            # training model is 3 month future returns.
-            tr_end = i - 4
-            tr_start = tr_end - self.lookback
-
-            # mask for training data
-            mask_tr = (dates >= months[tr_start]) & (dates <= months[tr_end])
-            X_tr = factor_arrays[mask_tr]
-            y_tr = t_plus_3_return[mask_tr]
-
-            alpha_model = Ridge(alpha=1.0)
-            alpha_model.fit(X_tr, y_tr)
-
-            # save the actual model for the month
-            # this will be useful for historical goodness-of-fit
-            self.alpha_models[months[i]] = alpha_model
-
-            # save model coefficients (z-scored)
-            zscored_coefs = zscore(alpha_model.coef_)
-            model_coeffs = dict(zip(self.factors, zscored_coefs))
-            model_coeffs['date'] = months[i]
-            self.model_coefficients.append(model_coeffs)
-
-            # mask for prediction data
-            mask_pred = (dates == months[i])
-            X_pred = factor_arrays[mask_pred]
-            tickers_pred = tickers[mask_pred]
-            index_weight_pred = index_weight[mask_pred]
-            estimated_vol_pred = estimated_vol[mask_pred]
-            returns_pred = returns[mask_pred]
-
-            pred_return = alpha_model.predict(X_pred)
-
-            # now get portfolio weights (all np arrays)
-            passive_weights = index_weight_pred
-            inverse_vol = 1.0 / estimated_vol_pred
-            raw_scores = pred_return * inverse_vol
-            centered_scores = raw_scores - raw_scores.mean()
-            alpha_overlay = 0.6 * centered_scores / np.abs(centered_scores).sum()
-            portfolio_weights_arr = passive_weights + alpha_overlay
-
-            # Store portfolio weights as list of (ticker, weight)
-            self.portfolio_weights.append({
-                'date': months[i],
-                'portfolio_weights': list(zip(tickers_pred.tolist(), portfolio_weights_arr.tolist()))
-            })
-
-            # and get portfolio returns
-            self.backtest_results.append({
-                'date': months[i],
-                'portfolio_return': float(np.dot(portfolio_weights_arr, returns_pred)) - self.transaction_costs,
-                'passive_return': float(np.dot(passive_weights, returns_pred))
-            })
-
-        backtest_results = pd.DataFrame(self.backtest_results)
+                for row, i in enumerate(pred_months):
+                    # and get portfolio returns
+                    self.backtest_results.append({
+                        'date': months[i],
+                        'portfolio_return': float(portfolio_returns[row]),
+                        'passive_return': float(passive_returns[row])
+                    })
+
+        return self.results()
+
+    def iter_portfolio_data(self):
+        # the backtest's data in date order, pulled as iter_backtest gets to
+        # it: the months before the first fitted one in one go, as nothing
+        # can be yielded before they're all in, then one month at a time
+        metadata = self.db.table_metadata('portfolio_data')
+        start = np.datetime64(pd.to_datetime(self.start_date).date(), 'D')
+        end = np.datetime64(pd.to_datetime(self.end_date).date(), 'D')
+        months = metadata.months[(metadata.months >= start) & (metadata.months <= end)].astype(object)
+
+        first = self.lookback + 5
+        for chunk in [months[:first]] + [months[i:i + 1] for i in range(first, len(months))]:
+            if len(chunk):
+                yield self.db.fetch_between_dates(
+                    'portfolio_data',
+                    chunk[0],
+                    chunk[-1],
+                    None,
+                    PANEL_COLUMNS + self.factors
+                )
+
+    def iter_backtest(self, portfolio_data):
+        # streaming version of run_backtest: fits, weights and yields one
+        # month at a time, so callers see each month as soon as it's done.
+        # portfolio_data is an iterable of frames of whole months in date
+        # order, e.g. iter_portfolio_data, or a single frame in a list. of
+        # each month only its statistics and results are kept, not its rows.
+        # ends up with the same state (and numbers) as run_backtest.
+        months, month_stats = [], []
+        rolling_ridge = RollingRidge(month_stats, alpha=1.0)
+
+        self.backtest_results = []
+        self.model_coefficients = []
+        self.analytics_cache = {}
+
+        # tickers and sectors are codes into each frame's own vocabulary
+        # until the end, when they're mapped onto the union of them all
+        universes, sector_vocabs = [], []
+        weight_dates, weight_rows = [], []
+        diagnostic_rows = []
+        sector_weights, sector_codes = [], []
+        cum_portfolio, cum_passive = 1.0, 1.0
+        for data in portfolio_data:
+            with metrics.span('panel_build'):
+                panel = PortfolioPanel(data, self.factors)
+            universes.append(panel.universe)
+            sector_vocabs.append(panel.sector_vocab)
+
+            for m in range(len(panel)):
+                i = len(months)
+                pred = panel.view(m)
+                months.append(panel.months[m])
+                with metrics.span('month_stats'):
+                    month_stats.append(RidgeStats.from_arrays(pred.X, pred.t_plus_3_return))
+
+                # we start 4 months back, as the predictor in the
+                # training model is 3 month future returns.
+                if i < self.lookback + 4:
+                    continue
+                alpha_model = rolling_ridge.fit_window(i - 4 - self.lookback, i - 4)
+                metrics.count('ridge_fits')
+
+                zscored_coefs = zscore(alpha_model.coef_)
+                model_coeffs = dict(zip(self.factors, zscored_coefs))
+                model_coeffs['date'] = months[i]
+                self.model_coefficients.append(model_coeffs)
+
+                predicted = alpha_model.predict(pred.X)
+                diagnostic_rows.append(month_diagnostics(alpha_model, predicted, pred.t_plus_3_return))
+                portfolio_weights, _ = construct_weights(
+                    predicted,
+                    pred.estimated_vol,
+                    pred.index_weight,
+                    self.overlay_weight
+                )
+                portfolio_weights = portfolio_weights[0]
+                portfolio_return = float(np.dot(portfolio_weights, pred.returns)) - self.transaction_costs
+                passive_return = float(np.dot(pred.index_weight, pred.returns))
+
+                weight_dates.append(months[i])
+                weight_rows.append((len(universes) - 1, pred.ticker_codes, portfolio_weights))
+                sector_weights.append(portfolio_weights)
+                sector_codes.append((len(sector_vocabs) - 1, pred.sector_codes))
+
+                self.backtest_results.append({
+                    'date': months[i],
+                    'portfolio_return': portfolio_return,
+                    'passive_return': passive_return
+                })
+
+                cum_portfolio *= 1 + portfolio_return
+                cum_passive *= 1 + passive_return
+                yield {
+                    'date': months[i].isoformat(),
+                    'portfolio_return': portfolio_return,
+                    'passive_return': passive_return,
+                    'cum_portfolio': cum_portfolio - 1,
+                    'cum_passive': cum_passive - 1,
+                    'coefficients': {f: float(c) for f, c in zip(self.factors, zscored_coefs)}
+                }
+
+        # weights and sector exposures over every ticker and sector seen,
+        # as run_backtest has them from its one panel
+        universe, remap = union_vocabulary(universes)
+        weights = np.full((len(weight_rows), len(universe)), np.nan, dtype=np.float32)
+        for row, (k, codes, w) in enumerate(weight_rows):
+            weights[row, remap[k][codes]] = w
+        self.portfolio_weights = WeightMatrix(weight_dates, universe, weights)
+        self.diagnostics = ModelDiagnostics.from_rows(weight_dates, self.factors, diagnostic_rows)
+
+        sector_vocab, sector_remap = union_vocabulary(sector_vocabs)
+        self.sector_exposure = SectorExposure.from_codes(
+            np.concatenate(sector_weights) if sector_weights else [],
+            np.concatenate([np.append(sector_remap[k], -1)[codes] for k, codes in sector_codes]) if sector_codes else [],
+            sector_vocab,
+            np.repeat(np.arange(len(sector_weights)), [len(w) for w in sector_weights]),
+            weight_dates
+        )
+
+    def results(self) -> list[dict]:
+        # monthly returns plus cumulative returns, as served by the api
+        return records(self.results_frame())
+
+    def results_frame(self) -> pd.DataFrame:
+        backtest_results = pd.DataFrame(self.backtest_results, columns=['date', 'portfolio_return', 'passive_return'])
         backtest_results['cum_portfolio'] = (1 + backtest_results['portfolio_return']).cumprod() - 1
         backtest_results['cum_passive'] = (1 + backtest_results['passive_return']).cumprod() - 1
 
-        return backtest_results.to_dict(orient='records')
+        return backtest_results
 
     def factor_exposures(self):
         if self.model_coefficients is None:
@@ -137,18 +385,50 @@ class BackTest:
         
         return self.model_coefficients
 
+    def sector_exposures(self) -> pd.DataFrame:
+        # long, short, net and gross weight per sector through time
+        if self.sector_exposure is None:
+            raise HTTPException(
+                status_code=400,
+                detail='Sector exposure is not available for this backtest.'
+            )
+
+        return self.sector_exposure.to_long()
+
+    def model_diagnostics(self) -> pd.DataFrame:
+        # out-of-sample ic, rank ic, hit rate, r2 and prediction dispersion
+        # of each month's model, with its raw coefficients
+        if self.diagnostics is None:
+            raise HTTPException(
+                status_code=400,
+                detail='Model diagnostics are not available for this backtest.'
+            )
+
+        return self.diagnostics.to_frame()
+
+    def rolling_analytics(self, window: int, metric_names: list[str] | None = None) -> pd.DataFrame:
+        # every rolling metric is computed in one pass the first time a
+        # window is asked for; later requests just pick their columns
+        if metric_names is not None:
+            check_metrics(metric_names, window)
+
+        if window not in self.analytics_cache:
+            analytics = rolling_analytics(
+                [r['portfolio_return'] for r in self.backtest_results],
+                [r['passive_return'] for r in self.backtest_results],
+                window
+            )
+            self.analytics_cache[window] = analytics
+
+        analytics = self.analytics_cache[window]
+        if metric_names is not None:
+            analytics = {m: analytics[m] for m in metric_names}
+
+        return rolling_frame([r['date'] for r in self.backtest_results], analytics)
+
     def beta_exposures(self, window_length: int):
         # get the rolling beta exposure with the given window length
-        backtest_df = pd.DataFrame(self.backtest_results)
-        backtest_df = backtest_df.sort_values('date')
-        rolling_cov = backtest_df['portfolio_return'].rolling(window=window_length).cov(backtest_df['passive_return'])
-        rolling_var = backtest_df['passive_return'].rolling(window=window_length).var()
-        rolling_beta = rolling_cov / rolling_var
-
-        # ensure no nas
-        rolling_beta_df = pd.DataFrame({
-            'date': backtest_df['date'],
-            'rolling_beta': rolling_beta
-        }).dropna()
-
-        return rolling_beta_df.to_dict(orient='records')
\ No newline at end of file
+        rolling_beta_df = self.rolling_analytics(window_length, ['beta'])
+        rolling_beta_df = rolling_beta_df.rename(columns={'beta': 'rolling_beta'})
+
+        return records(rolling_beta_df)
@@ -0,0 +1,236 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+import pandas as pd
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from .BackTest import BackTest, fitted_months
+from .BacktestStore import BacktestStore
+
+FINISHED = ('done', 'failed', 'cancelled')
+
+class JobCancelled(Exception):
+    pass
+
+def _run_job(job_id: str, backtest: BackTest, portfolio_data: pd.DataFrame, progress, cancelled) -> BackTest:
+    # runs in a pool process. the backtest is run month by month, so the
+    # parent can be told how far along it is and ask it to stop in between
+    total = len(fitted_months(portfolio_data['date'].nunique(), backtest.lookback))
+    started_at = time.time()
+    progress[job_id] = {'months_done': 0, 'months_total': total, 'started_at': started_at}
+
+    for done, _ in enumerate(backtest.iter_backtest([portfolio_data]), 1):
+        if cancelled.get(job_id):
+            raise JobCancelled()
+        progress[job_id] = {'months_done': done, 'months_total': total, 'started_at': started_at}
+
+    return backtest
+
+@dataclass
+class BacktestJob:
+    job_id: str
+    backtest_id: str
+    submitted_at: float
+    status: str = 'queued'      # queued, running, done, failed or cancelled
+    future: Future | None = None
+    error: str | None = None
+    finished_at: float | None = None
+    last_progress: dict | None = None   # kept once the job has finished
+
+class BacktestJobQueue:
+    def __init__(self, store: BacktestStore, max_workers: int, max_pending: int = 64, max_history: int = 256):
+        # backtests submitted as jobs run on a pool of max_workers processes,
+        # so a long backtest neither holds up a request nor the event loop,
+        # and several run side by side. finished ones go into store, where
+        # the analytics endpoints find them.
+        self.store = store
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_history = max_history
+
+        self.jobs: OrderedDict[str, BacktestJob] = OrderedDict()
+        self.active: dict[str, str] = {}    # backtest id -> unfinished job id
+        self.lock = threading.Lock()
+
+        # the event loop only keeps weak references to tasks, so the ones
+        # fetching data for jobs are held on to here
+        self.tasks: set[asyncio.Task] = set()
+
+        # the pool and the manager process sharing progress and cancel flags
+        # with it are only started once the first job comes in
+        self.pool: ProcessPoolExecutor | None = None
+        self.manager = None
+        self.progress = None
+        self.cancelled = None
+
+    def _start(self) -> None:
+        # spawned rather than forked workers, as the server process has
+        # database and executor threads running
+        context = multiprocessing.get_context('spawn')
+        self.manager = context.Manager()
+        self.progress = self.manager.dict()
+        self.cancelled = self.manager.dict()
+        self.pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+
+    async def submit(self, backtest_id: str, backtest: BackTest) -> dict:
+        # looked up before taking the lock, as it may have to go to disk
+        computed = await run_in_threadpool(self.store.__contains__, backtest_id)
+
+        run = False
+        with self.lock:
+            # the same backtest already queued or running is the same job
+            job = self.jobs.get(self.active.get(backtest_id))
+            if job is None:
+                job = BacktestJob(uuid.uuid4().hex, backtest_id, time.time())
+                if computed:
+                    # nothing to run
+                    job.status, job.finished_at = 'done', job.submitted_at
+                else:
+                    if len(self.active) >= self.max_pending:
+                        raise HTTPException(
+                            status_code=503,
+                            detail='Too many backtest jobs are queued, try again later.'
+                        )
+                    if self.pool is None:
+                        self._start()
+                    self.active[backtest_id] = job.job_id
+                    run = True
+                self._remember(job)
+
+        if run:
+            task = asyncio.ensure_future(self._fetch_and_run(job, backtest))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return self.status(job.job_id)
+
+    async def _fetch_and_run(self, job: BacktestJob, backtest: BackTest) -> None:
+        # the data is pulled here, through the server's data source and its
+        # caches, and handed to the worker with the backtest
+        try:
+            portfolio_data = await backtest.fetch_portfolio_data_async()
+        except Exception as e:
+            self._finish(job, 'failed', getattr(e, 'detail', str(e)))
+            return
+
+        with self.lock:
+            if self.cancelled.get(job.job_id):
+                cancelled = True
+            else:
+                cancelled = False
+                job.future = self.pool.submit(
+                    _run_job, job.job_id, backtest, portfolio_data, self.progress, self.cancelled
+                )
+
+        if cancelled:
+            self._finish(job, 'cancelled')
+        else:
+            job.future.add_done_callback(lambda future: self._collect(job, future))
+
+    def _collect(self, job: BacktestJob, future: Future) -> None:
+        # called on the pool's thread once the worker is done with the job
+        if future.cancelled():
+            self._finish(job, 'cancelled')
+            return
+
+        error = future.exception()
+        if isinstance(error, JobCancelled):
+            self._finish(job, 'cancelled')
+        elif error is not None:
+            self._finish(job, 'failed', getattr(error, 'detail', str(error)))
+        else:
+            try:
+                self.store[job.backtest_id] = future.result()
+                self._finish(job, 'done')
+            except Exception as e:
+                self._finish(job, 'failed', str(e))
+
+    def _finish(self, job: BacktestJob, status: str, error: str | None = None) -> None:
+        with self.lock:
+            # keep the last progress reading, so finished jobs still show it
+            job.last_progress = self.progress.pop(job.job_id, job.last_progress)
+            self.cancelled.pop(job.job_id, None)
+
+            job.status, job.error, job.finished_at = status, error, time.time()
+            job.future = None
+            if self.active.get(job.backtest_id) == job.job_id:
+                del self.active[job.backtest_id]
+
+    def _remember(self, job: BacktestJob) -> None:
+        # only a bounded number of jobs are remembered; finished ones are
+        # forgotten first, oldest first
+        self.jobs[job.job_id] = job
+        finished = [job_id for job_id, j in self.jobs.items() if j.status in FINISHED]
+        while len(self.jobs) > self.max_history and finished:
+            del self.jobs[finished.pop(0)]
+
+    def _get(self, job_id: str) -> BacktestJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f'Job {job_id} does not exist.'
+            )
+        return job
+
+    def status(self, job_id: str) -> dict:
+        with self.lock:
+            job = self._get(job_id)
+            progress = job.last_progress
+            cancelling = False
+            if job.status not in FINISHED:
+                progress = self.progress.get(job_id)
+                cancelling = bool(self.cancelled.get(job_id))
+
+        # queued jobs are running once their worker reports progress
+        status = job.status
+        if status == 'queued' and progress is not None:
+            status = 'running'
+        if cancelling:
+            status = 'cancelling'
+
+        done = progress['months_done'] if progress else 0
+        total = progress['months_total'] if progress else None
+
+        # eta from the average time per month so far
+        eta = None
+        if progress and job.status not in FINISHED and 0 < done < total:
+            elapsed = time.time() - progress['started_at']
+            eta = elapsed / done * (total - done)
+
+        return {
+            'job_id': job.job_id,
+            'backtest_id': job.backtest_id,
+            'status': status,
+            'months_done': done,
+            'months_total': total,
+            'progress': done / total if total else (1.0 if job.status == 'done' else 0.0),
+            'eta_seconds': eta,
+            'submitted_at': job.submitted_at,
+            'finished_at': job.finished_at,
+            'error': job.error
+        }
+
+    def cancel(self, job_id: str) -> dict:
+        with self.lock:
+            job = self._get(job_id)
+            unfinished = job.status not in FINISHED
+
+            # a job still waiting for a worker is just dropped (its done
+            # callback marks it cancelled); a running one is asked to stop,
+            # which it does at the end of its current month
+            if unfinished and not (job.future is not None and job.future.cancel()):
+                self.cancelled[job_id] = True
+
+        return self.status(job_id)
+
+    def stats(self) -> dict:
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {'workers': self.max_workers, 'active': len(self.active), **counts}
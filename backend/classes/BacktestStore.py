@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+import pandas as pd
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from fastapi.concurrency import run_in_threadpool
+from .BackTest import BackTest
+from .WeightMatrix import WeightMatrix
+from .SectorExposure import SectorExposure
+from .ModelDiagnostics import ModelDiagnostics
+
+def backtest_key(params: dict, data_version: str, panel_dtype: str) -> str:
+    # deterministic backtest id: a hash of the canonical request plus the
+    # version of the data it ran on and the dtype its factors were held in
+    # (float32 panels give slightly different results). factor order doesn't
+    # change results, and dates are normalised so '2020-1-31' and
+    # '2020-01-31' match.
+    canonical = {
+        'start_date': pd.to_datetime(params['start_date']).date().isoformat(),
+        'end_date': pd.to_datetime(params['end_date']).date().isoformat(),
+        'lookback': int(params['lookback']),
+        'factors': sorted(params['factors']),
+        'overlay_weight': float(params['overlay_weight']),
+        'transaction_costs': float(params['transaction_costs']),
+        'data_version': data_version,
+        'panel_dtype': panel_dtype
+    }
+    digest = hashlib.sha256(json.dumps(canonical, sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+class BacktestStore:
+    def __init__(self, root: str, max_in_memory: int = 32):
+        # finished backtests are written to disk under root/<backtest id>/,
+        # so every worker (and a restarted server) can serve them. only the
+        # max_in_memory most recently used ones are kept as objects in RAM.
+        self.root = root
+        self.max_in_memory = max_in_memory
+        self.hot: OrderedDict[str, BackTest] = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+        # backtests currently being computed in this worker, so identical
+        # concurrent requests wait on one computation. only touched from
+        # the event loop.
+        self.in_flight: dict[str, asyncio.Task] = {}
+        self.stats = {'computed': 0, 'reused': 0, 'coalesced': 0}
+
+        # the event loop only keeps weak references to tasks, so the ones
+        # started by start_get_or_compute are held on to here
+        self.tasks: set[asyncio.Task] = set()
+
+    def __contains__(self, backtest_id: str) -> bool:
+        with self.lock:
+            if backtest_id in self.hot:
+                return True
+        path = self._path(backtest_id)
+        return path is not None and os.path.isdir(path)
+
+    def __getitem__(self, backtest_id: str) -> BackTest:
+        with self.lock:
+            if backtest_id in self.hot:
+                self.hot.move_to_end(backtest_id)
+                return self.hot[backtest_id]
+
+        if backtest_id not in self:
+            raise KeyError(backtest_id)
+
+        backtest = self._load(backtest_id)
+        self._remember(backtest_id, backtest)
+        return backtest
+
+    def __setitem__(self, backtest_id: str, backtest: BackTest) -> None:
+        self._save(backtest_id, backtest)
+        self._remember(backtest_id, backtest)
+
+    async def get_or_compute(
+        self,
+        backtest_id: str,
+        compute: Callable[[], Awaitable[BackTest]]
+    ) -> BackTest:
+        if await run_in_threadpool(self.__contains__, backtest_id):
+            self.stats['reused'] += 1
+            return await run_in_threadpool(self.__getitem__, backtest_id)
+
+        task = self.in_flight.get(backtest_id)
+        if task is not None:
+            self.stats['coalesced'] += 1
+        else:
+            self.stats['computed'] += 1
+            task = asyncio.ensure_future(self._compute_and_save(backtest_id, compute))
+            self.in_flight[backtest_id] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(backtest_id, None))
+
+        # shield it, so one client disconnecting doesn't cancel the
+        # computation the other waiters are relying on
+        return await asyncio.shield(task)
+
+    def start_get_or_compute(
+        self,
+        backtest_id: str,
+        compute: Callable[[], Awaitable[BackTest]]
+    ) -> asyncio.Task:
+        # get_or_compute as a task of its own, for callers that have other
+        # things to do (e.g. streaming months out) while it runs. it carries
+        # on if the caller goes away, so the backtest is still saved.
+        task = asyncio.ensure_future(self.get_or_compute(backtest_id, compute))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _compute_and_save(self, backtest_id: str, compute: Callable[[], Awaitable[BackTest]]) -> BackTest:
+        backtest = await compute()
+        await run_in_threadpool(self.__setitem__, backtest_id, backtest)
+        return backtest
+
+    def _remember(self, backtest_id: str, backtest: BackTest) -> None:
+        with self.lock:
+            self.hot[backtest_id] = backtest
+            self.hot.move_to_end(backtest_id)
+            while len(self.hot) > self.max_in_memory:
+                self.hot.popitem(last=False)
+
+    def _path(self, backtest_id: str) -> str | None:
+        # ids end up in file paths, so only allow uuid/hash style ids
+        if not re.fullmatch(r'[0-9A-Za-z-]+', backtest_id):
+            return None
+        return os.path.join(self.root, backtest_id)
+
+    def _save(self, backtest_id: str, backtest: BackTest) -> None:
+        path = self._path(backtest_id)
+        if path is None:
+            raise ValueError(f'Invalid backtest id: {backtest_id}')
+
+        # write everything into a scratch directory first and rename it into
+        # place, so other workers never see a half-written backtest
+        tmp_path = os.path.join(self.root, f'.tmp-{backtest_id}-{uuid.uuid4().hex}')
+        os.makedirs(tmp_path)
+        try:
+            with open(os.path.join(tmp_path, 'params.json'), 'w', encoding='utf-8') as f:
+                json.dump(backtest.params(), f)
+
+            pd.DataFrame(backtest.backtest_results).to_parquet(os.path.join(tmp_path, 'results.parquet'), index=False)
+            pd.DataFrame(backtest.model_coefficients).to_parquet(os.path.join(tmp_path, 'coefficients.parquet'), index=False)
+
+            # weights are stored sparse and long: one (date, ticker, weight)
+            # row per held position
+            weights = backtest.portfolio_weights.to_long()
+            weights.to_parquet(os.path.join(tmp_path, 'weights.parquet'), index=False)
+
+            if backtest.sector_exposure is not None:
+                backtest.sector_exposure.to_long().to_parquet(os.path.join(tmp_path, 'sectors.parquet'), index=False)
+            if backtest.diagnostics is not None:
+                backtest.diagnostics.to_frame().to_parquet(os.path.join(tmp_path, 'diagnostics.parquet'), index=False)
+
+            os.replace(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            # ids are content addressed, so if another worker saved this id
+            # first, what's on disk is the same backtest
+            if not os.path.isdir(path):
+                raise
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+    def _load(self, backtest_id: str) -> BackTest:
+        path = self._path(backtest_id)
+
+        with open(os.path.join(path, 'params.json'), encoding='utf-8') as f:
+            params = json.load(f)
+
+        results = pd.read_parquet(os.path.join(path, 'results.parquet'))
+        coefficients = pd.read_parquet(os.path.join(path, 'coefficients.parquet'))
+        weights = pd.read_parquet(os.path.join(path, 'weights.parquet'))
+
+        # backtests stored before sector exposures were tracked don't have them
+        sectors_path = os.path.join(path, 'sectors.parquet')
+        sectors = SectorExposure.from_long(pd.read_parquet(sectors_path)) if os.path.exists(sectors_path) else None
+        # nor model diagnostics
+        diagnostics_path = os.path.join(path, 'diagnostics.parquet')
+        diagnostics = None
+        if os.path.exists(diagnostics_path):
+            diagnostics = ModelDiagnostics.from_frame(pd.read_parquet(diagnostics_path), params['factors'])
+
+        return BackTest.from_results(
+            params,
+            results.to_dict(orient='records'),
+            coefficients.to_dict(orient='records'),
+            WeightMatrix.from_long(weights),
+            sectors,
+            diagnostics
+        )
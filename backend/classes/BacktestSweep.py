@@ -0,0 +1,209 @@
+import itertools
+import multiprocessing
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from fastapi import HTTPException
+from .DataSource import DataSource
+from .PortfolioPanel import PortfolioPanel, PANEL_COLUMNS
+from .BackTest import month_ridge_stats, rolling_fits
+from .RidgeSolver import RidgeStats
+from .PortfolioConstruction import construct_weights
+
+@dataclass
+class SweepConfig:
+    lookback: int
+    factors: list[str]
+    overlay_weight: float
+    transaction_costs: float
+
+def performance_summary(monthly_returns: np.ndarray) -> dict:
+    # annualised figures from monthly returns. sharpe assumes a zero risk
+    # free rate.
+    if len(monthly_returns) == 0:
+        return {
+            'annualised_return': None,
+            'annualised_vol': None,
+            'sharpe': None,
+            'max_drawdown': None
+        }
+
+    wealth = np.cumprod(1 + monthly_returns)
+    annualised_return = wealth[-1] ** (12 / len(monthly_returns)) - 1
+    annualised_vol = np.std(monthly_returns, ddof=1) * np.sqrt(12) if len(monthly_returns) > 1 else np.nan
+    sharpe = np.mean(monthly_returns) * 12 / annualised_vol if annualised_vol > 0 else np.nan
+    drawdown = wealth / np.maximum.accumulate(np.maximum(wealth, 1.0)) - 1
+
+    # nan isn't valid json, so undefined figures come back as None
+    return {
+        name: float(value) if np.isfinite(value) else None
+        for name, value in [
+            ('annualised_return', annualised_return),
+            ('annualised_vol', annualised_vol),
+            ('sharpe', sharpe),
+            ('max_drawdown', drawdown.min())
+        ]
+    }
+
+def fit_group(panel: PortfolioPanel, month_stats: list[RidgeStats] | None, lookback: int, factor_idx: list[int]):
+    # everything a (lookback, factor set) group needs, independent of the
+    # overlay weight and costs: per month, the passive return and the
+    # return of a unit-gross alpha overlay.
+    #
+    # month_stats over every factor of the panel can only be cut down to a
+    # subset if no row was left out of them for a missing factor
+    if month_stats is not None:
+        stats = [s.subset(factor_idx) for s in month_stats]
+    else:
+        stats = month_ridge_stats(panel, factor_idx)
+    months, pred_returns = [], []
+
+    for i, alpha_model in rolling_fits(stats, lookback):
+        months.append(i)
+        pred_returns.append(alpha_model.predict(panel.view(i).X[:, factor_idx]))
+
+    if not months:
+        return np.array([], dtype=int), np.array([]), np.array([])
+
+    first, last = months[0], months[-1]
+    index_weight = panel.matrix(panel.index_weight, first, last)
+    returns = panel.matrix(panel.returns, first, last)
+    _, unit_overlay = construct_weights(
+        panel.matrix(np.concatenate(pred_returns), first, last),
+        panel.matrix(panel.estimated_vol, first, last),
+        index_weight,
+        1.0
+    )
+
+    passive_returns = np.nansum(index_weight * returns, axis=1)
+    overlay_returns = np.nansum(unit_overlay * returns, axis=1)
+    return np.array(months, dtype=int), passive_returns, overlay_returns
+
+def _fit_groups(panel: PortfolioPanel, month_stats: list[RidgeStats] | None, tasks: list[tuple[int, list[int]]]) -> list:
+    # runs in a pool process: one batch of groups over one copy of the panel
+    return [fit_group(panel, month_stats, lookback, factor_idx) for lookback, factor_idx in tasks]
+
+class SweepPool:
+    def __init__(self, max_workers: int):
+        # one long-lived pool of worker processes shared by every sweep, so
+        # requests don't pay for starting and stopping processes. as with
+        # BacktestJobQueue, the workers are spawned rather than forked (the
+        # server has database and executor threads running), and only once
+        # the first sweep needs them.
+        self.max_workers = max_workers
+        self.pool: ProcessPoolExecutor | None = None
+        self.lock = threading.Lock()
+
+    def fit_groups(self, panel: PortfolioPanel, month_stats: list[RidgeStats] | None, tasks: list[tuple[int, list[int]]]) -> list:
+        # fit_group for every task, in order. the tasks are dealt out into
+        # one batch per worker, so the panel is sent to each worker once
+        # per sweep rather than once per task.
+        n_batches = min(self.max_workers, len(tasks))
+        if n_batches <= 1:
+            return _fit_groups(panel, month_stats, tasks)
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            futures = [
+                self.pool.submit(_fit_groups, panel, month_stats, tasks[b::n_batches])
+                for b in range(n_batches)
+            ]
+
+        batches = [future.result() for future in futures]
+        return [batches[t % n_batches][t // n_batches] for t in range(len(tasks))]
+
+class BacktestSweep:
+    def __init__(
+        self,
+        start_date: str,
+        end_date: str,
+        lookbacks: list[int],
+        factor_sets: list[list[str]],
+        overlay_weights: list[float],
+        transaction_costs: list[float],
+        db: DataSource,
+        pool: SweepPool | None = None
+    ):
+        date_validities, bounds = db.are_dates_valid('portfolio_data', [start_date, end_date])
+        if False in date_validities:
+            raise HTTPException(
+                status_code=400,
+                detail=f"One of the dates is out of bounds. "
+                    f"Max date: {bounds.max_date}, Min date: {bounds.min_date}"
+            )
+
+        # every combination of the grid is one configuration
+        self.configs = [
+            SweepConfig(lookback, list(factors), overlay_weight, costs)
+            for lookback, factors, overlay_weight, costs in itertools.product(
+                lookbacks, factor_sets, overlay_weights, transaction_costs
+            )
+        ]
+        if not self.configs:
+            raise HTTPException(
+                status_code=400,
+                detail='The sweep grid is empty.'
+            )
+
+        self.start_date = start_date
+        self.end_date = end_date
+        self.db = db
+        # groups are fitted in this process if there is no pool
+        self.pool = pool
+
+    def run(self) -> list[dict]:
+        # load the panel once with the union of every factor in the grid
+        all_factors = sorted({f for config in self.configs for f in config.factors})
+        table_columns = self.db.table_columns('portfolio_data')
+        missing_factors = [f for f in all_factors if f not in table_columns]
+        if missing_factors:
+            raise HTTPException(
+                status_code=400,
+                detail=f"The following factors do not exist in portfolio_data: {missing_factors}"
+            )
+
+        portfolio_data = self.db.fetch_between_dates(
+            'portfolio_data',
+            self.start_date,
+            self.end_date,
+            None,
+            PANEL_COLUMNS + all_factors
+        )
+        panel = PortfolioPanel(portfolio_data, all_factors)
+        # rows missing a factor are left out of a fit, so with gaps in the
+        # data each group's statistics are built from its own factors
+        complete = np.isfinite(panel.X).all() and np.isfinite(panel.t_plus_3_return).all()
+        month_stats = month_ridge_stats(panel) if complete else None
+
+        # configurations that only differ in overlay weight or costs share
+        # one set of fits, so we only fit each (lookback, factors) once
+        groups = sorted({(c.lookback, tuple(sorted(c.factors))) for c in self.configs})
+        tasks = [(lookback, [all_factors.index(f) for f in factors]) for lookback, factors in groups]
+
+        if self.pool is not None:
+            fitted = self.pool.fit_groups(panel, month_stats, tasks)
+        else:
+            fitted = _fit_groups(panel, month_stats, tasks)
+        fitted = dict(zip(groups, fitted))
+
+        table = []
+        for config in self.configs:
+            months, passive_returns, overlay_returns = fitted[(config.lookback, tuple(sorted(config.factors)))]
+            portfolio_returns = passive_returns + config.overlay_weight * overlay_returns - config.transaction_costs
+            table.append({
+                'lookback': config.lookback,
+                'factors': config.factors,
+                'overlay_weight': config.overlay_weight,
+                'transaction_costs': config.transaction_costs,
+                'start_date': panel.months[months[0]] if len(months) else None,
+                'end_date': panel.months[months[-1]] if len(months) else None,
+                'months': len(months),
+                **performance_summary(portfolio_returns)
+            })
+
+        return table
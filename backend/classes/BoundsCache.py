@@ -0,0 +1,125 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Callable
+
+@dataclass
+class TableMetadata:
+    min_date: date
+    max_date: date
+    months: np.ndarray      # distinct dates in the table, datetime64[D], sorted
+    row_counts: np.ndarray  # rows per entry of months
+    version: str            # changes whenever the table's rows or values change
+    columns: list[str]
+    fetched_at: float
+    column_types: dict[str, str] = field(default_factory=dict)   # declared type per column, where known
+
+    @classmethod
+    def from_date_counts(
+        cls,
+        date_counts: pd.DataFrame,
+        columns: list[str],
+        column_types: dict[str, str] | None = None,
+        load_stamp: str = ''
+    ) -> 'TableMetadata':
+        # date_counts has one row per distinct date: (date, n), plus any
+        # per-date aggregates of the contents (sums of columns...) that
+        # should change the version when values change. load_stamp is
+        # anything else that identifies the loaded data, e.g. file mtimes.
+        months = pd.to_datetime(date_counts['date']).to_numpy().astype('datetime64[D]')
+        row_counts = date_counts['n'].to_numpy(dtype=np.int64)
+        order = np.argsort(months)
+        months, row_counts = months[order], row_counts[order]
+
+        digest = hashlib.sha1()
+        digest.update(months.tobytes())
+        digest.update(row_counts.tobytes())
+
+        # a database may add floats up in any order (e.g. in parallel), so
+        # sums are only hashed to 10 significant digits
+        aggregates = [c for c in date_counts.columns if c not in ('date', 'n')]
+        for col in sorted(aggregates):
+            values = pd.to_numeric(date_counts[col]).to_numpy(dtype=np.float64)[order]
+            digest.update(col.encode())
+            digest.update(','.join(f'{x:.10g}' for x in values).encode())
+        digest.update(load_stamp.encode())
+
+        return cls(
+            min_date=months[0].astype(object) if len(months) else None,
+            max_date=months[-1].astype(object) if len(months) else None,
+            months=months,
+            row_counts=row_counts,
+            version=digest.hexdigest(),
+            columns=columns,
+            fetched_at=time.monotonic(),
+            column_types=column_types or {}
+        )
+
+    def are_dates_valid(self, dates: list) -> np.ndarray:
+        if not len(self.months):
+            return np.zeros(len(dates), dtype=bool)
+        # parsing each date with Timestamp is much cheaper than going
+        # through to_datetime for the handful of dates a request checks
+        d = np.array(
+            [pd.Timestamp(x).to_datetime64() for x in dates],
+            dtype='datetime64[ns]'
+        ).astype('datetime64[D]')
+        return (d >= self.months[0]) & (d <= self.months[-1])
+
+class BoundsCache:
+    def __init__(self, loader: Callable[[str], TableMetadata], ttl: float):
+        # the bounds only move when data is (re)loaded, so we keep them in
+        # memory for ttl seconds, or until someone calls invalidate. the
+        # version they carry is what tells the panel cache and the backtest
+        # store that a table has changed, so that is also how stale a
+        # reload can be served for.
+        self.loader = loader
+        self.ttl = ttl
+        self.tables: dict[str, TableMetadata] = {}
+        self.lock = threading.Lock()
+
+        # tables being loaded right now, so concurrent misses on the same
+        # table wait on one metadata query
+        self.loading: dict[str, Future] = {}
+
+    def get(self, table: str) -> TableMetadata:
+        with self.lock:
+            metadata = self.tables.get(table)
+            if metadata is not None and time.monotonic() - metadata.fetched_at < self.ttl:
+                return metadata
+
+            future = self.loading.get(table)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.loading[table] = future
+
+        if not owner:
+            return future.result()
+
+        # query outside the lock, so other tables can still be served
+        try:
+            metadata = self.loader(table)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[table]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            self.tables[table] = metadata
+            del self.loading[table]
+        future.set_result(metadata)
+        return metadata
+
+    def invalidate(self, table: str | None = None) -> None:
+        with self.lock:
+            if table is None:
+                self.tables.clear()
+            else:
+                self.tables.pop(table, None)
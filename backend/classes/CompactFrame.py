@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# string columns kept dictionary encoded: integer codes into a sorted
+# vocabulary, instead of one python string per row
+CATEGORICAL_COLUMNS = ['ticker', 'sector', 'index']
+
+# the model factors, which can be stored as float32 if asked for. returns,
+# weights and volatilities always stay float64.
+FACTOR_COLUMNS = ['EVEBIT', 'EVEBITDA', 'MOMENTUM', 'PB', 'PE', 'PS']
+
+def compact_frame(data: pd.DataFrame, float32_columns: list[str] = ()) -> pd.DataFrame:
+    # the compact form of a fetched table, as kept in the panel cache.
+    # categories are always sorted, so sorting by a column and factorizing
+    # it give the same order as the plain strings would.
+    columns = {}
+    for col in CATEGORICAL_COLUMNS:
+        if col in data.columns:
+            columns[col] = sorted_categorical(data[col])
+    for col in float32_columns:
+        if col in data.columns and data[col].dtype != np.float32:
+            columns[col] = data[col].astype(np.float32)
+    return data.assign(**columns) if columns else data
+
+def sorted_categorical(values: pd.Series) -> pd.Series:
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype('category')
+    if values.cat.categories.is_monotonic_increasing:
+        return values
+    return values.cat.reorder_categories(values.cat.categories.sort_values())
+
+def concat_frames(parts: list[pd.DataFrame]) -> pd.DataFrame:
+    # pd.concat falls back to object columns when categoricals have
+    # different vocabularies, so those are unioned first
+    if len(parts) == 1:
+        return parts[0].reset_index(drop=True)
+
+    columns = {}
+    for col in parts[0].columns:
+        if all(isinstance(part[col].dtype, pd.CategoricalDtype) for part in parts):
+            columns[col] = pd.Series(pd.api.types.union_categoricals(
+                [part[col] for part in parts],
+                sort_categories=True,
+                ignore_order=True
+            ))
+    data = pd.concat(parts, ignore_index=True)
+    return data.assign(**columns) if columns else data
+
+def encode(values) -> tuple[np.ndarray, np.ndarray]:
+    # integer codes (-1 for missing) and the sorted vocabulary they index.
+    # categoricals are encoded from their codes, without touching strings.
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        codes = np.asarray(values.cat.codes if isinstance(values, pd.Series) else values.codes)
+        categories = values.cat.categories if isinstance(values, pd.Series) else values.categories
+        if not categories.is_monotonic_increasing:
+            return pd.factorize(values, sort=True)
+
+        # drop categories that don't occur, so the vocabulary is exactly
+        # the values present, as with factorize
+        used = np.unique(codes[codes >= 0])
+        remap = np.full(len(categories) + 1, -1, dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        return remap[codes], np.asarray(categories[used], dtype=object)
+
+    codes, vocabulary = pd.factorize(np.asarray(values, dtype=object), sort=True)
+    return codes, np.asarray(vocabulary, dtype=object)
+
+def positions(vocabulary, values) -> np.ndarray:
+    # where each value sits in vocabulary (-1 if it isn't there). for a
+    # categorical only its categories are looked up, then taken by code.
+    index = pd.Index(vocabulary)
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        found = np.append(index.get_indexer(values.cat.categories), -1)
+        return found[np.asarray(values.cat.codes)]
+    return index.get_indexer(values)
+
+def expand_frame(data: pd.DataFrame) -> pd.DataFrame:
+    # back to plain strings and float64 at the api boundary, so responses
+    # look the same whatever the storage
+    columns = {}
+    for col in data.columns:
+        values = data[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns[col] = values.astype(values.cat.categories.dtype)
+        elif values.dtype == np.float32:
+            columns[col] = values.astype(np.float64)
+    return data.assign(**columns) if columns else data
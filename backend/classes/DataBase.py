@@ -1,45 +1,296 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, make_url
+from sqlalchemy.exc import SQLAlchemyError
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import numpy as np
+import os
+import threading
 from typing import Tuple
 from datetime import date
-from dataclasses import dataclass
+from .PanelCache import PanelCache
+from .BoundsCache import BoundsCache, TableMetadata
+from .RidgeSolver import RidgeStats
+from .DataSource import DataSource, DateBounds
+from .Instrumentation import metrics
+from .CompactFrame import FACTOR_COLUMNS, compact_frame
 
-@dataclass
-class DateBounds:
-    max_date: date
-    min_date: date
+# arrow types for the postgres column types we read, so COPY output is
+# parsed as the table declares it rather than guessed from the rows
+ARROW_TYPES = {
+    'date': pa.date32(),
+    'timestamp without time zone': pa.timestamp('us'),
+    'double precision': pa.float64(),
+    'real': pa.float64(),
+    'numeric': pa.float64(),
+    'bigint': pa.int64(),
+    'integer': pa.int64(),
+    'smallint': pa.int64(),
+    'boolean': pa.bool_(),
+    'text': pa.string(),
+    'character varying': pa.string(),
+    'character': pa.string()
+}
 
-class PSQLDataBase:
-    def __init__(self, db_url: str) -> None:
-        self.psql = create_engine(db_url)
+# column types whose per-month sums go into a table's data version
+NUMERIC_TYPES = {'double precision', 'real', 'numeric', 'bigint', 'integer', 'smallint'}
 
-    def are_dates_valid(self, table: str, dates: list[str]) -> Tuple[list[bool], DateBounds]:
-        max_date = pd.read_sql(f'select max(date) from {table}', self.psql).iloc[0, 0]
-        min_date = pd.read_sql(f'select min(date) from {table}', self.psql).iloc[0, 0]
-        res = []
+class PSQLDataBase(DataSource):
+    def __init__(
+        self,
+        db_url: str,
+        cache_bytes: int = 1 << 30,
+        cached_tables: tuple[str, ...] = ('portfolio_data',),
+        bounds_ttl: float = 300.0,
+        bulk_fetch: bool = True,
+        pool_size: int = 10,
+        max_overflow: int = 10,
+        compact: bool = True,
+        float32_factors: bool = False
+    ) -> None:
+        # size the connection pool explicitly. sqlite (used for local
+        # stand-ins) doesn't take these arguments.
+        if make_url(db_url).get_backend_name() == 'sqlite':
+            self.psql = create_engine(db_url)
+        else:
+            self.psql = create_engine(
+                db_url,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_pre_ping=True
+            )
 
-        for d in dates:
-            d_date = pd.to_datetime(d).date()
-            res.append(min_date <= d_date <= max_date)
+        # blocking database calls made from async endpoints run here. it is
+        # sized to the pool, so queries queue for a thread rather than for
+        # a connection while holding a thread.
+        self.executor = ThreadPoolExecutor(
+            max_workers=pool_size + max_overflow,
+            thread_name_prefix='psql'
+        )
+
+        # pull large ranges with COPY into arrow instead of pd.read_sql.
+        # only used on psycopg2 connections, everything else uses read_sql.
+        self.bulk_fetch = bulk_fetch
+
+        # keep fetched tables dictionary encoded (tickers, sectors, indices
+        # as categoricals), and optionally the factors as float32, so more
+        # history fits in the panel cache. strings come back at the api.
+        self.compact = compact
+        self.float32_columns = FACTOR_COLUMNS if float32_factors else []
+
+        # read-through cache of date ranges we have already pulled, shared
+        # by every request in this process
+        self.panel_cache = PanelCache(cache_bytes)
+        self.cached_tables = cached_tables
+
+        # per-table min/max dates and month list, refreshed after bounds_ttl
+        # seconds or when invalidate is called
+        self.bounds_cache = BoundsCache(self._load_metadata, bounds_ttl)
+
+    async def are_dates_valid_async(self, table: str, dates: list[str]) -> Tuple[list[bool], DateBounds]:
+        return await self._run_async(self.are_dates_valid, table, dates)
+
+    def table_metadata(self, table: str) -> TableMetadata:
+        return self.bounds_cache.get(table)
+
+    def _load_metadata(self, table: str) -> TableMetadata:
+        # the bounds, the month list, and per-month row counts and column
+        # sums which together make up the table's data version
+        with metrics.span('metadata_query'):
+            sample = pd.read_sql(f'select * from {table} limit 100', self.psql)
+            columns = sample.columns.tolist()
+
+            # declared column types, for parsing COPY output. only postgres
+            # has information_schema; elsewhere read_sql types the frame.
+            column_types = {}
+            if self.psql.dialect.name == 'postgresql':
+                types = pd.read_sql(
+                    text(
+                        'select column_name, data_type from information_schema.columns '
+                        'where table_schema = current_schema() and table_name = :table'
+                    ),
+                    self.psql,
+                    params={'table': table}
+                )
+                column_types = dict(zip(types['column_name'], types['data_type']))
+                numeric = [c for c in columns if column_types.get(c) in NUMERIC_TYPES]
+            else:
+                numeric = [c for c in columns if c != 'date' and pd.api.types.is_numeric_dtype(sample[c])]
+
+            # summing every numeric column per month means a reload that
+            # corrects values, not just one that adds or drops rows, gets a
+            # new version
+            sums = ''.join(f', sum("{c}") as "sum_{c}"' for c in numeric if '"' not in c)
+            date_counts = pd.read_sql(
+                f'select date, count(*) as n{sums} from {table} group by date order by date',
+                self.psql
+            )
+        return TableMetadata.from_date_counts(date_counts, columns, column_types)
 
-        return res, DateBounds(
-            max_date = max_date,
-            min_date = min_date
+
+    def fetch_between_dates(
+        self,
+        table_name: str,
+        start_date: str | None,
+        end_date: str | None,
+        tickers: str | None,
+        columns: list[str] | None = None
+    ) -> pd.DataFrame:
+        # only closed date ranges over the whole universe go through the
+        # cache; ticker subsets and open-ended pulls hit the database
+        use_cache = (
+            table_name in self.cached_tables
+            and start_date is not None
+            and end_date is not None
+            and not tickers
         )
+        if not use_cache:
+            return self._query_between_dates(table_name, start_date, end_date, tickers, columns)
+
+        start = pd.to_datetime(start_date).date()
+        end = pd.to_datetime(end_date).date()
+        if start > end:
+            return self._query_between_dates(table_name, start, end, None, columns)
+
+        # only the columns asked for (and the date, which segments are
+        # sorted by) are pulled and cached, so segments are kept per column
+        # set. sorting them lets the same columns in any order share them.
+        # segments cached under an older version of the table are reloaded.
+        cached_columns = tuple(sorted(set(columns) | {'date'})) if columns is not None else None
+        data = self.panel_cache.fetch(
+            table_name,
+            start,
+            end,
+            lambda gap_start, gap_end: self._query_between_dates(
+                table_name, gap_start, gap_end, None, list(cached_columns) if cached_columns is not None else None
+            ),
+            self.table_metadata(table_name).version,
+            cached_columns
+        )
+        return data[columns] if columns is not None else data
+
+    async def fetch_between_dates_async(
+        self,
+        table_name: str,
+        start_date: str | None,
+        end_date: str | None,
+        tickers: str | None,
+        columns: list[str] | None = None
+    ) -> pd.DataFrame:
+        return await self._run_async(
+            self.fetch_between_dates, table_name, start_date, end_date, tickers, columns
+        )
+
+    async def _run_async(self, fn, *args):
+        # offload a blocking call onto the bounded database executor so the
+        # event loop is free while we wait on postgres
+        # (in a copy of the caller's context, so its timings are reported
+        # against the request that asked for them)
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, context.run, functools.partial(fn, *args))
+
+    def fetch_month_stats(self, start_date, end_date, factors: list[str]) -> tuple[list[date], list[RidgeStats]] | None:
+        # per-month ridge statistics for the factors against t_plus_3_return,
+        # from the factor_month_stats table data/build_factor_stats.py builds.
+        # a few kilobytes instead of every ticker row in the range. None if
+        # the table isn't there, lacks a factor, can't give exact statistics
+        # for this set of factors, or no longer matches portfolio_data, in
+        # which case callers fit from the raw rows.
+        start = pd.to_datetime(start_date).date()
+        end = pd.to_datetime(end_date).date()
+        try:
+            with metrics.span('month_stats_query'):
+                stats = pd.read_sql(
+                    text('select * from factor_month_stats where date between :start_date and :end_date order by date'),
+                    self.psql,
+                    params={'start_date': start, 'end_date': end}
+                )
+        except (SQLAlchemyError, pd.errors.DatabaseError):
+            return None
+
+        # factor pairs are stored once, in either order
+        def pair(a: str, b: str) -> str | None:
+            for name in (f'sum_xx_{a}_{b}', f'sum_xx_{b}_{a}'):
+                if name in stats.columns:
+                    return name
+            return None
 
+        pairs = [[pair(a, b) for b in factors] for a in factors]
+        needed = ['total_rows', 'n', 'sum_y'] + [f'sum_x_{f}' for f in factors] + [f'sum_xy_{f}' for f in factors]
+        if any(c not in stats.columns for c in needed) or any(p is None for row in pairs for p in row):
+            return None
+
+        # rows missing any of the factors the statistics were built with
+        # are left out of them, while a fit on fewer factors keeps the rows
+        # that only miss the others. so for a subset they are only exact if
+        # no row with a target was left out. tables built before target_rows
+        # was stored are compared with total_rows instead.
+        built = {c[len('sum_x_'):] for c in stats.columns if c.startswith('sum_x_')}
+        if set(factors) != built:
+            usable = stats['target_rows'] if 'target_rows' in stats.columns else stats['total_rows']
+            if not np.array_equal(stats['n'].to_numpy(dtype=np.int64), usable.to_numpy(dtype=np.int64)):
+                return None
+
+        # the statistics are only usable if they were built from the
+        # portfolio_data we'd otherwise read: same months, same row counts
+        metadata = self.table_metadata('portfolio_data')
+        in_range = (metadata.months >= np.datetime64(start)) & (metadata.months <= np.datetime64(end))
+        months = pd.to_datetime(stats['date']).to_numpy().astype('datetime64[D]')
+        if not (
+            np.array_equal(months, metadata.months[in_range])
+            and np.array_equal(stats['total_rows'].to_numpy(dtype=np.int64), metadata.row_counts[in_range])
+        ):
+            return None
+
+        sum_x = stats[[f'sum_x_{f}' for f in factors]].to_numpy(dtype=np.float64)
+        sum_xy = stats[[f'sum_xy_{f}' for f in factors]].to_numpy(dtype=np.float64)
+        sum_xx = stats[[p for row in pairs for p in row]].to_numpy(dtype=np.float64).reshape(-1, len(factors), len(factors))
+
+        return months.astype(object).tolist(), [
+            RidgeStats.from_sums(n, sum_x[m], sum_y, sum_xx[m], sum_xy[m])
+            for m, (n, sum_y) in enumerate(zip(stats['n'].tolist(), stats['sum_y'].tolist()))
+        ]
+
+    def invalidate(self, table_name: str | None = None) -> None:
+        # drop cached data, e.g. after the tables have been reloaded
+        self.panel_cache.invalidate(table_name)
+        self.bounds_cache.invalidate(table_name)
+
+    def cache_stats(self) -> dict:
+        return self.panel_cache.get_stats()
+
+    def _query_between_dates(
+        self,
+        table_name: str,
+        start_date: str | None,
+        end_date: str | None,
+        tickers: str | None,
+        columns: list[str] | None = None
+    ) -> pd.DataFrame:
+        # COPY needs the query with its parameters already inlined, which
+        # psycopg2 does for us with %(name)s placeholders; read_sql goes
+        # through sqlalchemy's :name binds
+        use_copy = self.bulk_fetch and self.psql.dialect.driver == 'psycopg2'
+        bind = (lambda name: f'%({name})s') if use_copy else (lambda name: f':{name}')
 
-    def fetch_between_dates(self, table_name: str, start_date: str | None, end_date: str | None, tickers: str | None) -> pd.DataFrame:
         conditions = []
         params = {}
 
+        # callers pass strings, dates or timestamps; bind them all as dates,
+        # which every driver (sqlite included) knows how to send
         if start_date is not None:
-            conditions.append("date >= :start_date")
-            params['start_date'] = start_date
+            conditions.append(f"date >= {bind('start_date')}")
+            params['start_date'] = pd.to_datetime(start_date).date()
         if end_date is not None:
-            conditions.append("date <= :end_date")
-            params['end_date'] = end_date
+            conditions.append(f"date <= {bind('end_date')}")
+            params['end_date'] = pd.to_datetime(end_date).date()
         if tickers is not None and len(tickers) > 0:
-            conditions.append("ticker IN :tickers")
+            conditions.append(f"ticker IN {bind('tickers')}")
             params['tickers'] = tuple(tickers)
 
         # create conditions if they exist - otherwise pull the entire
@@ -50,12 +301,103 @@ class PSQLDataBase:
         if conditions:
             where_clause = " WHERE " + " AND ".join(conditions)
 
-        # query from the postgresql database
-        query = text(f"SELECT * FROM {table_name}{where_clause}")
-        data = pd.read_sql(
-            query, 
-            self.psql, 
-            params=params
+        # only read the columns the caller asked for
+        select_list = "*"
+        if columns is not None:
+            bad_columns = [c for c in columns if '"' in c]
+            if bad_columns:
+                raise ValueError(f'Invalid column names: {bad_columns}')
+            select_list = ", ".join(f'"{c}"' for c in columns)
+
+        query = f"SELECT {select_list} FROM {table_name}{where_clause}"
+
+        if use_copy:
+            data = self._copy_query(query, params, self.table_metadata(table_name).column_types)
+        else:
+            # query from the postgresql database. read_sql runs the query
+            # and builds the frame in one go, so they're timed together.
+            with metrics.span('sql_read'):
+                data = pd.read_sql(
+                    text(query), 
+                    self.psql, 
+                    params=params
+                )
+
+        if self.compact:
+            data = compact_frame(data, self.float32_columns)
+
+        metrics.count('rows_fetched', len(data))
+        metrics.count('frame_bytes_fetched', int(data.memory_usage(index=False).sum()))
+        return data
+
+    def _copy_query(self, query: str, params: dict, column_types: dict[str, str]) -> pd.DataFrame:
+        # stream the result out of postgres with COPY, which skips building
+        # a python object per value, and let arrow parse it into typed
+        # columns as it arrives. COPY writes into a pipe from a thread while
+        # arrow reads batches off the other end, so the csv text is never
+        # held in memory as a whole.
+        read_fd, write_fd = os.pipe()
+        writer = CopyWriter(write_fd)
+        errors = []
+
+        def copy() -> None:
+            try:
+                raw = self.psql.raw_connection()
+                try:
+                    with raw.cursor() as cur:
+                        select = cur.mogrify(query, params).decode()
+                        cur.copy_expert(f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER true)", writer)
+                finally:
+                    raw.close()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # closing our end is what tells the reader the data is done
+                writer.close()
+
+        # every column is parsed as the table declares it, so a window that
+        # happens to be all null or all digits keeps the column's type
+        convert_options = pa_csv.ConvertOptions(
+            column_types={c: ARROW_TYPES[t] for c, t in column_types.items() if t in ARROW_TYPES},
+            strings_can_be_null=True,
+            true_values=['t'],
+            false_values=['f']
         )
-        
-        return data
\ No newline at end of file
+
+        thread = threading.Thread(target=copy, name='psql-copy', daemon=True)
+        with metrics.span('sql_copy'):
+            thread.start()
+            try:
+                with open(read_fd, 'rb') as reader:
+                    table = pa_csv.open_csv(reader, convert_options=convert_options).read_all()
+            except Exception:
+                # a failed COPY ends the stream early, and then its error is
+                # the one worth reporting. if arrow gave up first, COPY just
+                # saw its pipe closed.
+                thread.join()
+                if errors and not isinstance(errors[0], BrokenPipeError):
+                    raise errors[0]
+                raise
+            thread.join()
+        if errors:
+            raise errors[0]
+        metrics.count('wire_bytes_fetched', writer.bytes)
+
+        with metrics.span('arrow_to_pandas'):
+            # in compact mode arrow hands string columns over as categoricals
+            # directly, without a python string per row
+            return table.to_pandas(date_as_object=True, strings_to_categorical=self.compact)
+
+class CopyWriter:
+    # the file object COPY writes into: the write end of a pipe, counting
+    # the bytes that went through it
+    def __init__(self, fd: int):
+        self.file = open(fd, 'wb')
+        self.bytes = 0
+
+    def write(self, data: bytes) -> int:
+        self.bytes += len(data)
+        return self.file.write(data)
+
+    def close(self) -> None:
+        self.file.close()
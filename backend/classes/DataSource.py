@@ -0,0 +1,76 @@
+import asyncio
+import pandas as pd
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import date
+from typing import Tuple
+from .BoundsCache import TableMetadata
+from .RidgeSolver import RidgeStats
+from .Instrumentation import metrics
+
+@dataclass
+class DateBounds:
+    max_date: date
+    min_date: date
+
+class DataSource(ABC):
+    # what the models, backtests and endpoints need from wherever the tables
+    # live. implementations only have to provide table metadata and date
+    # range fetches; everything else has a default built on those.
+
+    @abstractmethod
+    def table_metadata(self, table: str) -> TableMetadata:
+        ...
+
+    @abstractmethod
+    def fetch_between_dates(
+        self,
+        table_name: str,
+        start_date: str | None,
+        end_date: str | None,
+        tickers: str | None,
+        columns: list[str] | None = None
+    ) -> pd.DataFrame:
+        # rows with start_date <= date <= end_date (either end open if None),
+        # optionally only for the given tickers and columns
+        ...
+
+    def are_dates_valid(self, table: str, dates: list[str]) -> Tuple[list[bool], DateBounds]:
+        with metrics.span('are_dates_valid'):
+            metadata = self.table_metadata(table)
+            res = metadata.are_dates_valid(dates)
+
+        return res.tolist(), DateBounds(
+            max_date = metadata.max_date,
+            min_date = metadata.min_date
+        )
+
+    def table_columns(self, table: str) -> list[str]:
+        return self.table_metadata(table).columns
+
+    def fetch_month_stats(self, start_date, end_date, factors: list[str]) -> tuple[list[date], list[RidgeStats]] | None:
+        # precomputed per-month ridge statistics, if the source has them.
+        # None means callers fit from the raw rows.
+        return None
+
+    async def are_dates_valid_async(self, table: str, dates: list[str]) -> Tuple[list[bool], DateBounds]:
+        return await asyncio.to_thread(self.are_dates_valid, table, dates)
+
+    async def fetch_between_dates_async(
+        self,
+        table_name: str,
+        start_date: str | None,
+        end_date: str | None,
+        tickers: str | None,
+        columns: list[str] | None = None
+    ) -> pd.DataFrame:
+        return await asyncio.to_thread(
+            self.fetch_between_dates, table_name, start_date, end_date, tickers, columns
+        )
+
+    def invalidate(self, table_name: str | None = None) -> None:
+        # drop anything cached about the tables, e.g. after they were reloaded
+        pass
+
+    def cache_stats(self) -> dict:
+        return {}
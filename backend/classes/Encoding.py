@@ -0,0 +1,121 @@
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from .Instrumentation import metrics
+from .CompactFrame import expand_frame
+
+# response formats for tabular payloads. records is the default, and is
+# what every endpoint served before; columnar json and arrow ipc are much
+# smaller and cheaper to encode for wide or long tables.
+MEDIA_TYPES = {
+    'records': 'application/json',
+    'columnar': 'application/x-columnar+json',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+def negotiate_format(request: Request, format: str | None = None) -> str:
+    # an explicit ?format= wins, otherwise the first media type we know in
+    # the accept header, otherwise plain records
+    if format is not None:
+        if format not in MEDIA_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown format {format}. Expected one of {list(MEDIA_TYPES)}"
+            )
+        return format
+
+    for accepted in request.headers.get('accept', '').split(','):
+        media_type = accepted.split(';')[0].strip()
+        for fmt, known in MEDIA_TYPES.items():
+            if media_type == known:
+                return fmt
+
+    return 'records'
+
+def _column_values(values: pd.Series) -> list:
+    # plain python values for json; nan isn't valid json so it becomes None,
+    # and dates go out as iso strings like they do for records
+    if values.dtype.kind == 'f':
+        array = values.to_numpy()
+        return np.where(np.isnan(array), None, array).tolist() if np.isnan(array).any() else array.tolist()
+    if values.dtype.kind == 'M':
+        return values.dt.strftime('%Y-%m-%d').tolist()
+    return [v.isoformat() if hasattr(v, 'isoformat') else v for v in values.tolist()]
+
+class TimedJSONResponse(JSONResponse):
+    # the app's default response class, so encoding every records (and
+    # other plain json) response shows up in the metrics as json_encode.
+    # fastapi runs its jsonable_encoder over the content before this, which
+    # isn't timed here; records endpoints use json_response to skip it.
+    def render(self, content) -> bytes:
+        with metrics.span('json_encode'):
+            return super().render(content)
+
+def records(data: pd.DataFrame) -> list[dict]:
+    # a table as json records, one dict per row. nan isn't valid json, so
+    # missing values (months without realised returns, tickers without a
+    # price...) become None
+    if not data.isna().to_numpy().any():
+        return data.to_dict(orient='records')
+    return data.astype(object).where(data.notna(), None).to_dict(orient='records')
+
+def _json_default(value):
+    # what json_response does with values json.dumps doesn't know: numpy
+    # scalars become python ones and dates iso strings, as jsonable_encoder
+    # would have them
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def json_response(content) -> Response:
+    # records (lists of dicts from to_dict...) encoded straight to json,
+    # instead of being walked value by value by fastapi's jsonable_encoder
+    # first. the whole encoding is timed as json_encode. tables go in as
+    # records(...), which has already turned nan into None.
+    with metrics.span('json_encode'):
+        body = json.dumps(content, default=_json_default, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return Response(content=body, media_type=MEDIA_TYPES['records'])
+
+def frame_response(data: pd.DataFrame, fmt: str, metadata: dict | None = None) -> Response:
+    # encodes a table as columnar json or an arrow ipc stream. anything
+    # that isn't part of the table (backtest ids, model coefficients...)
+    # goes next to the columns in json, and into the schema metadata in
+    # arrow. records are left to the endpoints, as each has its own shape.
+    with metrics.span(f'encode_{fmt}'):
+        return _frame_response(data, fmt, metadata or {})
+
+def _frame_response(data: pd.DataFrame, fmt: str, metadata: dict) -> Response:
+    # compact frames go out as plain strings and float64, like any other
+    data = expand_frame(data)
+
+    if fmt == 'columnar':
+        content = {
+            **metadata,
+            'columns': {str(col): _column_values(data[col]) for col in data.columns}
+        }
+        return Response(
+            content=json.dumps(content, default=str),
+            media_type=MEDIA_TYPES['columnar']
+        )
+
+    if fmt == 'arrow':
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b'metadata': json.dumps(metadata, default=str).encode()
+        })
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(
+            content=sink.getvalue().to_pybytes(),
+            media_type=MEDIA_TYPES['arrow']
+        )
+
+    raise ValueError(f'Cannot encode a frame as {fmt}')
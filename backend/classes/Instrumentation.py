@@ -0,0 +1,145 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, float('inf')]
+
+# spans timed while handling the current request, as (name, seconds). set
+# by the request middleware, so nested calls (threads included, as long as
+# they run in a copy of the request's context) report into it.
+request_spans: ContextVar[list | None] = ContextVar('request_spans', default=None)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float | None:
+        # upper bound of the bucket the q-th observation falls in, so an
+        # overestimate by at most one bucket
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, n in zip(BUCKETS_MS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound / 1000, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_s': self.total / self.count if self.count else None,
+            'p50_s': self.quantile(0.5),
+            'p95_s': self.quantile(0.95),
+            'p99_s': self.quantile(0.99),
+            'max_s': self.max,
+            'buckets_ms': {
+                str(bound): n for bound, n in zip(BUCKETS_MS, self.counts) if n
+            }
+        }
+
+class Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self) -> 'Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.metrics.record_span(self.name, time.perf_counter() - self.start)
+
+class NoSpan:
+    # what span hands out when metrics are off: entering and leaving it is
+    # all the overhead left
+    __slots__ = ()
+
+    def __enter__(self) -> 'NoSpan':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+NO_SPAN = NoSpan()
+
+class Metrics:
+    def __init__(self, enabled: bool = True, server_timing: bool = False):
+        # process wide timings and counters. main.py sets enabled and
+        # server_timing from the environment.
+        self.enabled = enabled
+        self.server_timing = server_timing
+        self.lock = threading.Lock()
+        self.spans: dict[str, Histogram] = defaultdict(Histogram)
+        self.requests: dict[str, Histogram] = defaultdict(Histogram)
+        self.statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.counters: dict[str, float] = defaultdict(float)
+        self.started_at = time.time()
+
+    def span(self, name: str) -> Span | NoSpan:
+        # with metrics.span('sql_query'): ... times the block under name
+        return Span(self, name) if self.enabled else NO_SPAN
+
+    def record_span(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.spans[name].observe(seconds)
+        spans = request_spans.get()
+        if spans is not None:
+            spans.append((name, seconds))
+
+    def count(self, name: str, value: float = 1) -> None:
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += value
+
+    def record_request(self, endpoint: str, status: int, seconds: float) -> None:
+        with self.lock:
+            self.requests[endpoint].observe(seconds)
+            self.statuses[endpoint][status] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'uptime_s': time.time() - self.started_at,
+                'endpoints': {
+                    endpoint: {**h.summary(), 'statuses': dict(self.statuses[endpoint])}
+                    for endpoint, h in self.requests.items()
+                },
+                'spans': {name: h.summary() for name, h in self.spans.items()},
+                'counters': dict(self.counters)
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.spans.clear()
+            self.requests.clear()
+            self.statuses.clear()
+            self.counters.clear()
+            self.started_at = time.time()
+
+def server_timing(spans: list[tuple[str, float]], total: float) -> str:
+    # Server-Timing header value: repeated spans are summed, durations in ms
+    durations = defaultdict(float)
+    for name, seconds in spans:
+        durations[name] += seconds
+    entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in durations.items()]
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+metrics = Metrics()
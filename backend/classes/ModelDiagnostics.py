@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from datetime import date
+from scipy.stats import rankdata
+from .RidgeSolver import RidgeFit
+
+# per-month out-of-sample statistics of a model's predictions against the
+# realised t+3 returns of the month it predicted
+METRICS = ['ic', 'rank_ic', 'hit_rate', 'r2', 'dispersion']
+
+def month_diagnostics(fit: RidgeFit, predicted: np.ndarray, realised: np.ndarray) -> dict:
+    # one month's diagnostics. rows without a realised return (e.g. the
+    # last months of the data) aren't scored; statistics that need more
+    # than one row, or some spread, are nan otherwise.
+    predicted = np.asarray(predicted, dtype=np.float64)
+    realised = np.asarray(realised, dtype=np.float64)
+    scored = np.isfinite(predicted) & np.isfinite(realised)
+    p, r = predicted[scored], realised[scored]
+
+    row = {
+        'n': len(p),
+        'ic': np.nan,
+        'rank_ic': np.nan,
+        'hit_rate': float(np.mean(np.sign(p) == np.sign(r))) if len(p) else np.nan,
+        'r2': np.nan,
+        'dispersion': float(p.std()) if len(p) else np.nan,
+        'intercept': float(fit.intercept_),
+        'coefficients': np.asarray(fit.coef_, dtype=np.float64)
+    }
+    if len(p) > 1:
+        row['ic'] = correlation(p, r)
+        row['rank_ic'] = correlation(ranks(p), ranks(r))
+        sst = np.sum((r - r.mean()) ** 2)
+        if sst > 0:
+            # as Ridge.score would give on the month: 1 - sse / sst
+            row['r2'] = float(1 - np.sum((r - p) ** 2) / sst)
+    return row
+
+def correlation(a: np.ndarray, b: np.ndarray) -> float:
+    # pearson correlation, nan if either side has no spread
+    a, b = a - a.mean(), b - b.mean()
+    denom = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    return float(np.dot(a, b) / denom) if denom > 0 else np.nan
+
+def ranks(values: np.ndarray) -> np.ndarray:
+    # ranks from one argsort; scipy's (slower) rankdata only when there are
+    # ties to average over
+    order = np.argsort(values)
+    if np.any(values[order[1:]] == values[order[:-1]]):
+        return rankdata(values)
+    result = np.empty(len(values))
+    result[order] = np.arange(1, len(values) + 1)
+    return result
+
+@dataclass
+class ModelDiagnostics:
+    # how each month's model did out of sample, as one array per metric,
+    # plus the raw fitted coefficients (months x factors) and intercepts.
+    # this is all that's kept of the fits, rather than a model per month.
+    dates: list[date]
+    factors: list[str]
+    n: np.ndarray
+    ic: np.ndarray
+    rank_ic: np.ndarray
+    hit_rate: np.ndarray
+    r2: np.ndarray
+    dispersion: np.ndarray
+    intercepts: np.ndarray
+    coefficients: np.ndarray
+
+    @classmethod
+    def from_rows(cls, dates: list[date], factors: list[str], rows: list[dict]) -> 'ModelDiagnostics':
+        # rows as returned by month_diagnostics, one per date
+        column = lambda key, dtype=np.float64: np.array([row[key] for row in rows], dtype=dtype)
+        return cls(
+            dates=list(dates),
+            factors=list(factors),
+            n=column('n', np.int64),
+            **{metric: column(metric) for metric in METRICS},
+            intercepts=column('intercept'),
+            coefficients=np.vstack([row['coefficients'] for row in rows]) if rows else np.empty((0, len(factors)))
+        )
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, factors: list[str]) -> 'ModelDiagnostics':
+        # inverse of to_frame
+        return cls(
+            dates=list(data['date']),
+            factors=list(factors),
+            n=data['n'].to_numpy(dtype=np.int64),
+            **{metric: data[metric].to_numpy(dtype=np.float64) for metric in METRICS},
+            intercepts=data['intercept'].to_numpy(dtype=np.float64),
+            coefficients=data[list(factors)].to_numpy(dtype=np.float64).reshape(len(data), len(factors))
+        )
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def to_frame(self) -> pd.DataFrame:
+        # one row per month: the metrics, then the intercept and a column
+        # of raw coefficients per factor
+        data = pd.DataFrame({
+            'date': self.dates,
+            'n': self.n,
+            **{metric: getattr(self, metric) for metric in METRICS},
+            'intercept': self.intercepts
+        })
+        coefficients = pd.DataFrame(self.coefficients, columns=self.factors)
+        return pd.concat([data, coefficients], axis=1)
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from datetime import date, timedelta
+from typing import Callable
+from .CompactFrame import concat_frames
+
+@dataclass
+class CacheSegment:
+    # one contiguous, inclusive date interval of a table that we have
+    # loaded. rows are sorted by date so sub-ranges are iloc slices.
+    start: date
+    end: date
+    data: pd.DataFrame
+    dates: np.ndarray
+    nbytes: int
+    version: str = ''   # version of the table the rows were loaded from
+
+    def between(self, start: date, end: date) -> pd.DataFrame:
+        lo = np.searchsorted(self.dates, np.datetime64(start, 'D'), side='left')
+        hi = np.searchsorted(self.dates, np.datetime64(end, 'D'), side='right')
+        return self.data.iloc[lo:hi]
+
+@dataclass
+class CacheStats:
+    hits: int = 0           # requests served entirely from memory
+    partial_hits: int = 0   # requests that only needed some gaps fetched
+    misses: int = 0         # requests with nothing cached
+    gap_fetches: int = 0    # queries actually sent to the database
+    evictions: int = 0
+    stale_drops: int = 0    # segments dropped because the table changed
+    bytes: int = 0
+    max_bytes: int = 0
+
+class PanelCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # keyed by (table, columns, segment start), in least-recently-used
+        # order. columns is the sorted tuple of columns the segment holds, or
+        # None for whole rows; each column set has its own segments.
+        self.segments: OrderedDict[tuple[str, tuple[str, ...] | None, date], CacheSegment] = OrderedDict()
+        self.stats = CacheStats(max_bytes=max_bytes)
+        self.lock = threading.Lock()
+
+    def fetch(
+        self,
+        table_name: str,
+        start_date: date,
+        end_date: date,
+        loader: Callable[[date, date], pd.DataFrame],
+        version: str = '',
+        columns: tuple[str, ...] | None = None
+    ) -> pd.DataFrame:
+        # read-through: serve whatever part of [start_date, end_date] is
+        # already in memory, and call loader only for the missing gaps.
+        # version is the table's current data version; segments loaded
+        # under any other version are stale and dropped first.
+        with self.lock:
+            self._drop_stale(table_name, version)
+            overlapping = sorted(
+                (s for s in self._table_segments(table_name, columns) if s.start <= end_date and s.end >= start_date),
+                key=lambda s: s.start
+            )
+            for segment in overlapping:
+                self.segments.move_to_end((table_name, columns, segment.start))
+            gaps = self._gaps(start_date, end_date, overlapping)
+
+            if not gaps:
+                self.stats.hits += 1
+            elif overlapping:
+                self.stats.partial_hits += 1
+            else:
+                self.stats.misses += 1
+            self.stats.gap_fetches += len(gaps)
+
+        # query the database outside the lock so other requests can
+        # still be served from memory in the meantime
+        fetched = [self._make_segment(s, e, loader(s, e), version) for s, e in gaps]
+
+        with self.lock:
+            for segment in fetched:
+                self._insert(table_name, columns, segment)
+
+        # segments never overlap, so ordering them by start keeps the
+        # merged frame sorted by date. categorical columns of the pieces are
+        # merged over the union of their vocabularies.
+        pieces = [(s.start, s.between(start_date, end_date)) for s in overlapping]
+        pieces += [(s.start, s.data) for s in fetched]
+        parts = [part for _, part in sorted(pieces, key=lambda piece: piece[0])]
+        return concat_frames(parts)
+
+    def invalidate(self, table_name: str | None = None) -> None:
+        with self.lock:
+            for key in list(self.segments):
+                if table_name is None or key[0] == table_name:
+                    self.stats.bytes -= self.segments.pop(key).nbytes
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return asdict(self.stats)
+
+    def _drop_stale(self, table_name: str, version: str) -> None:
+        for key, segment in list(self.segments.items()):
+            if key[0] == table_name and segment.version != version:
+                self.stats.bytes -= self.segments.pop(key).nbytes
+                self.stats.stale_drops += 1
+
+    def _table_segments(self, table_name: str, columns: tuple[str, ...] | None) -> list[CacheSegment]:
+        return [s for (t, c, _), s in self.segments.items() if t == table_name and c == columns]
+
+    def _gaps(self, start: date, end: date, overlapping: list[CacheSegment]) -> list[tuple[date, date]]:
+        gaps = []
+        cursor = start
+        for segment in overlapping:
+            if segment.start > cursor:
+                gaps.append((cursor, segment.start - timedelta(days=1)))
+            cursor = max(cursor, segment.end + timedelta(days=1))
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def _make_segment(self, start: date, end: date, data: pd.DataFrame, version: str) -> CacheSegment:
+        data = data.sort_values('date', kind='stable').reset_index(drop=True)
+        dates = pd.to_datetime(data['date']).to_numpy().astype('datetime64[D]')
+        return CacheSegment(
+            start=start,
+            end=end,
+            data=data,
+            dates=dates,
+            nbytes=int(data.memory_usage(index=True, deep=True).sum()),
+            version=version
+        )
+
+    def _insert(self, table_name: str, columns: tuple[str, ...] | None, segment: CacheSegment) -> None:
+        # anything larger than the whole budget is served but never kept
+        if segment.nbytes > self.max_bytes:
+            return
+
+        # two requests may have raced to fetch the same gap; keep the first
+        if any(s.start <= segment.end and s.end >= segment.start for s in self._table_segments(table_name, columns)):
+            return
+
+        self.segments[(table_name, columns, segment.start)] = segment
+        self.stats.bytes += segment.nbytes
+
+        # evict least recently used segments (across all tables) until
+        # we are back under budget
+        while self.stats.bytes > self.max_bytes:
+            _, victim = self.segments.popitem(last=False)
+            self.stats.bytes -= victim.nbytes
+            self.stats.evictions += 1
@@ -0,0 +1,132 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pa_fs
+from .BoundsCache import BoundsCache, TableMetadata
+from .DataSource import DataSource
+from .Instrumentation import metrics
+from .CompactFrame import FACTOR_COLUMNS, compact_frame
+
+class ParquetDataSource(DataSource):
+    # reads the tables straight from parquet dumps, with no database: each
+    # table is root/<table>.parquet (as in data/dump) or a directory of
+    # parquet files root/<table>/. date ranges and tickers are pushed down
+    # into the scan, so row groups whose statistics fall outside the range
+    # are skipped; dumps sorted by date get the most out of that.
+    def __init__(
+        self,
+        root: str,
+        memory_map: bool = True,
+        bounds_ttl: float = 300.0,
+        compact: bool = True,
+        float32_factors: bool = False
+    ) -> None:
+        self.root = root
+
+        # string columns come back dictionary encoded and factors optionally
+        # as float32, as with PSQLDataBase
+        self.compact = compact
+        self.float32_columns = FACTOR_COLUMNS if float32_factors else []
+
+        # memory mapped files are paged in by the os as the scan touches
+        # them, rather than read into buffers up front
+        self.filesystem = pa_fs.LocalFileSystem(use_mmap=memory_map)
+        self.datasets: dict[str, ds.Dataset] = {}
+
+        # per-table min/max dates and month list, refreshed after bounds_ttl
+        # seconds or when invalidate is called
+        self.bounds_cache = BoundsCache(self._load_metadata, bounds_ttl)
+
+    def table_metadata(self, table: str) -> TableMetadata:
+        return self.bounds_cache.get(table)
+
+    def _load_metadata(self, table: str) -> TableMetadata:
+        # only the date column is read for the bounds and per-month counts.
+        # the files are looked up afresh, as they may have been replaced,
+        # and their sizes and modification times go into the data version.
+        self.datasets.pop(table, None)
+        dataset = self._dataset(table)
+        counts = pc.value_counts(dataset.to_table(columns=['date'])['date'].combine_chunks())
+        date_counts = pd.DataFrame({
+            'date': counts.field('values').to_pandas(),
+            'n': counts.field('counts').to_numpy()
+        }).dropna()
+
+        stamps = []
+        for path in sorted(dataset.files):
+            stat = os.stat(path)
+            stamps.append(f'{path}:{stat.st_size}:{stat.st_mtime_ns}')
+        return TableMetadata.from_date_counts(date_counts, dataset.schema.names, load_stamp='\n'.join(stamps))
+
+    def _dataset(self, table: str) -> ds.Dataset:
+        if table not in self.datasets:
+            # table names come from requests, so only plain names are looked up
+            if os.path.basename(table) != table or table.startswith('.'):
+                raise ValueError(f'Invalid table name: {table}')
+
+            path = os.path.join(self.root, table)
+            if os.path.isdir(path):
+                source = path
+            elif os.path.isfile(path + '.parquet'):
+                source = path + '.parquet'
+            else:
+                raise ValueError(f'Table {table} does not exist in {self.root}')
+
+            self.datasets[table] = ds.dataset(source, format='parquet', filesystem=self.filesystem)
+        return self.datasets[table]
+
+    def fetch_between_dates(
+        self,
+        table_name: str,
+        start_date: str | None,
+        end_date: str | None,
+        tickers: str | None,
+        columns: list[str] | None = None
+    ) -> pd.DataFrame:
+        dataset = self._dataset(table_name)
+        date_type = dataset.schema.field('date').type
+
+        conditions = []
+        if start_date is not None:
+            conditions.append(ds.field('date') >= date_scalar(start_date, date_type))
+        if end_date is not None:
+            conditions.append(ds.field('date') <= date_scalar(end_date, date_type))
+        if tickers is not None and len(tickers) > 0:
+            conditions.append(ds.field('ticker').isin(list(tickers)))
+
+        # create conditions if they exist - otherwise read the entire table
+        condition = None
+        for c in conditions:
+            condition = c if condition is None else condition & c
+
+        # only read the columns the caller asked for
+        if columns is not None:
+            missing = [c for c in columns if c not in dataset.schema.names]
+            if missing:
+                raise ValueError(f'Invalid column names: {missing}')
+
+        with metrics.span('parquet_scan'):
+            data = dataset.to_table(columns=columns, filter=condition)
+        metrics.count('rows_fetched', data.num_rows)
+        metrics.count('frame_bytes_fetched', data.nbytes)
+
+        with metrics.span('arrow_to_pandas'):
+            data = data.to_pandas(date_as_object=True, strings_to_categorical=self.compact)
+        return compact_frame(data, self.float32_columns) if self.compact else data
+
+    def invalidate(self, table_name: str | None = None) -> None:
+        # the files may have been replaced, so forget their datasets too
+        if table_name is None:
+            self.datasets.clear()
+        else:
+            self.datasets.pop(table_name, None)
+        self.bounds_cache.invalidate(table_name)
+
+def date_scalar(value, date_type: pa.DataType) -> pa.Scalar:
+    # comparisons in a scan filter need a scalar of the column's own type
+    timestamp = pd.Timestamp(value)
+    if pa.types.is_timestamp(date_type):
+        return pa.scalar(timestamp.to_datetime64(), type=pa.timestamp('ns')).cast(date_type)
+    return pa.scalar(timestamp.date(), type=pa.date32()).cast(date_type)
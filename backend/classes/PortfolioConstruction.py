@@ -0,0 +1,38 @@
+import numpy as np
+
+def construct_weights(
+    pred_return: np.ndarray,
+    estimated_vol: np.ndarray,
+    index_weight: np.ndarray,
+    overlay_weight: float
+) -> tuple[np.ndarray, np.ndarray]:
+    # builds portfolio weights for every month at once. inputs are
+    # (months x tickers) matrices with nan wherever a ticker isn't in that
+    # month's universe, so ragged universes just work.
+    #
+    # the alpha overlay is the inverse-vol scaled predicted return, centred
+    # cross-sectionally and scaled to a gross of overlay_weight each month,
+    # on top of the passive index weights.
+    pred_return = np.atleast_2d(pred_return)
+    estimated_vol = np.atleast_2d(estimated_vol)
+    index_weight = np.atleast_2d(index_weight)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw_scores = pred_return / estimated_vol
+        raw_scores[~np.isfinite(raw_scores)] = np.nan
+
+        # months with no usable scores at all get no overlay
+        has_scores = ~np.isnan(raw_scores)
+        n_scores = has_scores.sum(axis=1, keepdims=True)
+        mean_scores = np.where(n_scores > 0, np.nansum(raw_scores, axis=1, keepdims=True) / np.maximum(n_scores, 1), 0.0)
+        centered_scores = np.where(has_scores, raw_scores - mean_scores, 0.0)
+
+        gross = np.abs(centered_scores).sum(axis=1, keepdims=True)
+        alpha_weights = np.where(gross > 0, overlay_weight * centered_scores / gross, 0.0)
+
+    # tickers with a passive weight but no score just hold the index weight;
+    # tickers outside the universe stay nan
+    portfolio_weights = index_weight + alpha_weights
+    alpha_weights = np.where(np.isnan(index_weight), np.nan, alpha_weights)
+
+    return portfolio_weights, alpha_weights
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from .CompactFrame import encode
+
+# columns the panel needs besides the model factors themselves
+PANEL_COLUMNS = [
+    'date', 'ticker', 'sector', 'index_weight',
+    'return', 't_plus_3_return', 'estimated_vol'
+]
+
+@dataclass
+class PanelView:
+    # zero-copy views into a PortfolioPanel over a contiguous month range
+    X: np.ndarray
+    t_plus_3_return: np.ndarray
+    returns: np.ndarray
+    estimated_vol: np.ndarray
+    index_weight: np.ndarray
+    ticker_codes: np.ndarray
+    sector_codes: np.ndarray
+    universe: np.ndarray
+    sector_vocab: np.ndarray
+
+    # tickers and sectors are kept as integer codes into the panel's
+    # vocabularies; these turn them back into strings for responses
+    @property
+    def tickers(self) -> np.ndarray:
+        return self.universe[self.ticker_codes]
+
+    @property
+    def sectors(self) -> np.ndarray:
+        return decode(self.sector_codes, self.sector_vocab)
+
+class PortfolioPanel:
+    def __init__(self, portfolio_data: pd.DataFrame, factors: list[str]):
+        # sort once by date so every month is a contiguous block of rows,
+        # and remember where each block starts. any month (or range of
+        # months) is then just a slice into the column arrays below.
+        data = portfolio_data.sort_values(['date', 'ticker'], kind='stable')
+        dates = pd.to_datetime(data['date']).to_numpy().astype('datetime64[D]')
+
+        self.month_ends, starts = np.unique(dates, return_index=True)
+        self.months = self.month_ends.astype(object)   # as datetime.date
+        self.offsets = np.append(starts, len(dates))
+        self.factors = factors
+
+        self.X = np.ascontiguousarray(data[factors].to_numpy(dtype=np.float64))
+        self.t_plus_3_return = data['t_plus_3_return'].to_numpy(dtype=np.float64)
+        self.returns = data['return'].to_numpy(dtype=np.float64)
+        self.estimated_vol = data['estimated_vol'].to_numpy(dtype=np.float64)
+        self.index_weight = data['index_weight'].to_numpy(dtype=np.float64)
+
+        # integer ticker codes and month ids per row, so any column can be
+        # laid out as a dense (months x tickers) matrix. tickers and sectors
+        # are only held as codes into sorted vocabularies; categorical
+        # columns (see CompactFrame) are encoded without touching a string.
+        self.ticker_codes, self.universe = encode(data['ticker'])
+        self.sector_codes, self.sector_vocab = encode(data['sector'])
+        self.month_ids = np.repeat(np.arange(len(self.month_ends)), np.diff(self.offsets))
+
+    def __len__(self) -> int:
+        return len(self.month_ends)
+
+    def months_between(self, start_date, end_date) -> tuple[int, int]:
+        # inclusive month indices covering [start_date, end_date]. the
+        # range is empty (first > last) if no month falls inside it.
+        start = np.datetime64(pd.to_datetime(start_date).date(), 'D')
+        end = np.datetime64(pd.to_datetime(end_date).date(), 'D')
+        first = int(np.searchsorted(self.month_ends, start, side='left'))
+        last = int(np.searchsorted(self.month_ends, end, side='right')) - 1
+        return first, last
+
+    def rows(self, first: int, last: int | None = None) -> slice:
+        if last is None:
+            last = first
+        last = max(last, first - 1)
+        return slice(int(self.offsets[first]), int(self.offsets[last + 1]))
+
+    def matrix(self, values: np.ndarray, first: int, last: int | None = None) -> np.ndarray:
+        # scatter per-row values for months [first, last] into a
+        # (months x universe) matrix, with nan where a ticker is absent.
+        # values is either a full panel column or just those months' rows.
+        if last is None:
+            last = first
+        rows = self.rows(first, last)
+        if len(values) == len(self.month_ids):
+            values = values[rows]
+
+        matrix = np.full((max(last - first + 1, 0), len(self.universe)), np.nan)
+        matrix[self.month_ids[rows] - first, self.ticker_codes[rows]] = values
+        return matrix
+
+    def view(self, first: int, last: int | None = None) -> PanelView:
+        rows = self.rows(first, last)
+        return PanelView(
+            X=self.X[rows],
+            t_plus_3_return=self.t_plus_3_return[rows],
+            returns=self.returns[rows],
+            estimated_vol=self.estimated_vol[rows],
+            index_weight=self.index_weight[rows],
+            ticker_codes=self.ticker_codes[rows],
+            sector_codes=self.sector_codes[rows],
+            universe=self.universe,
+            sector_vocab=self.sector_vocab
+        )
+
+def decode(codes: np.ndarray, vocabulary: np.ndarray) -> np.ndarray:
+    # codes back to values, None where a code is -1 (missing)
+    values = np.asarray(vocabulary, dtype=object)[codes]
+    values[codes < 0] = None
+    return values
@@ -8,12 +8,32 @@ class BacktestRequest(BaseModel):
     overlay_weight: float       # the long/short component overlay weight - 0.6 indicates a 30/30 overlay (30 + 30)
     transaction_costs: float    # transaction costs assumption
 
+class SweepRequest(BaseModel):
+    start_date: str                 # start date of every backtest in the sweep
+    end_date: str                   # end date of every backtest in the sweep
+    lookbacks: list[int]            # lookback windows to try
+    factor_sets: list[list[str]]    # factor subsets to try
+    overlay_weights: list[float]    # overlay weights to try
+    transaction_costs: list[float]  # transaction cost assumptions to try
+
+class SimulationRequest(BaseModel):
+    backtest_id: str            # backtest whose weights to simulate holding
+    initial_capital: float      # starting capital of the portfolio
+    transaction_costs: float    # cost per unit of traded notional - 0.001 is 10bps
+
 class WeightRequest(BaseModel):
     date: str                   # end of month to find index weights for
     factors: list[str]          # list of factors the user wishes to use from ['EVEBIT', 'EVEBITDA', 'PE', 'PB', 'PS', 'MOMENTUM']
     overlay_weight: float       # the long/short component overlay weight - 0.6 indicates a 30/30 overlay (30 + 30)
     lookback: int               # months to look back
 
+class WeightRangeRequest(BaseModel):
+    start_date: str             # first month to find weights for
+    end_date: str               # last month to find weights for
+    factors: list[str]          # list of factors the user wishes to use from ['EVEBIT', 'EVEBITDA', 'PE', 'PB', 'PS', 'MOMENTUM']
+    overlay_weight: float       # the long/short component overlay weight - 0.6 indicates a 30/30 overlay (30 + 30)
+    lookback: int               # months to look back
+
 class DataRequest(BaseModel):
     table_name: str             # name of the table to get data from
     start_date: str | None      # start date of data fetching   
@@ -8,4 +8,6 @@ class ErrorResponse(BaseModel):
 class WeightsResponse(BaseModel):
     portfolio_weights: dict
     model_coef: dict
-    sector_weights: dict
\ No newline at end of file
+    sector_weights: dict
+class DatedWeightsResponse(WeightsResponse):
+    date: str
@@ -0,0 +1,169 @@
+import numpy as np
+from dataclasses import dataclass
+
+@dataclass
+class RidgeFit:
+    # mirrors the parts of a fitted sklearn Ridge that we actually use
+    coef_: np.ndarray
+    intercept_: float
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return np.asarray(X, dtype=np.float64) @ self.coef_ + self.intercept_
+
+@dataclass
+class RidgeStats:
+    # sufficient statistics for a ridge fit with an intercept. we keep
+    # them centred (means + centred cross products) rather than as raw
+    # sums, so adding and removing months doesn't lose precision.
+    n: int
+    x_mean: np.ndarray
+    y_mean: float
+    xx: np.ndarray      # centred X'X, (k, k)
+    xy: np.ndarray      # centred X'y, (k,)
+
+    @classmethod
+    def empty(cls, n_features: int) -> 'RidgeStats':
+        return cls(
+            n=0,
+            x_mean=np.zeros(n_features),
+            y_mean=0.0,
+            xx=np.zeros((n_features, n_features)),
+            xy=np.zeros(n_features)
+        )
+
+    @classmethod
+    def from_arrays(cls, X: np.ndarray, y: np.ndarray) -> 'RidgeStats':
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        # rows missing a factor or the target can't be used in a fit, so
+        # they are left out, as they are from the statistics that
+        # data/build_factor_stats.py precomputes
+        complete = np.isfinite(X).all(axis=1) & np.isfinite(y)
+        if not complete.all():
+            X, y = X[complete], y[complete]
+
+        if len(y) == 0:
+            return cls.empty(X.shape[1])
+
+        x_mean = X.mean(axis=0)
+        y_mean = float(y.mean())
+        Xc = X - x_mean
+        return cls(
+            n=len(y),
+            x_mean=x_mean,
+            y_mean=y_mean,
+            xx=Xc.T @ Xc,
+            xy=Xc.T @ (y - y_mean)
+        )
+
+    @classmethod
+    def from_sums(cls, n: int, sum_x: np.ndarray, sum_y: float, sum_xx: np.ndarray, sum_xy: np.ndarray) -> 'RidgeStats':
+        # from raw sums (sum of x, x x', x y...), e.g. precomputed by the
+        # database for one month
+        if n == 0:
+            return cls.empty(len(sum_x))
+
+        x_mean = np.asarray(sum_x, dtype=np.float64) / n
+        y_mean = float(sum_y) / n
+        return cls(
+            n=int(n),
+            x_mean=x_mean,
+            y_mean=y_mean,
+            xx=np.asarray(sum_xx, dtype=np.float64) - n * np.outer(x_mean, x_mean),
+            xy=np.asarray(sum_xy, dtype=np.float64) - n * x_mean * y_mean
+        )
+
+    def __add__(self, other: 'RidgeStats') -> 'RidgeStats':
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            return other
+
+        # pairwise (chan et al.) merge of the centred moments
+        n = self.n + other.n
+        dx = other.x_mean - self.x_mean
+        dy = other.y_mean - self.y_mean
+        scale = self.n * other.n / n
+        return RidgeStats(
+            n=n,
+            x_mean=self.x_mean + dx * other.n / n,
+            y_mean=self.y_mean + dy * other.n / n,
+            xx=self.xx + other.xx + scale * np.outer(dx, dx),
+            xy=self.xy + other.xy + scale * dx * dy
+        )
+
+    def __sub__(self, other: 'RidgeStats') -> 'RidgeStats':
+        if other.n == 0:
+            return self
+        if other.n >= self.n:
+            return RidgeStats.empty(len(self.x_mean))
+
+        # exact inverse of __add__: recover the moments of the remainder
+        n = self.n - other.n
+        x_mean = (self.n * self.x_mean - other.n * other.x_mean) / n
+        y_mean = (self.n * self.y_mean - other.n * other.y_mean) / n
+        dx = other.x_mean - x_mean
+        dy = other.y_mean - y_mean
+        scale = n * other.n / self.n
+        return RidgeStats(
+            n=n,
+            x_mean=x_mean,
+            y_mean=y_mean,
+            xx=self.xx - other.xx - scale * np.outer(dx, dx),
+            xy=self.xy - other.xy - scale * dx * dy
+        )
+
+    def subset(self, idx: list[int]) -> 'RidgeStats':
+        # statistics for a subset of the features, e.g. one factor set out
+        # of the union a sweep was loaded with
+        return RidgeStats(
+            n=self.n,
+            x_mean=self.x_mean[idx],
+            y_mean=self.y_mean,
+            xx=self.xx[np.ix_(idx, idx)],
+            xy=self.xy[idx]
+        )
+
+    def solve(self, alpha: float = 1.0) -> RidgeFit:
+        # same problem sklearn's Ridge(fit_intercept=True) solves: ridge on
+        # the centred data, with the intercept recovered from the means
+        k = len(self.x_mean)
+        coef = np.linalg.solve(self.xx + alpha * np.eye(k), self.xy)
+        return RidgeFit(
+            coef_=coef,
+            intercept_=float(self.y_mean - self.x_mean @ coef)
+        )
+
+class RollingRidge:
+    def __init__(self, month_stats: list[RidgeStats], alpha: float = 1.0):
+        # month_stats[m] holds the statistics for month m alone. windows
+        # are inclusive [start, end] month indices.
+        self.month_stats = month_stats
+        self.alpha = alpha
+        self.start = 0
+        self.end = -1
+        self.window = RidgeStats.empty(len(month_stats[0].x_mean)) if month_stats else None
+
+    def _rebuild(self, start: int, end: int) -> None:
+        window = RidgeStats.empty(len(self.month_stats[0].x_mean))
+        for m in range(start, end + 1):
+            window = window + self.month_stats[m]
+        self.window, self.start, self.end = window, start, end
+
+    def fit_window(self, start: int, end: int) -> RidgeFit:
+        # slide the current window onto [start, end], only touching the
+        # months entering and leaving it. if the new window doesn't overlap
+        # the old one it's cheaper (and exact) to just rebuild it.
+        if start > self.end or end < self.start or end < self.end:
+            self._rebuild(start, end)
+        else:
+            for m in range(self.end + 1, end + 1):
+                self.window = self.window + self.month_stats[m]
+            for m in range(self.start, start):
+                self.window = self.window - self.month_stats[m]
+            for m in range(start, self.start):
+                self.window = self.window + self.month_stats[m]
+            self.start, self.end = start, end
+
+        return self.window.solve(self.alpha)
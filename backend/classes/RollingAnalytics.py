@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+
+# every metric rolling_analytics can compute. volatility, tracking error,
+# alpha and the information ratio are annualised from monthly returns.
+METRICS = ['beta', 'alpha', 'tracking_error', 'information_ratio', 'volatility', 'drawdown']
+
+def _window_sums(values: np.ndarray, window: int) -> np.ndarray:
+    # sum over the trailing window ending at each month, from one running
+    # sum. the first window - 1 months don't have a full window and are nan.
+    running = np.concatenate([[0.0], np.cumsum(values)])
+    sums = np.full(len(values), np.nan)
+    sums[window - 1:] = running[window:] - running[:-window]
+    return sums
+
+def check_metrics(metrics: list[str], window: int) -> None:
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown metrics {unknown}. Expected some of {METRICS}"
+        )
+    if window < 2:
+        raise HTTPException(
+            status_code=400,
+            detail='The window has to be at least 2 months.'
+        )
+
+def rolling_analytics(
+    portfolio_returns: np.ndarray,
+    passive_returns: np.ndarray,
+    window: int,
+    metrics: list[str] | None = None
+) -> dict[str, np.ndarray]:
+    # rolling risk metrics of the portfolio against the passive index, all
+    # from the same handful of running sums, so any window is one pass over
+    # the returns rather than a pandas rolling job per metric.
+    metrics = METRICS if metrics is None else metrics
+    check_metrics(metrics, window)
+
+    p = np.asarray(portfolio_returns, dtype=np.float64)
+    b = np.asarray(passive_returns, dtype=np.float64)
+
+    # (co)variances don't care about a shift, and centring first keeps the
+    # running sums small so differencing them doesn't lose precision
+    p_shift, b_shift = (p.mean(), b.mean()) if len(p) else (0.0, 0.0)
+    pc, bc = p - p_shift, b - b_shift
+    ac = pc - bc
+
+    n = window
+    sum_p, sum_b, sum_a = _window_sums(pc, n), _window_sums(bc, n), _window_sums(ac, n)
+    mean_p, mean_b, mean_a = sum_p / n + p_shift, sum_b / n + b_shift, sum_a / n + (p_shift - b_shift)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_p = (_window_sums(pc * pc, n) - sum_p * sum_p / n) / (n - 1)
+        var_b = (_window_sums(bc * bc, n) - sum_b * sum_b / n) / (n - 1)
+        var_a = (_window_sums(ac * ac, n) - sum_a * sum_a / n) / (n - 1)
+        cov_pb = (_window_sums(pc * bc, n) - sum_p * sum_b / n) / (n - 1)
+
+        beta = cov_pb / var_b
+        tracking_error = np.sqrt(np.maximum(var_a, 0.0)) * np.sqrt(12)
+
+        results = {
+            'beta': beta,
+            'alpha': (mean_p - beta * mean_b) * 12,
+            'tracking_error': tracking_error,
+            'information_ratio': mean_a * 12 / tracking_error,
+            'volatility': np.sqrt(np.maximum(var_p, 0.0)) * np.sqrt(12)
+        }
+
+    if 'drawdown' in metrics:
+        # drawdown of the portfolio from its running peak, which doesn't
+        # depend on the window
+        wealth = np.cumprod(1 + p)
+        results['drawdown'] = wealth / np.maximum.accumulate(np.maximum(wealth, 1.0)) - 1
+
+    return {m: np.where(np.isfinite(results[m]), results[m], np.nan) for m in metrics}
+
+def rolling_frame(dates: list, analytics: dict[str, np.ndarray]) -> pd.DataFrame:
+    # months with a full window only, as the api serves them
+    frame = pd.DataFrame({'date': dates, **analytics})
+    return frame.dropna(subset=[m for m in analytics if m != 'drawdown'] or None)
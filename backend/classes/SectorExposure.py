@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from datetime import date
+
+@dataclass
+class SectorExposure:
+    # long and short weight per (month, sector), as (months x sectors)
+    # matrices over a sorted sector vocabulary. tickers counts the rows
+    # behind each pair, so sectors absent in a month can be told apart.
+    dates: list[date]
+    sectors: np.ndarray
+    long: np.ndarray
+    short: np.ndarray
+    tickers: np.ndarray
+
+    @classmethod
+    def from_weights(
+        cls,
+        weights: np.ndarray,
+        sectors: np.ndarray,
+        month_ids: np.ndarray | None = None,
+        dates: list[date] | None = None
+    ) -> 'SectorExposure':
+        # weights, sectors and month_ids are per row (ticker-month)
+        sector_codes, vocab = pd.factorize(np.asarray(sectors, dtype=object), sort=True)
+        return cls.from_codes(weights, sector_codes, vocab, month_ids, dates)
+
+    @classmethod
+    def from_codes(
+        cls,
+        weights: np.ndarray,
+        sector_codes: np.ndarray,
+        vocab: np.ndarray,
+        month_ids: np.ndarray | None = None,
+        dates: list[date] | None = None
+    ) -> 'SectorExposure':
+        # as from_weights, with sectors already integer codes into a sorted
+        # vocab (-1 for none), as the panel holds them. every (month, sector)
+        # pair is reduced in one bincount rather than a groupby per month.
+        # rows without a sector are left out.
+        weights = np.nan_to_num(np.asarray(weights, dtype=np.float64))
+        sector_codes = np.asarray(sector_codes, dtype=np.int64)
+        month_ids = np.zeros(len(weights), dtype=np.int64) if month_ids is None else np.asarray(month_ids, dtype=np.int64)
+        dates = [None] if dates is None else list(dates)
+
+        has_sector = sector_codes >= 0
+        n_months, n_sectors = len(dates), len(vocab)
+
+        cells = month_ids[has_sector] * n_sectors + sector_codes[has_sector]
+        weights = weights[has_sector]
+        shape = (n_months, n_sectors)
+        return cls(
+            dates=dates,
+            sectors=np.asarray(vocab, dtype=object),
+            long=np.bincount(cells, weights=np.maximum(weights, 0.0), minlength=n_months * n_sectors).reshape(shape),
+            short=np.bincount(cells, weights=np.minimum(weights, 0.0), minlength=n_months * n_sectors).reshape(shape),
+            tickers=np.bincount(cells, minlength=n_months * n_sectors).reshape(shape)
+        )
+
+    @classmethod
+    def from_long(cls, data: pd.DataFrame) -> 'SectorExposure':
+        # inverse of to_long
+        date_codes, dates = pd.factorize(data['date'], sort=True)
+        sector_codes, sectors = pd.factorize(data['sector'], sort=True)
+        shape = (len(dates), len(sectors))
+        long, short, tickers = np.zeros(shape), np.zeros(shape), np.zeros(shape, dtype=np.int64)
+        long[date_codes, sector_codes] = data['long'].to_numpy()
+        short[date_codes, sector_codes] = data['short'].to_numpy()
+        tickers[date_codes, sector_codes] = data['tickers'].to_numpy()
+        return cls(dates=list(dates), sectors=np.asarray(sectors, dtype=object), long=long, short=short, tickers=tickers)
+
+    @property
+    def net(self) -> np.ndarray:
+        return self.long + self.short
+
+    @property
+    def gross(self) -> np.ndarray:
+        return self.long - self.short
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def month(self, i: int = 0) -> dict:
+        # {sector: {long, short, net, gross}} for the sectors in one month,
+        # as the weights endpoints serve it
+        present = np.flatnonzero(self.tickers[i])
+        return {
+            sector: {
+                'long': long,
+                'short': short,
+                'net': long + short,
+                'gross': long - short
+            }
+            for sector, long, short in zip(
+                self.sectors[present].tolist(),
+                self.long[i, present].tolist(),
+                self.short[i, present].tolist()
+            )
+        }
+
+    def to_long(self) -> pd.DataFrame:
+        # one row per (date, sector) pair that has tickers
+        month_idx, sector_idx = np.nonzero(self.tickers)
+        return pd.DataFrame({
+            'date': np.asarray(self.dates, dtype=object)[month_idx],
+            'sector': self.sectors[sector_idx],
+            'tickers': self.tickers[month_idx, sector_idx],
+            'long': self.long[month_idx, sector_idx],
+            'short': self.short[month_idx, sector_idx],
+            'net': self.net[month_idx, sector_idx],
+            'gross': self.gross[month_idx, sector_idx]
+        })
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from datetime import date
+from fastapi import HTTPException
+from .DataSource import DataSource
+from .WeightMatrix import WeightMatrix
+from .CompactFrame import positions
+
+class PortfolioSimulator:
+    def __init__(
+        self,
+        target_weights: WeightMatrix,
+        returns: np.ndarray,
+        prices: np.ndarray | None = None,
+        initial_capital: float = 1_000_000.0,
+        cost_rate: float = 0.0
+    ):
+        # simulates actually holding the backtest's portfolio with some
+        # starting capital: each month we start from last month's holdings,
+        # drifted by their realised returns, trade to the new target weights
+        # and pay cost_rate per unit of traded notional (0.001 is 10bps).
+        #
+        # returns and prices are (months x tickers) matrices aligned with
+        # target_weights. the targets don't depend on what we hold, so every
+        # month can be worked out up front; afterwards any month's holdings,
+        # trades and nav are O(1) lookups into the matrices below.
+        self.dates = target_weights.dates
+        self.tickers = target_weights.tickers
+        self.initial_capital = initial_capital
+        self.cost_rate = cost_rate
+
+        targets = np.nan_to_num(target_weights.weights.astype(np.float64))
+        returns = np.nan_to_num(np.asarray(returns, dtype=np.float64))
+
+        # holdings drift with their own returns; whatever isn't invested is
+        # cash earning nothing, so weights are still fractions of the nav
+        gross_returns = (targets * returns).sum(axis=1)
+        drifted = np.zeros_like(targets)
+        if len(targets) > 1:
+            drifted[1:] = targets[:-1] * (1 + returns[:-1]) / (1 + gross_returns[:-1, None])
+
+        # the first month buys everything from cash
+        turnover = np.abs(targets - drifted).sum(axis=1)
+        costs = cost_rate * turnover
+        net_returns = (1 - costs) * (1 + gross_returns) - 1
+
+        nav_end = initial_capital * np.cumprod(1 + net_returns)
+        nav_start = np.concatenate([[initial_capital], nav_end[:-1]])
+
+        # snapshots are the post-trade targets; the pre-trade (drifted)
+        # holdings give the deltas, i.e. the trades, for any month
+        self.targets = targets.astype(np.float32)
+        self.drifted = drifted.astype(np.float32)
+        self.prices = None if prices is None else np.asarray(prices, dtype=np.float32)
+        self.gross_returns = gross_returns
+        self.net_returns = net_returns
+        self.turnover = turnover
+        self.costs = costs
+        self.nav_start = nav_start
+        self.nav_end = nav_end
+
+    @classmethod
+    def from_backtest(cls, backtest, db: DataSource, initial_capital: float, cost_rate: float) -> 'PortfolioSimulator':
+        weights = backtest.portfolio_weights
+        if len(weights) == 0:
+            raise HTTPException(
+                status_code=400,
+                detail='Backtest has no portfolio weights to simulate.'
+            )
+
+        # realised returns and prices for the backtest's months, laid out
+        # like the weight matrix
+        data = db.fetch_between_dates(
+            'portfolio_data',
+            weights.dates[0],
+            weights.dates[-1],
+            None,
+            ['date', 'ticker', 'return', 'price']
+        )
+        month_idx = pd.Index(np.asarray(weights.dates, dtype='datetime64[D]')).get_indexer(
+            pd.to_datetime(data['date']).to_numpy().astype('datetime64[D]')
+        )
+        ticker_idx = positions(weights.tickers, data['ticker'])
+        known = (month_idx >= 0) & (ticker_idx >= 0)
+
+        shape = weights.weights.shape
+        returns = np.full(shape, np.nan)
+        prices = np.full(shape, np.nan)
+        returns[month_idx[known], ticker_idx[known]] = data['return'].to_numpy(dtype=np.float64)[known]
+        prices[month_idx[known], ticker_idx[known]] = data['price'].to_numpy(dtype=np.float64)[known]
+
+        # tickers that drop out of the universe are sold at their last price
+        prices = pd.DataFrame(prices).ffill().to_numpy()
+
+        return cls(weights, returns, prices, initial_capital, cost_rate)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def month_index(self, month: date | str) -> int:
+        month = np.datetime64(pd.to_datetime(month).date(), 'D')
+        i = int(np.searchsorted(np.asarray(self.dates, dtype='datetime64[D]'), month))
+        if i == len(self.dates) or np.datetime64(self.dates[i], 'D') != month:
+            raise HTTPException(
+                status_code=400,
+                detail=f'{month} is not a month of this simulation. '
+                    f'First month: {self.dates[0]}, last month: {self.dates[-1]}'
+            )
+        return i
+
+    def summary(self) -> pd.DataFrame:
+        # nav, returns and trading per month
+        return pd.DataFrame({
+            'date': self.dates,
+            'nav_start': self.nav_start,
+            'nav_end': self.nav_end,
+            'gross_return': self.gross_returns,
+            'net_return': self.net_returns,
+            'turnover': self.turnover,
+            'cost': self.costs * self.nav_start
+        })
+
+    def state(self, i: int) -> dict:
+        # the portfolio right after month i's rebalance
+        nav = self.nav_start[i] * (1 - self.costs[i])
+        held = np.flatnonzero(self.targets[i])
+        weights = self.targets[i, held].astype(np.float64)
+
+        holdings = pd.DataFrame({
+            'ticker': self.tickers[held],
+            'weight': weights,
+            'notional': weights * nav
+        })
+        if self.prices is not None:
+            holdings['price'] = self.prices[i, held]
+            holdings['shares'] = holdings['notional'] / holdings['price']
+
+        return {
+            'date': self.dates[i],
+            'nav': float(nav),
+            'cash': float(nav * (1 - weights.sum())),
+            'turnover': float(self.turnover[i]),
+            'cost': float(self.costs[i] * self.nav_start[i]),
+            'holdings': holdings
+        }
+
+    def trades(self, i: int) -> pd.DataFrame:
+        # trade list taking the drifted holdings to month i's targets
+        delta = self.targets[i] - self.drifted[i]
+        traded = np.flatnonzero(delta)
+        trade_weight = delta[traded].astype(np.float64)
+
+        trades = pd.DataFrame({
+            'ticker': self.tickers[traded],
+            'from_weight': self.drifted[i, traded],
+            'to_weight': self.targets[i, traded],
+            'trade_weight': trade_weight,
+            'notional': trade_weight * self.nav_start[i],
+            'side': np.where(trade_weight > 0, 'buy', 'sell')
+        })
+        if self.prices is not None:
+            trades['price'] = self.prices[i, traded]
+            trades['shares'] = trades['notional'] / trades['price']
+
+        return trades
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from datetime import date
+
+@dataclass
+class WeightMatrix:
+    # portfolio weights through time as one dense (months x tickers)
+    # matrix over a shared ticker vocabulary, rather than a python list of
+    # (ticker, weight) tuples per month. nan means not held that month.
+    dates: list[date]
+    tickers: np.ndarray
+    weights: np.ndarray
+
+    @classmethod
+    def from_rows(cls, dates: list[date], tickers: np.ndarray, rows: list[np.ndarray], dtype=np.float32) -> 'WeightMatrix':
+        weights = np.vstack(rows).astype(dtype) if rows else np.empty((0, len(tickers)), dtype=dtype)
+        return cls(dates=list(dates), tickers=np.asarray(tickers, dtype=object), weights=weights)
+
+    @classmethod
+    def from_long(cls, data: pd.DataFrame, dtype=np.float32) -> 'WeightMatrix':
+        # inverse of to_long
+        date_codes, dates = pd.factorize(data['date'], sort=True)
+        ticker_codes, tickers = pd.factorize(data['ticker'], sort=True)
+        weights = np.full((len(dates), len(tickers)), np.nan, dtype=dtype)
+        weights[date_codes, ticker_codes] = data['weight'].to_numpy()
+        return cls(dates=list(dates), tickers=np.asarray(tickers, dtype=object), weights=weights)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @property
+    def nbytes(self) -> int:
+        return self.weights.nbytes
+
+    def month(self, i: int) -> list[tuple[str, float]]:
+        # (ticker, weight) pairs held in month i
+        held = ~np.isnan(self.weights[i])
+        return list(zip(self.tickers[held].tolist(), self.weights[i, held].tolist()))
+
+    def to_long(self) -> pd.DataFrame:
+        # sparse (date, ticker, weight) rows, only for held positions
+        month_idx, ticker_idx = np.nonzero(~np.isnan(self.weights))
+        return pd.DataFrame({
+            'date': np.asarray(self.dates, dtype=object)[month_idx],
+            'ticker': self.tickers[ticker_idx],
+            'weight': self.weights[month_idx, ticker_idx]
+        })
@@ -1,38 +1,113 @@
 from typing import Union, Dict
 from fastapi import FastAPI
 from dotenv import load_dotenv
+from classes.DataSource import DataSource
 from classes.DataBase import PSQLDataBase
+from classes.ParquetDataSource import ParquetDataSource
 from classes.AlphaModel import AlphaModel
 from classes.BackTest import BackTest
-from classes.Requests import DataRequest, WeightRequest, BacktestRequest
+from classes.BacktestSweep import BacktestSweep, SweepPool
+from classes.BacktestStore import BacktestStore, backtest_key
+from classes.BacktestJobs import BacktestJobQueue
+from classes.Simulator import PortfolioSimulator
+from classes.Requests import DataRequest, WeightRequest, WeightRangeRequest, BacktestRequest, SweepRequest, SimulationRequest
 from classes.Responses import ErrorResponse
-from fastapi import Depends, HTTPException
-from fastapi.responses import JSONResponse
+from classes.Encoding import negotiate_format, frame_response, json_response, records, TimedJSONResponse
+from classes.CompactFrame import expand_frame
+from classes.Instrumentation import metrics, request_spans, server_timing
+from fastapi import Depends, HTTPException, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import pandas as pd
+import asyncio
+import hashlib
+import json
 import os
-import uuid
+import threading
+import time
 
 """
 Caches and other stuff
 """
 
 # for caching backtests, such that users can run
-# backtest diagnostics after running initial backtest
-# i think for now we can tie backtests to a UUID tag, and then
-# each time a client wants a 
-backtest_cache: Dict[uuid.UUID, BackTest] = {}
+# backtest diagnostics after running initial backtest.
+# backtests are keyed by a hash of their request and the data version, and
+# persisted to disk, so they survive restarts and are shared between
+# workers; only the most recently used ones stay in memory
+backtest_cache = BacktestStore(
+    os.getenv('BACKTEST_STORE_DIR', os.path.join(os.path.dirname(__file__), 'backtest_store')),
+    max_in_memory=int(os.getenv('BACKTEST_CACHE_SIZE', 32))
+)
+
+# portfolio simulations of cached backtests, so users can step through
+# their months. they are cheap to rebuild, so they only live in memory.
+simulation_cache: OrderedDict[str, PortfolioSimulator] = OrderedDict()
+simulation_cache_size = int(os.getenv('SIMULATION_CACHE_SIZE', 16))
+simulation_lock = threading.Lock()
+
+# long backtests can be submitted as background jobs instead, run on a pool
+# of JOB_WORKERS processes. finished ones land in backtest_cache, so the
+# analytics endpoints work on them as usual.
+backtest_jobs = BacktestJobQueue(
+    backtest_cache,
+    max_workers=int(os.getenv('JOB_WORKERS', os.cpu_count() or 1)),
+    max_pending=int(os.getenv('JOB_QUEUE_SIZE', 64))
+)
+
+# sweeps fit their configurations on one long-lived pool of SWEEP_WORKERS
+# processes, started with the first sweep
+sweep_pool = SweepPool(int(os.getenv('SWEEP_WORKERS', os.cpu_count() or 1)))
 
 """
 Ensure you have run the database setup steps found in /data
 """
 
 load_dotenv('../.env')
-db_url = os.getenv('DB_URL')
-db = PSQLDataBase(db_url)
 
-app = FastAPI()
+# DATA_BACKEND picks where the tables are read from: 'postgres' (DB_URL), or
+# 'parquet', which reads the dumps in PARQUET_ROOT directly with no database
+# process (PARQUET_MEMORY_MAP=0 turns off memory mapping).
+# either way tickers, sectors and indices are kept dictionary encoded in
+# memory (PANEL_COMPACT=0 keeps plain strings), and PANEL_FLOAT32=1 also
+# stores the factor columns as float32
+data_backend = os.getenv('DATA_BACKEND', 'postgres')
+panel_compact = bool(int(os.getenv('PANEL_COMPACT', 1)))
+panel_float32 = bool(int(os.getenv('PANEL_FLOAT32', 0)))
+panel_dtype = 'float32' if panel_float32 else 'float64'
+db: DataSource
+if data_backend == 'postgres':
+    db_url = os.getenv('DB_URL')
+    db = PSQLDataBase(
+        db_url,
+        cache_bytes=int(os.getenv('PANEL_CACHE_BYTES', 1 << 30)),
+        bounds_ttl=float(os.getenv('BOUNDS_TTL_SECONDS', 300)),
+        pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        compact=panel_compact,
+        float32_factors=panel_float32
+    )
+elif data_backend == 'parquet':
+    db = ParquetDataSource(
+        os.getenv('PARQUET_ROOT', os.path.join(os.path.dirname(__file__), '../data/dump')),
+        memory_map=bool(int(os.getenv('PARQUET_MEMORY_MAP', 1))),
+        bounds_ttl=float(os.getenv('BOUNDS_TTL_SECONDS', 300)),
+        compact=panel_compact,
+        float32_factors=panel_float32
+    )
+else:
+    raise ValueError(f"Unknown DATA_BACKEND '{data_backend}', expected 'postgres' or 'parquet'")
+
+# timings of each stage (queries, fits, encoding...) and per endpoint
+# latencies, served from /v1/metrics. METRICS_ENABLED=0 turns them off;
+# SERVER_TIMING=1 also sends each request's stage timings back in a
+# Server-Timing header.
+metrics.enabled = bool(int(os.getenv('METRICS_ENABLED', 1)))
+metrics.server_timing = bool(int(os.getenv('SERVER_TIMING', 0)))
+
+app = FastAPI(default_response_class=TimedJSONResponse)
 
 # you shouldn't include this for production level
 app.add_middleware(
@@ -44,6 +119,34 @@ app.add_middleware(
 )
 
 
+async def instrument_requests(request: Request, call_next):
+    # spans timed anywhere while handling this request are collected here
+    spans = []
+    token = request_spans.set(spans)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.record_request(request.method + ' ' + request.url.path, 500, time.perf_counter() - start)
+        raise
+    finally:
+        request_spans.reset(token)
+    elapsed = time.perf_counter() - start
+
+    # keyed by route template, so /v1/jobs/{job_id} is one endpoint
+    route = request.scope.get('route')
+    endpoint = f"{request.method} {route.path if route is not None else request.url.path}"
+    metrics.record_request(endpoint, response.status_code, elapsed)
+
+    if metrics.server_timing:
+        response.headers['Server-Timing'] = server_timing(spans, elapsed)
+    return response
+
+# only registered with metrics on: a middleware of this kind puts every
+# response, streamed ones included, through an extra task and queue
+if metrics.enabled:
+    app.middleware('http')(instrument_requests)
+
 @app.get('/')
 def root():
     return {
@@ -56,15 +159,18 @@ def v1_root():
         'message': 'You have accessed version 1 root!'
     }
 
-@app.get('/v1/backtest/analytics/factor_exposure')
-def v1_backtest_factor_exposure(backtest_id: str):
+def get_backtest(backtest_id: str) -> BackTest:
+    # a backtest run by any worker, from memory or the store on disk
     if backtest_id not in backtest_cache:
         raise HTTPException(
             status_code=400,
             detail=f'Backtest {backtest_id} does not exist in cache.'
         )
-    
-    backtest = backtest_cache[backtest_id]
+    return backtest_cache[backtest_id]
+
+@app.get('/v1/backtest/analytics/factor_exposure')
+def v1_backtest_factor_exposure(backtest_id: str):
+    backtest = get_backtest(backtest_id)
     try:
         factor_exposures = backtest.factor_exposures()
     except Exception as e:
@@ -73,54 +179,309 @@ def v1_backtest_factor_exposure(backtest_id: str):
             detail=f'{e}'
         )
     
-    return factor_exposures
+    return json_response(factor_exposures)
 
 @app.get('/v1/backtest/analytics/beta_exposure')
-def v1_backtest_beta_exposure(backtest_id: str):
-    if backtest_id not in backtest_cache:
-        raise HTTPException(
-            status_code=400,
-            detail=f'Backtest {backtest_id} does not exist in cache.'
-        )
-    
-    backtest = backtest_cache[backtest_id]
+def v1_backtest_beta_exposure(backtest_id: str, window: int = 12):
+    backtest = get_backtest(backtest_id)
     try:
-        rolling_beta = backtest.beta_exposures(12)
+        rolling_beta = backtest.beta_exposures(window)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=400,
             detail=f'{e}'
         )
     
-    return rolling_beta
+    return json_response(rolling_beta)
+
+@app.get('/v1/backtest/analytics/sector_exposure')
+def v1_backtest_sector_exposure(request: Request, backtest_id: str, format: str | None = None):
+    # long, short, net and gross weight per (month, sector)
+    fmt = negotiate_format(request, format)
+    exposures = get_backtest(backtest_id).sector_exposures()
+    if fmt != 'records':
+        return frame_response(exposures, fmt, {'backtest_id': backtest_id})
+
+    return json_response(records(exposures))
+
+@app.get('/v1/backtest/analytics/model_diagnostics')
+def v1_backtest_model_diagnostics(request: Request, backtest_id: str, format: str | None = None):
+    # out-of-sample ic, rank ic, hit rate, r2 and prediction dispersion of
+    # every month's model, with its raw coefficients
+    fmt = negotiate_format(request, format)
+    diagnostics = get_backtest(backtest_id).model_diagnostics()
+    if fmt != 'records':
+        return frame_response(diagnostics, fmt, {'backtest_id': backtest_id})
+
+    # months without realised returns yet have nan metrics
+    return json_response(records(diagnostics))
+
+@app.get('/v1/backtest/analytics/rolling')
+def v1_backtest_rolling_analytics(
+    request: Request,
+    backtest_id: str,
+    window: int = 12,
+    metric_names: list[str] | None = Query(None, alias='metrics'),
+    format: str | None = None
+):
+    # rolling beta, alpha, tracking error, information ratio, volatility
+    # and drawdown over the given window; all of them unless metrics says
+    # otherwise (?metrics=beta&metrics=alpha)
+    fmt = negotiate_format(request, format)
+    analytics = get_backtest(backtest_id).rolling_analytics(window, metric_names)
+    if fmt != 'records':
+        return frame_response(analytics, fmt, {'backtest_id': backtest_id, 'window': window})
+
+    return json_response(records(analytics))
+
+@app.get('/v1/backtest/analytics/portfolio_weights')
+def v1_backtest_portfolio_weights(request: Request, backtest_id: str, format: str | None = None):
+    # the backtest's weights as (date, ticker, weight) rows, for held
+    # positions only. ask for columnar json or arrow for anything but
+    # small backtests.
+    fmt = negotiate_format(request, format)
+    weights = get_backtest(backtest_id).portfolio_weights.to_long()
+    if fmt == 'records':
+        return json_response(records(weights))
+
+    return frame_response(weights, fmt, {'backtest_id': backtest_id})
+
+# the endpoints below are async: database waits happen on the database
+# executor and model fitting on the threadpool, so one slow request doesn't
+# hold up every other request on the worker
 
 @app.post('/v1/backtest/backtest_between_dates')
-def v1_backtest_between_dates(req: BacktestRequest):
+async def v1_backtest_between_dates(req: BacktestRequest, request: Request, format: str | None = None):
     try:
-        backtest = BackTest(
-            req.start_date,
-            req.end_date,
-            req.lookback,
-            req.factors,
-            req.overlay_weight,
-            req.transaction_costs,
-            db
-        )
-        backtest_id = str(uuid.uuid4())
-        backtest_data = backtest.backtest()
-        backtest_cache[backtest_id] = backtest
+        fmt = negotiate_format(request, format)
+
+        # identical requests on the same data get the same id, so finished
+        # backtests are reused and concurrent ones only run once
+        data_version = (await run_in_threadpool(db.table_metadata, 'portfolio_data')).version
+        backtest_id = backtest_key(req.model_dump(), data_version, panel_dtype)
+
+        async def run_backtest() -> BackTest:
+            backtest = await run_in_threadpool(
+                BackTest,
+                req.start_date,
+                req.end_date,
+                req.lookback,
+                req.factors,
+                req.overlay_weight,
+                req.transaction_costs,
+                db
+            )
+            await backtest.backtest_async()
+            return backtest
+
+        backtest = await backtest_cache.get_or_compute(backtest_id, run_backtest)
+        if fmt != 'records':
+            return await run_in_threadpool(
+                lambda: frame_response(backtest.results_frame(), fmt, {'backtest_id': backtest_id})
+            )
+
+        backtest_data = await run_in_threadpool(backtest.results)
 
-        return {
+        return json_response({
             'backtest_id': backtest_id,
             'results': backtest_data
-        }
+        })
     except Exception as e:
         raise e
 
+@app.post('/v1/backtest/stream')
+async def v1_backtest_stream(req: BacktestRequest):
+    # same backtest as /v1/backtest/backtest_between_dates, streamed as
+    # newline delimited json: a header line with the backtest id, then one
+    # line per month as soon as that month has been fitted
+    data_version = (await run_in_threadpool(db.table_metadata, 'portfolio_data')).version
+    backtest_id = backtest_key(req.model_dump(), data_version, panel_dtype)
+    header = json.dumps({'backtest_id': backtest_id}) + '\n'
+
+    # bad dates or factors are reported now rather than mid-stream
+    backtest = await run_in_threadpool(
+        BackTest,
+        req.start_date,
+        req.end_date,
+        req.lookback,
+        req.factors,
+        req.overlay_weight,
+        req.transaction_costs,
+        db
+    )
+    await run_in_threadpool(backtest.check_factors)
+
+    # months are pulled and fitted one at a time on the threadpool, and
+    # handed to the stream through this queue. None marks the end.
+    loop = asyncio.get_running_loop()
+    months = asyncio.Queue()
+    streamed = False
+
+    async def run_streamed() -> BackTest:
+        nonlocal streamed
+        streamed = True
+
+        def run():
+            for month in backtest.iter_backtest(backtest.iter_portfolio_data()):
+                loop.call_soon_threadsafe(months.put_nowait, month)
+
+        await run_in_threadpool(run)
+        return backtest
+
+    # goes through the store like any other backtest, so a stream and a
+    # plain request for the same backtest only compute it once. if it's
+    # already stored, or being computed by another request, its months are
+    # replayed once it's done instead.
+    task = backtest_cache.start_get_or_compute(backtest_id, run_streamed)
+    task.add_done_callback(lambda _: months.put_nowait(None))
+
+    async def stream():
+        yield header
+        while (month := await months.get()) is not None:
+            yield json.dumps(month) + '\n'
+
+        finished = await task
+        if not streamed:
+            for month, coefs in zip(finished.results(), finished.model_coefficients):
+                month['coefficients'] = {f: float(coefs[f]) for f in finished.factors}
+                yield json.dumps(month, default=str) + '\n'
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+@app.post('/v1/jobs/backtest', status_code=202)
+async def v1_jobs_backtest(req: BacktestRequest):
+    # same backtest as /v1/backtest/backtest_between_dates, but run in the
+    # background: returns the job straight away, to be polled with
+    # /v1/jobs/{job_id}. the backtest id is the same as the synchronous one.
+    data_version = (await run_in_threadpool(db.table_metadata, 'portfolio_data')).version
+    backtest_id = backtest_key(req.model_dump(), data_version, panel_dtype)
+
+    # bad dates or factors are reported now rather than as a failed job
+    backtest = await run_in_threadpool(
+        BackTest,
+        req.start_date,
+        req.end_date,
+        req.lookback,
+        req.factors,
+        req.overlay_weight,
+        req.transaction_costs,
+        db
+    )
+    await run_in_threadpool(backtest.check_factors)
+
+    return await backtest_jobs.submit(backtest_id, backtest)
+
+@app.get('/v1/jobs/{job_id}')
+async def v1_jobs_status(job_id: str):
+    # progress (months done of total), eta and, once done, the backtest id
+    # to use with the analytics endpoints
+    return await run_in_threadpool(backtest_jobs.status, job_id)
+
+@app.delete('/v1/jobs/{job_id}')
+async def v1_jobs_cancel(job_id: str):
+    return await run_in_threadpool(backtest_jobs.cancel, job_id)
+
+@app.post('/v1/backtest/sweep')
+async def v1_backtest_sweep(req: SweepRequest):
+    # runs every combination of the grid over one panel load and returns
+    # a summary row per configuration. nothing is cached.
+    sweep = await run_in_threadpool(
+        BacktestSweep,
+        req.start_date,
+        req.end_date,
+        req.lookbacks,
+        req.factor_sets,
+        req.overlay_weights,
+        req.transaction_costs,
+        db,
+        sweep_pool
+    )
+    return await run_in_threadpool(sweep.run)
+
+def get_simulation(simulation_id: str) -> PortfolioSimulator:
+    with simulation_lock:
+        if simulation_id not in simulation_cache:
+            raise HTTPException(
+                status_code=400,
+                detail=f'Simulation {simulation_id} does not exist in cache.'
+            )
+        simulation_cache.move_to_end(simulation_id)
+        return simulation_cache[simulation_id]
+
+@app.post('/v1/simulation/run')
+def v1_simulation_run(req: SimulationRequest, request: Request, format: str | None = None):
+    # holds a cached backtest's portfolio with real capital, paying costs
+    # on what actually trades. returns nav, turnover and costs per month.
+    fmt = negotiate_format(request, format)
+    backtest = get_backtest(req.backtest_id)
+
+    simulation_id = hashlib.sha256(
+        json.dumps([req.backtest_id, req.initial_capital, req.transaction_costs]).encode()
+    ).hexdigest()[:32]
+
+    with simulation_lock:
+        simulation = simulation_cache.get(simulation_id)
+    if simulation is None:
+        simulation = PortfolioSimulator.from_backtest(
+            backtest,
+            db,
+            req.initial_capital,
+            req.transaction_costs
+        )
+        with simulation_lock:
+            simulation_cache[simulation_id] = simulation
+            while len(simulation_cache) > simulation_cache_size:
+                simulation_cache.popitem(last=False)
+
+    summary = simulation.summary()
+    if fmt != 'records':
+        return frame_response(summary, fmt, {'simulation_id': simulation_id})
+
+    return json_response({
+        'simulation_id': simulation_id,
+        'results': records(summary)
+    })
+
+@app.get('/v1/simulation/state')
+def v1_simulation_state(request: Request, simulation_id: str, date: str, format: str | None = None):
+    # the portfolio after the given month's rebalance. previous_date and
+    # next_date let clients step backwards and forwards through time.
+    fmt = negotiate_format(request, format)
+    simulation = get_simulation(simulation_id)
+    i = simulation.month_index(date)
+
+    state = simulation.state(i)
+    holdings = state.pop('holdings')
+    state['previous_date'] = simulation.dates[i - 1] if i > 0 else None
+    state['next_date'] = simulation.dates[i + 1] if i + 1 < len(simulation) else None
+
+    if fmt != 'records':
+        return frame_response(holdings, fmt, state)
+
+    state['holdings'] = records(holdings)
+    return json_response(state)
+
+@app.get('/v1/simulation/trades')
+def v1_simulation_trades(request: Request, simulation_id: str, date: str, format: str | None = None):
+    # trade list for the given month's rebalance
+    fmt = negotiate_format(request, format)
+    simulation = get_simulation(simulation_id)
+    trades = simulation.trades(simulation.month_index(date))
+
+    if fmt != 'records':
+        return frame_response(trades, fmt, {'simulation_id': simulation_id, 'date': date})
+
+    return json_response(records(trades))
+
 @app.post('/v1/model/weights_on_date')
-def v1_get_weights_on_date(req: WeightRequest):
+async def v1_get_weights_on_date(req: WeightRequest, request: Request, format: str | None = None):
     try:
-        weights_data = AlphaModel.get_weights_on_date(
+        fmt = negotiate_format(request, format)
+
+        weights_data = await run_in_threadpool(
+            AlphaModel.get_weights_on_date,
             req.date, 
             req.lookback,
             req.overlay_weight,
@@ -129,14 +490,87 @@ def v1_get_weights_on_date(req: WeightRequest):
         )
     except Exception as e:
         raise e
-    
+
+    if fmt != 'records':
+        # the weights are the table; coefficients and sectors ride along
+        weights = pd.DataFrame({
+            'ticker': list(weights_data.portfolio_weights.keys()),
+            'weight': list(weights_data.portfolio_weights.values())
+        })
+        return frame_response(weights, fmt, {
+            'model_coef': weights_data.model_coef,
+            'sector_weights': weights_data.sector_weights
+        })
+
     return weights_data
 
+@app.post('/v1/model/weights_range')
+async def v1_get_weights_range(req: WeightRangeRequest, request: Request, format: str | None = None):
+    # weights_on_date for every month in a range, in one response
+    fmt = negotiate_format(request, format)
+    weights_data = await run_in_threadpool(
+        AlphaModel.get_weights_between_dates,
+        req.start_date,
+        req.end_date,
+        req.lookback,
+        req.overlay_weight,
+        req.factors,
+        db
+    )
+
+    if fmt != 'records':
+        # one (date, ticker, weight) table; coefficients and sectors by date
+        weights = pd.DataFrame({
+            'date': [w.date for w in weights_data for _ in w.portfolio_weights],
+            'ticker': [t for w in weights_data for t in w.portfolio_weights.keys()],
+            'weight': [x for w in weights_data for x in w.portfolio_weights.values()]
+        })
+        return frame_response(weights, fmt, {
+            'model_coef': {w.date: w.model_coef for w in weights_data},
+            'sector_weights': {w.date: w.sector_weights for w in weights_data}
+        })
+
+    return weights_data
+
+@app.get('/v1/metrics')
+def v1_metrics():
+    # stage timings, endpoint latencies and counters since startup (or
+    # the last reset), plus the state of the caches
+    return {
+        **metrics.snapshot(),
+        'panel_cache': db.cache_stats(),
+        'backtest_store': {**backtest_cache.stats, 'in_memory': len(backtest_cache.hot)},
+        'simulation_cache': {'size': len(simulation_cache)},
+        'jobs': backtest_jobs.stats()
+    }
+
+@app.post('/v1/metrics/reset')
+def v1_metrics_reset():
+    metrics.reset()
+    return {
+        'message': 'Metrics were reset.'
+    }
+
+@app.get('/v1/data/cache_stats')
+def v1_data_cache_stats():
+    return db.cache_stats()
+
+@app.post('/v1/data/invalidate')
+def v1_data_invalidate(table_name: str | None = None):
+    # reloaded tables are picked up by themselves once their version is
+    # next checked (every BOUNDS_TTL_SECONDS); this drops cached data
+    # straight away, though only in the worker that serves the request
+    db.invalidate(table_name)
+    return {
+        'message': f'Invalidated cached data for {table_name or "all tables"}.'
+    }
+
 @app.post('/v1/data/pull_between_dates')
-def v1_data_pull_between_dates(req: DataRequest):
+async def v1_data_pull_between_dates(req: DataRequest, request: Request, format: str | None = None):
+    fmt = negotiate_format(request, format)
     try:
         # attempt to pull the data
-        data: pd.DataFrame = db.fetch_between_dates(
+        data: pd.DataFrame = await db.fetch_between_dates_async(
             req.table_name, 
             req.start_date, 
             req.end_date, 
@@ -152,10 +586,15 @@ def v1_data_pull_between_dates(req: DataRequest):
             ).model_dump()
         )
     
-    data = data.sort_values('date')
-    
+    if fmt != 'records':
+        return await run_in_threadpool(
+            lambda: frame_response(data.sort_values('date'), fmt)
+        )
+
     # otherwise return the data in json form of records
-    return data.to_dict(orient='records')
+    return await run_in_threadpool(
+        lambda: json_response(records(expand_frame(data.sort_values('date'))))
+    )
 
 
 
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the backend's classes are imported as in main.py, and the data scripts
+# as modules, so both directories go on the path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, '..', 'data'))
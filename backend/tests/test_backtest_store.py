@@ -0,0 +1,112 @@
+import asyncio
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+from benchmarks.synthetic import InMemoryDataBase, make_portfolio_data
+from classes.BackTest import BackTest
+from classes.BacktestStore import BacktestStore, backtest_key
+from classes.BoundsCache import TableMetadata
+from classes.DataBase import PSQLDataBase
+
+PARAMS = {
+    'start_date': '2000-01-31',
+    'end_date': '2001-12-31',
+    'lookback': 6,
+    'factors': ['PE', 'MOMENTUM'],
+    'overlay_weight': 0.5,
+    'transaction_costs': 0.001
+}
+
+@pytest.fixture(scope='module')
+def db():
+    return InMemoryDataBase({'portfolio_data': make_portfolio_data(n_tickers=40, n_months=24, seed=5)})
+
+def run_backtest(db, **params) -> BackTest:
+    params = {**PARAMS, **params}
+    backtest = BackTest(
+        params['start_date'],
+        params['end_date'],
+        params['lookback'],
+        params['factors'],
+        params['overlay_weight'],
+        params['transaction_costs'],
+        db
+    )
+    backtest.backtest()
+    return backtest
+
+def test_key_is_canonical():
+    key = backtest_key(PARAMS, 'v1', 'float64')
+    assert backtest_key({**PARAMS, 'factors': ['MOMENTUM', 'PE']}, 'v1', 'float64') == key
+    assert backtest_key({**PARAMS, 'start_date': '2000-1-31', 'lookback': '6'}, 'v1', 'float64') == key
+
+    assert backtest_key(PARAMS, 'v2', 'float64') != key
+    assert backtest_key({**PARAMS, 'overlay_weight': 0.25}, 'v1', 'float64') != key
+    assert backtest_key({**PARAMS, 'factors': ['PE']}, 'v1', 'float64') != key
+    # float32 factors give slightly different results
+    assert backtest_key(PARAMS, 'v1', 'float32') != key
+
+def test_version_follows_values_as_well_as_row_counts():
+    dates = pd.to_datetime(['2000-01-31', '2000-02-29'])
+    counts = pd.DataFrame({'date': dates, 'n': [10, 12]})
+    version = TableMetadata.from_date_counts(counts.assign(sum_x=[1.5, 2.0]), ['date', 'x']).version
+
+    assert TableMetadata.from_date_counts(counts.assign(sum_x=[1.5, 2.0]), ['date', 'x']).version == version
+    assert TableMetadata.from_date_counts(counts.assign(sum_x=[1.5, 2.5]), ['date', 'x']).version != version
+    # sums added up in a different order are the same version
+    assert TableMetadata.from_date_counts(counts.assign(sum_x=[1.5, 2.0 + 1e-15]), ['date', 'x']).version == version
+
+def test_database_version_changes_when_values_are_corrected(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'portfolio.db'}")
+    make_portfolio_data(n_tickers=20, n_months=6, seed=6).to_sql('portfolio_data', engine, index=False)
+    db = PSQLDataBase(str(engine.url), bounds_ttl=0)
+
+    version = db.table_metadata('portfolio_data').version
+    assert db.table_metadata('portfolio_data').version == version
+
+    # same rows, one value changed
+    with engine.begin() as conn:
+        conn.execute(text('update portfolio_data set "return" = "return" + 0.01 where rowid = 1'))
+    assert db.table_metadata('portfolio_data').version != version
+
+def test_store_keeps_only_recent_backtests_in_memory(db, tmp_path):
+    store = BacktestStore(str(tmp_path / 'store'), max_in_memory=2)
+    backtests = {f'bt{lookback}': run_backtest(db, lookback=lookback) for lookback in [4, 5, 6]}
+    for backtest_id, backtest in backtests.items():
+        store[backtest_id] = backtest
+
+    assert list(store.hot) == ['bt5', 'bt6']
+    assert all(backtest_id in store for backtest_id in backtests)
+    assert 'bt7' not in store and '../bt4' not in store
+
+    # evicted ones are read back from disk, and become the most recent
+    reloaded = store['bt4']
+    assert list(store.hot) == ['bt6', 'bt4']
+    pd.testing.assert_frame_equal(reloaded.results_frame(), backtests['bt4'].results_frame())
+    pd.testing.assert_frame_equal(
+        reloaded.portfolio_weights.to_long(),
+        backtests['bt4'].portfolio_weights.to_long()
+    )
+
+    # a fresh store over the same directory (another worker) sees them all
+    other = BacktestStore(str(tmp_path / 'store'), max_in_memory=2)
+    pd.testing.assert_frame_equal(other['bt6'].results_frame(), backtests['bt6'].results_frame())
+
+def test_concurrent_requests_compute_once(db, tmp_path):
+    store = BacktestStore(str(tmp_path / 'store'))
+    calls = []
+
+    async def compute() -> BackTest:
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return run_backtest(db)
+
+    async def main():
+        first = await asyncio.gather(*[store.get_or_compute('bt', compute) for _ in range(3)])
+        again = await store.get_or_compute('bt', compute)
+        return first, again
+
+    first, again = asyncio.run(main())
+    assert len(calls) == 1
+    assert first[0] is first[1] is first[2] is again
+    assert store.stats == {'computed': 1, 'reused': 1, 'coalesced': 2}
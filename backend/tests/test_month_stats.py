@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, text
+from build_factor_stats import build_factor_stats
+from benchmarks.synthetic import make_portfolio_data
+from classes.AlphaModel import AlphaModel
+from classes.BackTest import month_ridge_stats
+from classes.DataBase import PSQLDataBase
+from classes.PortfolioPanel import PortfolioPanel, PANEL_COLUMNS
+
+START, END = '2000-01-31', '2002-12-31'
+
+class RawRowsDataBase(PSQLDataBase):
+    # the same tables, but always fitting from the raw rows
+    def fetch_month_stats(self, start_date, end_date, factors):
+        return None
+
+@pytest.fixture(scope='module')
+def db_url(tmp_path_factory):
+    # sparse gaps in the factors and the target, as in the real data
+    data = make_portfolio_data(n_tickers=120, n_months=36, seed=1)
+    rng = np.random.default_rng(2)
+    for col in ['PE', 'PS', 't_plus_3_return']:
+        data.loc[rng.random(len(data)) < 0.03, col] = np.nan
+
+    url = f"sqlite:///{tmp_path_factory.mktemp('db') / 'portfolio.db'}"
+    engine = create_engine(url)
+    data.to_sql('portfolio_data', engine, index=False)
+    build_factor_stats(engine)
+    return url
+
+@pytest.mark.parametrize('factors', [
+    ['EVEBIT', 'EVEBITDA', 'MOMENTUM', 'PB', 'PE', 'PS'],
+    ['MOMENTUM', 'PB'],
+    ['PE', 'MOMENTUM']
+])
+def test_stats_match_raw_rows(db_url, factors):
+    db = PSQLDataBase(db_url)
+    month_stats = db.fetch_month_stats(START, END, factors)
+    panel = PortfolioPanel(
+        db.fetch_between_dates('portfolio_data', START, END, None, PANEL_COLUMNS + factors),
+        factors
+    )
+    raw_stats = month_ridge_stats(panel)
+
+    if month_stats is None:
+        # only a subset of the factors the table was built with can be
+        # turned away, when rows were left out for the others
+        assert len(factors) < 6
+        return
+
+    months, stats = month_stats
+    assert len(stats) == len(raw_stats)
+    for stored, raw in zip(stats, raw_stats):
+        assert stored.n == raw.n
+        np.testing.assert_allclose(stored.solve(1.0).coef_, raw.solve(1.0).coef_, rtol=1e-9, atol=1e-12)
+        assert stored.solve(1.0).intercept_ == pytest.approx(raw.solve(1.0).intercept_, rel=1e-9, abs=1e-12)
+
+@pytest.mark.parametrize('factors', [
+    ['EVEBIT', 'EVEBITDA', 'MOMENTUM', 'PB', 'PE', 'PS'],
+    ['MOMENTUM', 'PB']
+])
+def test_weights_same_with_and_without_stats(db_url, factors):
+    # the weights endpoints give the same coefficients and weights whether
+    # or not factor_month_stats is there
+    with_stats = AlphaModel.get_weights_between_dates('2001-12-31', '2002-09-30', 12, 0.5, factors, PSQLDataBase(db_url))
+    raw_rows = AlphaModel.get_weights_between_dates('2001-12-31', '2002-09-30', 12, 0.5, factors, RawRowsDataBase(db_url))
+
+    assert [r.date for r in with_stats] == [r.date for r in raw_rows]
+    for a, b in zip(with_stats, raw_rows):
+        np.testing.assert_allclose(
+            [a.model_coef[f] for f in factors], [b.model_coef[f] for f in factors], rtol=1e-9, atol=1e-12
+        )
+        assert list(a.portfolio_weights) == list(b.portfolio_weights)
+        np.testing.assert_allclose(
+            list(a.portfolio_weights.values()), list(b.portfolio_weights.values()), rtol=1e-9, atol=1e-12
+        )
+
+def test_subset_stats_used_without_gaps(tmp_path):
+    # with no gaps at all, the table serves every subset of its factors
+    engine = create_engine(f"sqlite:///{tmp_path / 'complete.db'}")
+    make_portfolio_data(n_tickers=50, n_months=12, seed=3).to_sql('portfolio_data', engine, index=False)
+    build_factor_stats(engine)
+    db = PSQLDataBase(str(engine.url))
+    assert db.fetch_month_stats(START, '2000-12-31', ['PE', 'PB']) is not None
+
+    with engine.begin() as conn:
+        conn.execute(text("update portfolio_data set PS = null where rowid = 1"))
+    build_factor_stats(engine)
+    db.invalidate()
+    assert db.fetch_month_stats(START, '2000-12-31', ['PE', 'PB']) is None
+    assert db.fetch_month_stats(START, '2000-12-31', ['EVEBIT', 'EVEBITDA', 'MOMENTUM', 'PB', 'PE', 'PS']) is not None
+
+@pytest.mark.parametrize('database', [PSQLDataBase, RawRowsDataBase])
+def test_window_without_usable_rows_is_rejected(tmp_path, database):
+    # every training month has rows, but none with a target to fit on
+    data = make_portfolio_data(n_tickers=30, n_months=24, seed=7)
+    data.loc[pd.to_datetime(data['date']) <= pd.Timestamp('2001-03-31'), 't_plus_3_return'] = np.nan
+    engine = create_engine(f"sqlite:///{tmp_path / 'holes.db'}")
+    data.to_sql('portfolio_data', engine, index=False)
+    build_factor_stats(engine)
+    db = database(str(engine.url))
+
+    factors = ['PE', 'PB']
+    with pytest.raises(HTTPException) as e:
+        AlphaModel.get_weights_on_date('2001-05-31', 4, 0.5, factors, db)
+    assert e.value.status_code == 400 and 'no training data' in e.value.detail
+
+    with pytest.raises(HTTPException) as e:
+        AlphaModel.get_weights_between_dates('2001-05-31', '2001-08-31', 4, 0.5, factors, db)
+    assert e.value.status_code == 400 and 'no training data' in e.value.detail
@@ -0,0 +1,135 @@
+import time
+import pandas as pd
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from sqlalchemy import create_engine, text
+from benchmarks.synthetic import InMemoryDataBase, make_portfolio_data
+from classes.BoundsCache import BoundsCache, TableMetadata
+from classes.DataBase import PSQLDataBase
+from classes.PanelCache import PanelCache
+
+@pytest.fixture(scope='module')
+def data():
+    return make_portfolio_data(n_tickers=40, n_months=24, seed=4)
+
+class CountingLoader:
+    # serves date ranges out of a frame, remembering every range asked for
+    def __init__(self, data: pd.DataFrame):
+        self.data = data
+        self.calls = []
+
+    def __call__(self, start: date, end: date) -> pd.DataFrame:
+        self.calls.append((start, end))
+        return self.data[(self.data['date'] >= start) & (self.data['date'] <= end)]
+
+def expected(data: pd.DataFrame, start: date, end: date) -> pd.DataFrame:
+    rows = data[(data['date'] >= start) & (data['date'] <= end)]
+    return rows.sort_values('date', kind='stable').reset_index(drop=True)
+
+def test_gaps_are_fetched_and_merged(data):
+    cache = PanelCache(1 << 30)
+    loader = CountingLoader(data)
+
+    cache.fetch('portfolio_data', date(2000, 3, 1), date(2000, 6, 30), loader)
+    cache.fetch('portfolio_data', date(2000, 10, 1), date(2000, 12, 31), loader)
+    loader.calls.clear()
+
+    # a range over both segments only loads what lies around and between them
+    result = cache.fetch('portfolio_data', date(2000, 1, 1), date(2001, 3, 31), loader)
+    assert loader.calls == [
+        (date(2000, 1, 1), date(2000, 2, 29)),
+        (date(2000, 7, 1), date(2000, 9, 30)),
+        (date(2001, 1, 1), date(2001, 3, 31))
+    ]
+    pd.testing.assert_frame_equal(result, expected(data, date(2000, 1, 1), date(2001, 3, 31)))
+
+    stats = cache.get_stats()
+    assert (stats['misses'], stats['partial_hits'], stats['gap_fetches']) == (2, 1, 5)
+
+def test_covered_range_is_a_hit(data):
+    cache = PanelCache(1 << 30)
+    loader = CountingLoader(data)
+    cache.fetch('portfolio_data', date(2000, 1, 1), date(2000, 12, 31), loader)
+    loader.calls.clear()
+
+    result = cache.fetch('portfolio_data', date(2000, 4, 1), date(2000, 8, 31), loader)
+    assert loader.calls == []
+    assert cache.get_stats()['hits'] == 1
+    pd.testing.assert_frame_equal(result, expected(data, date(2000, 4, 1), date(2000, 8, 31)))
+
+def test_least_recently_used_segment_is_evicted(data):
+    loader = CountingLoader(data)
+    one_month = expected(data, date(2000, 1, 1), date(2000, 1, 31))
+    budget = int(one_month.memory_usage(index=True, deep=True).sum() * 2.5)
+    cache = PanelCache(budget)
+
+    for month in [1, 2, 3]:
+        start = date(2000, month, 1)
+        cache.fetch('portfolio_data', start, (start + pd.offsets.MonthEnd(0)).date(), loader)
+
+    stats = cache.get_stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] <= budget
+    assert [key[2] for key in cache.segments] == [date(2000, 2, 1), date(2000, 3, 1)]
+
+def test_segments_of_an_old_version_are_reloaded(data):
+    cache = PanelCache(1 << 30)
+    loader = CountingLoader(data)
+    cache.fetch('portfolio_data', date(2000, 1, 1), date(2000, 12, 31), loader, 'v1')
+    loader.calls.clear()
+
+    cache.fetch('portfolio_data', date(2000, 1, 1), date(2000, 12, 31), loader, 'v2')
+    assert loader.calls == [(date(2000, 1, 1), date(2000, 12, 31))]
+    assert cache.get_stats()['stale_drops'] == 1
+
+def test_database_serves_rows_after_the_table_changes(data, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'portfolio.db'}")
+    data.to_sql('portfolio_data', engine, index=False)
+    db = PSQLDataBase(str(engine.url), bounds_ttl=0)
+
+    before = db.fetch_between_dates('portfolio_data', '2000-01-31', '2000-12-31', None)
+    with engine.begin() as conn:
+        conn.execute(text('update portfolio_data set "return" = "return" + 1'))
+        conn.execute(text('delete from portfolio_data where rowid in (1, 2, 3)'))
+    after = db.fetch_between_dates('portfolio_data', '2000-01-31', '2000-12-31', None)
+
+    assert len(after) == len(before) - 3
+    pd.testing.assert_series_equal(
+        after['return'].reset_index(drop=True),
+        before['return'].iloc[3:].reset_index(drop=True) + 1
+    )
+
+def test_concurrent_metadata_misses_load_once(data):
+    calls = []
+    def loader(table: str) -> TableMetadata:
+        calls.append(table)
+        time.sleep(0.05)
+        return InMemoryDataBase({table: data}).table_metadata(table)
+
+    cache = BoundsCache(loader, ttl=60)
+    with ThreadPoolExecutor(8) as pool:
+        versions = list(pool.map(lambda _: cache.get('portfolio_data').version, range(8)))
+    assert calls == ['portfolio_data']
+    assert len(set(versions)) == 1
+
+def test_database_caches_only_the_columns_asked_for(data, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'portfolio.db'}")
+    data.to_sql('portfolio_data', engine, index=False)
+    db = PSQLDataBase(str(engine.url))
+
+    first = db.fetch_between_dates('portfolio_data', '2000-01-31', '2000-12-31', None, ['ticker', 'PE', 'PB'])
+    again = db.fetch_between_dates('portfolio_data', '2000-01-31', '2000-06-30', None, ['PB', 'ticker', 'PE'])
+    assert list(first.columns) == ['ticker', 'PE', 'PB']
+    assert list(again.columns) == ['PB', 'ticker', 'PE']
+    assert db.cache_stats()['hits'] == 1
+
+    # a segment holds the columns asked for and the date, nothing more
+    [(key, segment)] = db.panel_cache.segments.items()
+    assert key[1] == ('PB', 'PE', 'date', 'ticker')
+    assert sorted(segment.data.columns) == ['PB', 'PE', 'date', 'ticker']
+
+    # other columns are fetched (and cached) separately
+    whole = db.fetch_between_dates('portfolio_data', '2000-01-31', '2000-12-31', None)
+    assert list(whole.columns) == list(data.columns)
+    assert len(db.panel_cache.segments) == 2
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from sklearn.linear_model import Ridge
+from classes.RidgeSolver import RidgeStats, RollingRidge
+
+N_MONTHS, N_FACTORS = 24, 4
+
+@pytest.fixture(scope='module')
+def months():
+    # a small synthetic panel: a different number of tickers each month,
+    # factors on different scales and a target with some signal in it
+    rng = np.random.default_rng(0)
+    months = []
+    for _ in range(N_MONTHS):
+        n = int(rng.integers(20, 60))
+        X = rng.normal(size=(n, N_FACTORS)) * [1.0, 10.0, 0.1, 100.0] + [0.0, 5.0, -1.0, 50.0]
+        y = X @ [0.5, -0.02, 3.0, 0.001] + 0.3 + rng.normal(scale=0.5, size=n)
+        months.append((X, y))
+    return months
+
+def sklearn_fit(months, start, end):
+    X = np.vstack([X for X, _ in months[start:end + 1]])
+    y = np.concatenate([y for _, y in months[start:end + 1]])
+    return Ridge(alpha=1.0).fit(X, y)
+
+def assert_same_fit(fit, expected):
+    assert_allclose(fit.coef_, expected.coef_, rtol=1e-8, atol=1e-10)
+    assert_allclose(fit.intercept_, expected.intercept_, rtol=1e-8, atol=1e-10)
+
+def test_rolling_windows_match_sklearn(months):
+    month_stats = [RidgeStats.from_arrays(X, y) for X, y in months]
+    model = RollingRidge(month_stats, alpha=1.0)
+
+    # sliding forward adds and subtracts months, the jump and the shrinking
+    # window rebuild, and the last one grows the window backwards
+    windows = [(0, 11)] + [(s, s + 11) for s in range(1, 9)] + [(14, 20), (12, 18), (8, 18)]
+    for start, end in windows:
+        assert_same_fit(model.fit_window(start, end), sklearn_fit(months, start, end))
+
+def test_sums_add_and_subtract_match_sklearn(months):
+    # statistics from raw sums, as precomputed by the database, merged
+    # into a window and then with its first months taken off again
+    month_stats = [
+        RidgeStats.from_sums(len(y), X.sum(axis=0), y.sum(), X.T @ X, X.T @ y)
+        for X, y in months
+    ]
+    window = RidgeStats.empty(N_FACTORS)
+    for stats in month_stats:
+        window = window + stats
+    assert_same_fit(window.solve(1.0), sklearn_fit(months, 0, N_MONTHS - 1))
+
+    for m in range(6):
+        window = window - month_stats[m]
+    assert window.n == sum(len(y) for _, y in months[6:])
+    assert_same_fit(window.solve(1.0), sklearn_fit(months, 6, N_MONTHS - 1))
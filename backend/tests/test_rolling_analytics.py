@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+from numpy.testing import assert_allclose
+from classes.RollingAnalytics import METRICS, rolling_analytics, rolling_frame
+
+N_MONTHS = 60
+
+@pytest.fixture(scope='module')
+def returns():
+    # monthly passive returns and a portfolio loosely following them
+    rng = np.random.default_rng(1)
+    passive = rng.normal(0.006, 0.04, N_MONTHS)
+    portfolio = 0.002 + 1.2 * passive + rng.normal(0.0, 0.02, N_MONTHS)
+    return pd.Series(portfolio), pd.Series(passive)
+
+def pandas_analytics(p: pd.Series, b: pd.Series, window: int) -> dict[str, pd.Series]:
+    # the same metrics from pandas rolling jobs, one per statistic
+    active = p - b
+    beta = p.rolling(window).cov(b) / b.rolling(window).var()
+    tracking_error = active.rolling(window).std() * np.sqrt(12)
+    wealth = (1 + p).cumprod()
+    return {
+        'beta': beta,
+        'alpha': (p.rolling(window).mean() - beta * b.rolling(window).mean()) * 12,
+        'tracking_error': tracking_error,
+        'information_ratio': active.rolling(window).mean() * 12 / tracking_error,
+        'volatility': p.rolling(window).std() * np.sqrt(12),
+        'drawdown': wealth / wealth.cummax().clip(lower=1.0) - 1
+    }
+
+@pytest.mark.parametrize('window', [2, 12, 36])
+def test_metrics_match_pandas(returns, window):
+    p, b = returns
+    analytics = rolling_analytics(p.to_numpy(), b.to_numpy(), window)
+    expected = pandas_analytics(p, b, window)
+
+    assert list(analytics) == METRICS
+    for metric in METRICS:
+        assert_allclose(analytics[metric], expected[metric].to_numpy(), rtol=1e-9, atol=1e-12, err_msg=metric)
+
+def test_returns_far_from_zero_keep_their_precision(returns):
+    # beta and tracking error don't change when both series are shifted,
+    # but running sums of the raw values would lose most of their digits
+    # (pandas' own rolling cov is off in the fifth digit here)
+    p, b = returns
+    analytics = rolling_analytics(p.to_numpy() + 1e4, b.to_numpy() + 1e4, 12, ['beta', 'tracking_error'])
+    expected = pandas_analytics(p, b, 12)
+    for metric in ['beta', 'tracking_error']:
+        assert_allclose(analytics[metric], expected[metric].to_numpy(), rtol=1e-9, err_msg=metric)
+
+def test_frame_keeps_months_with_a_full_window(returns):
+    p, b = returns
+    dates = pd.date_range('2000-01-31', periods=N_MONTHS, freq='ME')
+    frame = rolling_frame(list(dates), rolling_analytics(p.to_numpy(), b.to_numpy(), 12, ['beta', 'drawdown']))
+
+    assert list(frame.columns) == ['date', 'beta', 'drawdown']
+    assert list(frame['date']) == list(dates[11:])
+    assert not frame.isna().any().any()
+
+@pytest.mark.parametrize('metrics, window', [(['beta', 'sharpe'], 12), (['beta'], 1)])
+def test_bad_requests_are_rejected(returns, metrics, window):
+    with pytest.raises(HTTPException) as error:
+        rolling_analytics(returns[0].to_numpy(), returns[1].to_numpy(), window, metrics)
+    assert error.value.status_code == 400
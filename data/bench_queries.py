@@ -0,0 +1,89 @@
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+import json
+import os
+import sys
+import numpy as np
+
+"""
+Script usage: python3 bench_queries.py [db url] [--repeats N]
+
+Times the queries the backend runs against portfolio_data, for typical
+backtest windows, once with the planner free to use the (date, ticker)
+index and once with index scans turned off (a sequential scan). Times are
+server side execution times from explain analyze, so they exclude sending
+the rows back. Prints one json line per query and plan.
+Without a db url it reads DB_URL from the .env in the project root.
+"""
+
+args = [a for a in sys.argv[1:] if not a.startswith('--')]
+repeats = int(sys.argv[sys.argv.index('--repeats') + 1]) if '--repeats' in sys.argv else 5
+if '--repeats' in sys.argv:
+    args.remove(str(repeats))
+
+if args:
+    db_url = args[0]
+else:
+    load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
+    db_url = os.getenv('DB_URL')
+
+psql = create_engine(db_url)
+
+SCAN_SETTINGS = ['enable_indexscan', 'enable_bitmapscan', 'enable_indexonlyscan']
+
+def plan_nodes(plan: dict) -> list[str]:
+    return [plan['Node Type']] + [n for child in plan.get('Plans', []) for n in plan_nodes(child)]
+
+def explain(conn, query: str, params: dict) -> tuple[float, str]:
+    result = conn.execute(text(f'explain (analyze, format json) {query}'), params).scalar()
+    result = result if isinstance(result, list) else json.loads(result)
+    nodes = plan_nodes(result[0]['Plan'])
+    scans = [n for n in nodes if 'Scan' in n]
+    return result[0]['Execution Time'], ', '.join(sorted(set(scans)))
+
+with psql.connect() as conn:
+    months = [r[0] for r in conn.execute(text('select distinct date from portfolio_data order by date'))]
+    tickers = [r[0] for r in conn.execute(text(
+        'select ticker from portfolio_data where date = :date order by ticker limit 20'
+    ), {'date': months[-1]})]
+
+    # windows ending at the latest month, like a backtest or weights request
+    queries = []
+    for n_months in [1, 12, 36, 120]:
+        if n_months > len(months):
+            continue
+        queries.append((
+            f'{n_months} months',
+            'select * from portfolio_data where date between :start_date and :end_date',
+            {'start_date': months[-n_months], 'end_date': months[-1]}
+        ))
+    queries.append((
+        f'36 months, {len(tickers)} tickers',
+        'select * from portfolio_data where date between :start_date and :end_date and ticker in :tickers',
+        {'start_date': months[-min(36, len(months))], 'end_date': months[-1], 'tickers': tuple(tickers)}
+    ))
+    queries.append(('date bounds', 'select min(date), max(date) from portfolio_data', {}))
+    queries.append(('rows per date', 'select date, count(*) as n from portfolio_data group by date', {}))
+
+    for name, query, params in queries:
+        for plan in ['index', 'scan']:
+            for setting in SCAN_SETTINGS:
+                conn.execute(text(f"set {setting} = {'on' if plan == 'index' else 'off'}"))
+
+            # first run warms the cache, the rest are timed
+            explain(conn, query, params)
+            times, nodes = [], ''
+            for _ in range(repeats):
+                elapsed, nodes = explain(conn, query, params)
+                times.append(elapsed)
+
+            print(json.dumps({
+                'query': name,
+                'plan': plan,
+                'nodes': nodes,
+                'median_ms': round(float(np.median(times)), 3),
+                'min_ms': round(float(np.min(times)), 3)
+            }))
+
+    for setting in SCAN_SETTINGS:
+        conn.execute(text(f'reset {setting}'))
@@ -0,0 +1,85 @@
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+import os
+import sys
+import time
+
+"""
+Script usage: python3 build_factor_stats.py [db url]
+
+Rebuilds factor_month_stats: for every month of portfolio_data, the row count
+and the sums, cross products and factor/target products of the model factors
+against t_plus_3_return. A ridge fit over any lookback window and any subset
+of factors is then just a sum of these small per-month rows, instead of a
+pull of every ticker row in the window.
+
+Run it after (re)loading portfolio_data. setup_databases.py runs it for you.
+Without a db url it reads DB_URL from the .env in the project root.
+"""
+
+FACTORS = ['EVEBIT', 'EVEBITDA', 'MOMENTUM', 'PB', 'PE', 'PS']
+TARGET = 't_plus_3_return'
+
+def stats_columns(factors: list[str] = FACTORS) -> dict[str, str]:
+    # column name -> expression summed per month. the backend reads the
+    # same names back (see PSQLDataBase.fetch_month_stats).
+    columns = {
+        'n': '1',
+        'sum_y': f'"{TARGET}"'
+    }
+    for i, a in enumerate(factors):
+        columns[f'sum_x_{a}'] = f'"{a}"'
+        columns[f'sum_xy_{a}'] = f'"{a}" * "{TARGET}"'
+        for b in factors[i:]:
+            columns[f'sum_xx_{a}_{b}'] = f'"{a}" * "{b}"'
+    return columns
+
+def build_factor_stats(psql, factors: list[str] = FACTORS) -> int:
+    # rows missing a factor or the target can't be used in a fit, so they
+    # are left out of the statistics. total_rows counts every row of the month,
+    # so the backend can tell when portfolio_data has changed underneath.
+    # target_rows counts the rows with a target: where n is short of it,
+    # some row was left out for a missing factor, and a fit on a subset of
+    # the factors (which would keep that row) can't use the statistics.
+    complete = ' and '.join(f'"{c}" is not null' for c in factors + [TARGET])
+    aggregates = ',\n        '.join(
+        f'coalesce(sum({expr}) filter (where {complete}), 0) as "{name}"'
+        for name, expr in stats_columns(factors).items()
+    )
+
+    query = f"""
+    create table factor_month_stats as
+    select
+        date,
+        count(*) as total_rows,
+        count("{TARGET}") as target_rows,
+        {aggregates}
+    from portfolio_data
+    group by date
+    order by date
+    """
+
+    with psql.begin() as conn:
+        conn.execute(text('drop table if exists factor_month_stats'))
+        conn.execute(text(query))
+        conn.execute(text('create unique index factor_month_stats_date on factor_month_stats (date)'))
+        return conn.execute(text('select count(*) from factor_month_stats')).scalar()
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        db_url = str(sys.argv[1])
+    else:
+        load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
+        db_url = os.getenv('DB_URL')
+
+    psql = create_engine(db_url)
+
+    start = time.perf_counter()
+    try:
+        months = build_factor_stats(psql)
+    except Exception as e:
+        print('PSQL: Building factor_month_stats failed ❌')
+        print(f'Exception: {e}')
+        exit(1)
+
+    print(f'PSQL: Built factor_month_stats for {months} months in {time.perf_counter() - start:.1f}s ✅')
@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+import io
+import os
+import sys
+import time
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from schema import key_ddl
+
+"""
+Script usage: python3 bulk_load.py <table name> <parquet file> [db url]
+
+Streams a parquet dump into an existing table with COPY, one row group batch
+at a time, so the dump never has to fit in memory. setup_databases.py uses
+load_tables to load every missing table at once, in parallel.
+Without a db url it reads DB_URL from the .env in the project root.
+"""
+
+def copy_parquet(psql, table: str, path: str, batch_rows: int = 250_000) -> int:
+    # each batch is written to csv by arrow and sent with COPY ... FROM STDIN,
+    # all in one transaction so a failed load leaves the table as it was
+    parquet = pq.ParquetFile(path)
+    columns = ', '.join(f'"{c}"' for c in parquet.schema_arrow.names)
+    copy = f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)'
+
+    rows = 0
+    conn = psql.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            for batch in parquet.iter_batches(batch_size=batch_rows):
+                buffer = io.BytesIO()
+                pa_csv.write_csv(batch, buffer)
+                buffer.seek(0)
+                cursor.copy_expert(copy, buffer)
+                rows += batch.num_rows
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return rows
+
+def build_indexes(psql, table: str) -> None:
+    # every table is looked up by date range and ticker, so they all get a
+    # (date, ticker) index once loaded (building it up front slows every
+    # insert). tables with a primary key get that instead, which also fails
+    # the load if the dump has duplicate rows
+    with psql.begin() as conn:
+        conn.execute(text(key_ddl(table)))
+        conn.execute(text(f'analyze {table}'))
+
+def load_tables(psql, dumps: dict[str, str], max_workers: int | None = None) -> dict[str, int]:
+    # dumps maps table name -> parquet file. tables are loaded in parallel,
+    # each over its own connection, and indexed once their rows are in.
+    def load(table: str, path: str) -> int:
+        start = time.perf_counter()
+        rows = copy_parquet(psql, table, path)
+        elapsed = time.perf_counter() - start
+        print(f'PSQL: Loaded {rows:,} rows into {table} in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s) ✅')
+
+        start = time.perf_counter()
+        build_indexes(psql, table)
+        print(f'PSQL: Indexed {table} in {time.perf_counter() - start:.1f}s ✅')
+        return rows
+
+    if not dumps:
+        return {}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers or len(dumps)) as pool:
+        futures = {table: pool.submit(load, table, path) for table, path in dumps.items()}
+        loaded = {table: future.result() for table, future in futures.items()}
+
+    total = sum(loaded.values())
+    elapsed = time.perf_counter() - start
+    print(f'PSQL: Loaded {total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s overall)')
+    return loaded
+
+if __name__ == '__main__':
+    table = str(sys.argv[1])
+    path = str(sys.argv[2])
+    if len(sys.argv) > 3:
+        db_url = str(sys.argv[3])
+    else:
+        load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
+        db_url = os.getenv('DB_URL')
+
+    try:
+        load_tables(create_engine(db_url), {table: path})
+    except Exception as e:
+        print(f'PSQL: Loading {table} failed ❌')
+        print(f'Exception: {e}')
+        exit(1)
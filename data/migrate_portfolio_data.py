@@ -0,0 +1,94 @@
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+import os
+import sys
+import time
+from schema import portfolio_data_ddl, key_ddl, create_month_partitions, is_partitioned
+
+"""
+Script usage: python3 migrate_portfolio_data.py [db url] [--partitioned] [--drop-old]
+
+Moves an existing portfolio_data table onto the current schema: not null
+date and ticker, a (date, ticker) primary key and, with --partitioned, monthly
+range partitions. The rows are copied into a new table, which is indexed and
+then swapped in under the portfolio_data name in one transaction, so the
+backend keeps reading the old table until the swap. The old table is kept as
+portfolio_data_old unless --drop-old is given.
+Without a db url it reads DB_URL from the .env in the project root.
+"""
+
+COLUMNS = [
+    'date', 'ticker', 'price', 'volume', 'EVEBIT', 'EVEBITDA', 'MOMENTUM', 'PB', 'PE', 'PS',
+    'sector', 'index_weight', 'index', 'return', 't_plus_3_return', 'estimated_vol'
+]
+
+args = [a for a in sys.argv[1:] if not a.startswith('--')]
+partitioned = '--partitioned' in sys.argv
+drop_old = '--drop-old' in sys.argv
+
+if args:
+    db_url = args[0]
+else:
+    load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
+    db_url = os.getenv('DB_URL')
+
+psql = create_engine(db_url)
+columns = ', '.join(f'"{c}"' for c in COLUMNS)
+
+try:
+    with psql.begin() as conn:
+        if partitioned and is_partitioned(conn, 'portfolio_data'):
+            print('PSQL: portfolio_data is already partitioned, nothing to do')
+            exit(0)
+
+        for table in ['portfolio_data_new', 'portfolio_data_old']:
+            if conn.execute(text('select to_regclass(:table)'), {'table': table}).scalar() is not None:
+                print(f'PSQL: {table} already exists, drop it before migrating ❌')
+                exit(1)
+
+        # rows without a date or ticker can't be looked up, and don't fit
+        # the new schema
+        null_keys = conn.execute(text(
+            'select count(*) from portfolio_data where date is null or ticker is null'
+        )).scalar()
+        if null_keys:
+            print(f'PSQL: Skipping {null_keys} rows without a date or ticker')
+
+        start = time.perf_counter()
+        conn.execute(text(portfolio_data_ddl('portfolio_data_new', partitioned)))
+        if partitioned:
+            bounds = conn.execute(text('select min(date), max(date) from portfolio_data')).one()
+            # partitions get their final names straight away, so nothing
+            # needs renaming after the swap
+            months = create_month_partitions(conn, 'portfolio_data_new', bounds[0], bounds[1], name='portfolio_data')
+            print(f'PSQL: Created {months} monthly partitions')
+
+        rows = conn.execute(text(
+            f'insert into portfolio_data_new ({columns}) '
+            f'select {columns} from portfolio_data where date is not null and ticker is not null'
+        )).rowcount
+        print(f'PSQL: Copied {rows:,} rows in {time.perf_counter() - start:.1f}s')
+
+        start = time.perf_counter()
+        conn.execute(text('alter index if exists portfolio_data_date_ticker rename to portfolio_data_old_date_ticker'))
+        conn.execute(text('alter index if exists portfolio_data_pkey rename to portfolio_data_old_pkey'))
+        conn.execute(text(key_ddl('portfolio_data_new', name='portfolio_data')))
+        print(f'PSQL: Indexed in {time.perf_counter() - start:.1f}s')
+
+        conn.execute(text('alter table portfolio_data rename to portfolio_data_old'))
+        conn.execute(text('alter table portfolio_data_new rename to portfolio_data'))
+        if drop_old:
+            conn.execute(text('drop table portfolio_data_old'))
+
+    with psql.begin() as conn:
+        conn.execute(text('analyze portfolio_data'))
+except Exception as e:
+    print('PSQL: Migrating portfolio_data failed, nothing was changed ❌')
+    print(f'Exception: {e}')
+    exit(1)
+
+print('PSQL: portfolio_data migrated ✅')
+if null_keys:
+    print('PSQL: Rows were dropped, rerun build_factor_stats.py so the model statistics match')
+if not drop_old:
+    print('PSQL: The previous table is kept as portfolio_data_old')
@@ -0,0 +1,76 @@
+import pandas as pd
+from sqlalchemy import text
+
+"""
+DDL shared by setup_databases.py and migrate_portfolio_data.py.
+
+portfolio_data is read by date range (and sometimes by ticker), so date and
+ticker are never null, and the table can optionally be range partitioned by
+month so a backtest window only touches the months it covers. It has one
+row per (date, ticker), which its primary key enforces; like the other
+tables' (date, ticker) indexes, the key is built once the rows are in, see
+bulk_load.py.
+"""
+
+# tables whose rows are unique per key. the others (factor scores and
+# constituents can hold several rows per date and ticker) only get an index
+PRIMARY_KEYS = {
+    'portfolio_data': ('date', 'ticker')
+}
+
+def portfolio_data_ddl(table: str = 'portfolio_data', partitioned: bool = False) -> str:
+    return f"""
+    CREATE TABLE {table} (
+        date date not null,
+        ticker text not null,
+        price double precision,
+        volume bigint,
+        "EVEBIT" double precision,
+        "EVEBITDA" double precision,
+        "MOMENTUM" double precision,
+        "PB" double precision,
+        "PE" double precision,
+        "PS" double precision,
+        sector text,
+        index_weight double precision,
+        index text,
+        return double precision,
+        t_plus_3_return double precision,
+        estimated_vol double precision
+    ){' PARTITION BY RANGE (date)' if partitioned else ''};
+    """
+
+def index_ddl(table: str, name: str | None = None) -> str:
+    return f'create index if not exists {name or table}_date_ticker on {table} (date, ticker)'
+
+def primary_key_ddl(table: str, name: str | None = None) -> str:
+    # on a partitioned table the key is added to the parent, which works as
+    # it includes the partition column, and every partition gets its index
+    name = name or table
+    columns = ', '.join(PRIMARY_KEYS[name])
+    return f'alter table {table} add constraint {name}_pkey primary key ({columns})'
+
+def key_ddl(table: str, name: str | None = None) -> str:
+    # the primary key's index serves (date, ticker) lookups as well, so a
+    # keyed table doesn't need the plain index too
+    if (name or table) in PRIMARY_KEYS:
+        return primary_key_ddl(table, name)
+    return index_ddl(table, name)
+
+def create_month_partitions(conn, table: str, start_date, end_date, name: str | None = None) -> int:
+    # one partition per calendar month covering [start_date, end_date], plus
+    # a default partition so rows outside that range still load
+    name = name or table
+    months = pd.period_range(pd.to_datetime(start_date), pd.to_datetime(end_date), freq='M')
+    for month in months:
+        conn.execute(text(
+            f"create table if not exists {name}_{month.strftime('y%Ym%m')} partition of {table} "
+            f"for values from ('{month.start_time.date()}') to ('{(month + 1).start_time.date()}')"
+        ))
+    conn.execute(text(f'create table if not exists {name}_default partition of {table} default'))
+    return len(months)
+
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(text(
+        "select exists (select from pg_partitioned_table where partrelid = cast(:table as regclass))"
+    ), {'table': table}).scalar()
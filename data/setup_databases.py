@@ -1,12 +1,18 @@
-import pandas as pd
-from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
 import os
 import sys
 from cycler import cycler
+from build_factor_stats import build_factor_stats
+from bulk_load import load_tables
+from schema import portfolio_data_ddl, create_month_partitions
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 """
-Script usage: python3 setup_sql_tables.py <username> <password> <host name> <port> <db name>
+Script usage: python3 setup_sql_tables.py <username> <password> <host name> <port> <db name> [--partitioned]
+
+With --partitioned, portfolio_data is range partitioned by month. Existing
+databases can be moved over with migrate_portfolio_data.py.
 
 Please run this script within the same directory.
 
@@ -20,6 +26,7 @@ password = str(sys.argv[2])
 hostname = str(sys.argv[3])
 port = int(sys.argv[4])
 dbname = str(sys.argv[5])
+partitioned = '--partitioned' in sys.argv[6:]
 
 # database url
 db_url = f'postgresql+psycopg2://{username}:{password}@{hostname}:{port}/{dbname}'
@@ -65,26 +72,7 @@ create table if not exists monthly_constituents (
 );
 """
 
-portfolio_data = """
-CREATE TABLE portfolio_data (
-    date date,
-    ticker text,
-    price double precision,
-    volume bigint,
-    "EVEBIT" double precision,
-    "EVEBITDA" double precision,
-    "MOMENTUM" double precision,
-    "PB" double precision,
-    "PE" double precision,
-    "PS" double precision,
-    sector text,
-    index_weight double precision,
-    index text,
-    return double precision,
-    t_plus_3_return double precision,
-    estimated_vol double precision
-);
-"""
+portfolio_data = portfolio_data_ddl(partitioned=partitioned)
 
 eom_prices_exists = False
 factor_scores_exists = False
@@ -100,7 +88,7 @@ try:
     );
     """
 
-    with psql.connect() as conn:
+    with psql.begin() as conn:
         for table in ["eom_prices", "factor_scores", "monthly_constituents", "portfolio_data"]:
             exists = conn.execute(text(check_table), {"table_name": table}).scalar()
             if exists:
@@ -118,27 +106,46 @@ try:
                     conn.execute(text(monthly_constituents))
                 elif table == 'portfolio_data':
                     conn.execute(text(portfolio_data))
+                    # partitions have to exist before rows can go in, so
+                    # cover every month in the dump
+                    if partitioned and os.path.exists('./dump/portfolio_data.parquet'):
+                        dates = pq.read_table('./dump/portfolio_data.parquet', columns=['date'])['date']
+                        bounds = pc.min_max(dates).as_py()
+                        months = create_month_partitions(conn, 'portfolio_data', bounds['min'], bounds['max'])
+                        print(f"PSQL: Created {months} monthly partitions for 'portfolio_data'")
 except Exception as e:
     print('PSQL: Table creation failed ❌')
     print(f'Exception: {e}')
     exit(1)
 
-# now we read in the dumps, and store them into the tables
-if not eom_prices_exists:
-    prices_data = pd.read_parquet('./dump/eom_prices.parquet')
-    prices_data.to_sql('eom_prices', psql, if_exists='append', index=False)
+# now we stream the dumps into the tables with COPY, all tables at once,
+# and index them after their rows are in
+dumps = {
+    table: f'./dump/{table}.parquet'
+    for table, exists in [
+        ('eom_prices', eom_prices_exists),
+        ('factor_scores', factor_scores_exists),
+        ('monthly_constituents', monthly_constituents_exists),
+        ('portfolio_data', portfolio_data_exists)
+    ]
+    if not exists
+}
 
-if not factor_scores_exists:
-    factor_data = pd.read_parquet('./dump/factor_scores.parquet')
-    factor_data.to_sql('factor_scores', psql, if_exists='append', index=False)
-
-if not monthly_constituents_exists:
-    constituents_data = pd.read_parquet('./dump/monthly_constituents.parquet')
-    constituents_data.to_sql('monthly_constituents', psql, if_exists='append', index=False)
+try:
+    load_tables(psql, dumps)
+except Exception as e:
+    print('PSQL: Loading the dumps failed ❌')
+    print(f'Exception: {e}')
+    exit(1)
 
-if not portfolio_data_exists:
-    portfolio_data_df = pd.read_parquet('./dump/portfolio_data.parquet')
-    portfolio_data_df.to_sql('portfolio_data', psql, if_exists='append', index=False)
+# precompute the per-month factor statistics the backend fits models from.
+# they are derived from portfolio_data, so rebuild them on every run.
+try:
+    months = build_factor_stats(psql)
+    print(f'PSQL: Built factor_month_stats for {months} months ✅')
+except Exception as e:
+    print('PSQL: Building factor_month_stats failed, models will fit from raw rows ❌')
+    print(f'Exception: {e}')
 
 # finally, write to .env in the project root folder
 # i assume you are running this from within the directory that
@@ -152,4 +159,5 @@ try:
     print('.env: Saved DB_URL to .env. Make sure to not commit to your repo! ✅')
 except Exception as e:
     print(f'Error: could not write .env file in project root folder ❌')
-    print(f'Exception: {e}')
\ No newline at end of file
+    print(f'Exception: {e}')
+